@@ -0,0 +1,180 @@
+"""
+Lockstep batch emulator
+
+Runs one ROM on N machines at once, every machine (lane) has its own A, D, PC and RAM held as
+NumPy arrays and all lanes that sit on the same instruction execute it with one vectorized
+operation. When lanes branch differently they are grouped by PC and each group runs masked, so
+every lane ends in exactly the state the scalar emulator.Computer would reach from the same
+initial RAM.
+
+usage: python batch.py --rom Max.hack --lanes 10000 --random 0 1 [--ram-size 1024]
+
+Every lane has the full 32K RAM by default, --ram-size trades RAM the program does not touch
+for more lanes, a program that reaches past it stops with an error.
+"""
+import argparse
+import time
+from array import array
+
+import numpy as np
+
+import emulator
+
+# vectorized ALU for the documented comp bit patterns, arrays are uint16 so arithmetic wraps
+NP_ALU = {
+    0b101010: lambda d, y: np.zeros_like(d),
+    0b111111: lambda d, y: np.ones_like(d),
+    0b111010: lambda d, y: np.full_like(d, 0xFFFF),
+    0b001100: lambda d, y: d.copy(),
+    0b110000: lambda d, y: y.copy(),
+    0b001101: lambda d, y: ~d,
+    0b110001: lambda d, y: ~y,
+    0b001111: lambda d, y: -d,
+    0b110011: lambda d, y: -y,
+    0b011111: lambda d, y: d + 1,
+    0b110111: lambda d, y: y + 1,
+    0b001110: lambda d, y: d - 1,
+    0b110010: lambda d, y: y - 1,
+    0b000010: lambda d, y: d + y,
+    0b010011: lambda d, y: d - y,
+    0b000111: lambda d, y: y - d,
+    0b000000: lambda d, y: d & y,
+    0b010101: lambda d, y: d | y,
+}
+
+
+def _np_alu(comp: int):
+    """the general Hack ALU for comp bit patterns that are not in NP_ALU"""
+    zx, nx, zy, ny, f, no = [(comp >> i) & 1 for i in range(5, -1, -1)]
+
+    def alu(d, y):
+        x = np.zeros_like(d) if zx else d
+        x = ~x if nx else x
+        y = np.zeros_like(y) if zy else y
+        y = ~y if ny else y
+        out = x + y if f else x & y
+        return ~out if no else out
+
+    return alu
+
+
+class BatchComputer:
+    def __init__(self, rom, lanes: int, ram_size: int = emulator.RAM_SIZE):
+        # reuse the scalar emulator for loading, decoding and halt detection
+        self.scalar = emulator.Computer(rom)
+        self.code = [op if op.__class__ is int else (self._alu(w), op[1], op[2], op[3])
+                     for op, w in zip(self.scalar.code, self.scalar.rom)]
+        self.halts = self.scalar.halts
+        self.lanes = lanes
+        self.ram = np.zeros((lanes, ram_size), dtype=np.uint16)
+        self.reset()
+
+    @staticmethod
+    def _alu(word: int):
+        comp = (word >> 6) & 0x3F
+        return NP_ALU.get(comp) or _np_alu(comp)
+
+    def reset(self):
+        self.a = np.zeros(self.lanes, dtype=np.uint16)
+        self.d = np.zeros(self.lanes, dtype=np.uint16)
+        self.pc = np.zeros(self.lanes, dtype=np.int64)
+        self.cycles = np.zeros(self.lanes, dtype=np.int64)
+        self.halted = np.zeros(self.lanes, dtype=bool)
+
+    def run(self, limit: int) -> int:
+        """
+        runs every lane for up to limit instructions, lanes stop when they reach their halt loop
+        returns the number of lockstep steps taken
+        """
+        steps = 0
+        while steps < limit:
+            active = np.flatnonzero(~self.halted)
+            if not len(active):
+                break
+            pcs = self.pc[active]
+            first = int(pcs[0])
+            if (pcs == first).all():
+                self._execute(first, active)
+            else:
+                # lanes diverged, run each group of lanes that share a pc
+                for p in np.unique(pcs):
+                    self._execute(int(p), active[pcs == p])
+            steps += 1
+        return steps
+
+    def _execute(self, pc: int, lanes: np.ndarray):
+        op = self.code[pc]
+        self.cycles[lanes] += 1
+        if op.__class__ is int:
+            self.a[lanes] = op
+            self.pc[lanes] = pc + 1
+            return
+        alu, dest, jump, m = op
+        a = self.a[lanes]
+        d = self.d[lanes]
+        if (m or dest & 1) and a.max() >= self.ram.shape[1]:
+            raise Exception(f"RAM address out of range - {a.max()} at PC {pc}")
+        r = alu(d, self.ram[lanes, a] if m else a)
+        if dest & 1:
+            self.ram[lanes, a] = r
+        if dest & 2:
+            self.d[lanes] = r
+        if dest & 4:
+            self.a[lanes] = r
+        if not jump:
+            self.pc[lanes] = pc + 1
+            return
+        if jump == 0b111:
+            taken = np.ones(len(lanes), dtype=bool)
+        else:
+            s = r.view(np.int16)
+            taken = np.zeros(len(lanes), dtype=bool)
+            if jump & 4:
+                taken |= s < 0
+            if jump & 2:
+                taken |= s == 0
+            if jump & 1:
+                taken |= s > 0
+        self.pc[lanes] = np.where(taken, a, pc + 1)
+        if pc in self.halts:
+            self.halted[lanes] |= taken & (a == pc - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rom", action="store", required=True)
+    parser.add_argument("--lanes", action="store", type=int, default=10_000)
+    parser.add_argument("--random", nargs="*", type=int, default=[], metavar="ADDR",
+                        help="RAM addresses to fill with a random value per lane")
+    parser.add_argument("--ram-size", action="store", type=int, default=emulator.RAM_SIZE,
+                        help="RAM words per lane, the program may not use any address past it")
+    parser.add_argument("--cycles", action="store", type=int, default=100_000)
+    parser.add_argument("--check", action="store", type=int, default=100,
+                        help="compare this many lanes against the scalar emulator")
+    args = parser.parse_args()
+
+    rom = emulator.load_rom(args.rom)
+    batch = BatchComputer(rom, args.lanes, args.ram_size)
+    rng = np.random.default_rng(0)
+    for addr in args.random:
+        batch.ram[:, addr] = rng.integers(0, 0x8000, args.lanes, dtype=np.uint16)
+    initial = batch.ram.copy()
+
+    start = time.perf_counter()
+    steps = batch.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    total = int(batch.cycles.sum())
+    print(f"{args.lanes} lanes, {steps} steps, {total:,} instructions in {elapsed:.3f}s")
+    print(f"{total / elapsed:,.0f} instances x instructions/sec")
+
+    for lane in range(min(args.check, args.lanes)):
+        computer = emulator.Computer(rom)
+        computer.ram[: args.ram_size] = array("H", initial[lane].tobytes())
+        computer.run(args.cycles)
+        assert computer.ram[: args.ram_size].tobytes() == batch.ram[lane].tobytes(), f"lane {lane} diverged"
+        assert (computer.a, computer.d, computer.pc) == (batch.a[lane], batch.d[lane], batch.pc[lane])
+    print(f"{min(args.check, args.lanes)} lanes match the scalar emulator")
+
+
+if __name__ == "__main__":
+    main()
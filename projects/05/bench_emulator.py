@@ -0,0 +1,42 @@
+"""
+Compares the plain interpreter against the basic block engine on the translated Pong program
+(projects/06/pong/Pong.asm), both machines run the same number of instructions and have to end
+in the same state. The absolute rates depend on the machine and the Python version, both are
+printed with them
+
+usage: python bench_emulator.py [--asm ../06/pong/Pong.asm] [--cycles 5000000]
+"""
+import argparse
+import os
+import platform
+import time
+
+import blocks
+import emulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--asm", action="store", default=os.path.join(HERE, "..", "06", "pong", "Pong.asm"))
+    parser.add_argument("--cycles", action="store", type=int, default=5_000_000)
+    args = parser.parse_args()
+    rom = emulator._assemble(args.asm)
+    print(f"python {platform.python_version()} on {platform.machine()}, {os.cpu_count()} cpus")
+
+    results = []
+    for cls in (emulator.Computer, blocks.BlockComputer, blocks.BlockComputer):
+        computer = cls(rom)
+        start = time.perf_counter()
+        computer.run(args.cycles)
+        elapsed = time.perf_counter() - start
+        results.append((computer, elapsed))
+        print(f"{cls.__name__:>14}: {elapsed:.3f}s {args.cycles / elapsed:>12,.0f} instructions/sec")
+    (base, base_time), (_, cold), (warm, warm_time) = results
+    assert (base.a, base.d, base.pc, base.ram) == (warm.a, warm.d, warm.pc, warm.ram), "block engine diverged"
+    print(f"speedup {base_time / cold:.2f}x (compiling blocks), {base_time / warm_time:.2f}x (cached blocks)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Basic block execution engine for the Hack CPU emulator
+
+The ROM is split into basic blocks (straight-line runs of instructions that end at a jump or
+right before a jump target) and every block is compiled into one generated Python function that
+updates A, D and RAM without going through the fetch/decode/dispatch loop. Blocks are compiled
+the first time they are entered and cached by ROM hash, so loading the same program again reuses
+them.
+
+Jumps whose target is computed at runtime (A loaded from RAM, like the return of a VM function)
+can land in the middle of what was compiled as a block, those addresses are run by the plain
+interpreter until execution reaches the start of a block again.
+"""
+import hashlib
+import sys
+
+import emulator
+
+# python expression for each documented comp bit pattern, {y} is A or ram[a]
+EXPRESSIONS = {
+    0b101010: "0",
+    0b111111: "1",
+    0b111010: "65535",
+    0b001100: "d",
+    0b110000: "{y}",
+    0b001101: "d ^ 65535",
+    0b110001: "{y} ^ 65535",
+    0b001111: "-d & 65535",
+    0b110011: "-{y} & 65535",
+    0b011111: "(d + 1) & 65535",
+    0b110111: "({y} + 1) & 65535",
+    0b001110: "(d - 1) & 65535",
+    0b110010: "({y} - 1) & 65535",
+    0b000010: "(d + {y}) & 65535",
+    0b010011: "(d - {y}) & 65535",
+    0b000111: "({y} - d) & 65535",
+    0b000000: "d & {y}",
+    0b010101: "d | {y}",
+}
+# condition on the ALU output r for each jump (lt eq gt bits)
+CONDITIONS = {
+    0b001: "0 < r < 32768",
+    0b010: "r == 0",
+    0b011: "r < 32768",
+    0b100: "r >= 32768",
+    0b101: "r != 0",
+    0b110: "r == 0 or r >= 32768",
+    0b111: "True",
+}
+
+# compiled blocks of every ROM seen so far, rom hash -> {address: (function, length, halts)}
+_CACHE = {}
+
+
+class BlockComputer(emulator.Computer):
+    def load(self, rom):
+        super().load(rom)
+        self.leaders = self._leaders()
+        key = hashlib.sha256(self.rom.tobytes()).hexdigest()
+        self.blocks = _CACHE.setdefault(key, {})
+
+    def _leaders(self) -> set[int]:
+        """
+        addresses a block has to start at: 0, the targets of jumps whose target is a constant
+        and the instruction after every jump
+        """
+        leaders = {0}
+        code = self.code
+        for pc, op in enumerate(code):
+            if op.__class__ is tuple and op[2]:
+                leaders.add(pc + 1)
+                if pc and code[pc - 1].__class__ is int:
+                    leaders.add(code[pc - 1])
+        return leaders
+
+    def run(self, limit: int = None) -> int:
+        limit = sys.maxsize if limit is None else limit
+        blocks, leaders, ram = self.blocks, self.leaders, self.ram
+        a, d, pc = self.a, self.d, self.pc
+        n = 0
+        # instructions run by compiled blocks, the interpreter adds its own to self.cycles
+        compiled = 0
+        self.halted = False
+        while n < limit:
+            block = blocks.get(pc)
+            if block is None and pc in leaders:
+                block = blocks[pc] = self._compile(pc)
+            if block is None or n + block[1] > limit:
+                # computed jump into the middle of a block or not enough cycles left for the
+                # whole block, interpret up to the next leader
+                self.a, self.d, self.pc = a, d, pc
+                n += emulator.Computer.run(self, 1)
+                while n < limit and self.pc not in leaders and not self.halted:
+                    n += emulator.Computer.run(self, 1)
+                a, d, pc = self.a, self.d, self.pc
+                if self.halted:
+                    break
+                continue
+            fn, length, halts = block
+            a, d, pc = fn(ram, a, d)
+            n += length
+            compiled += length
+            if halts:
+                self.halted = True
+                break
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += compiled
+        return n
+
+    def _compile(self, start: int) -> tuple:
+        """
+        generates the python function for the block starting at start
+        """
+        code, rom = self.code, self.rom
+        lines = ["def block(ram, a, d):"]
+        namespace = {}
+        pc = start
+        halts = False
+        while True:
+            op = code[pc]
+            if op.__class__ is int:
+                lines.append(f"    a = {op}")
+            else:
+                alu, dest, jump, m = op
+                comp = (rom[pc] >> 6) & 0x3F
+                y = "ram[a]" if m else "a"
+                if comp in EXPRESSIONS:
+                    expr = EXPRESSIONS[comp].format(y=y)
+                else:
+                    namespace[f"alu{pc}"] = alu
+                    expr = f"alu{pc}(d, {y})"
+                if jump:
+                    lines.append(f"    r = {expr}")
+                    lines.append("    t = a")
+                    lines += self._stores(dest, "r")
+                    if jump == 0b111:
+                        lines.append("    return a, d, t")
+                        halts = pc in self.halts and start <= pc - 1 and code[pc - 1] == pc - 1
+                    else:
+                        lines.append(f"    if {CONDITIONS[jump]}:")
+                        lines.append("        return a, d, t")
+                        lines.append(f"    return a, d, {pc + 1}")
+                    pc += 1
+                    break
+                if dest in (1, 2, 4):
+                    lines += self._stores(dest, expr)
+                elif dest:
+                    lines.append(f"    r = {expr}")
+                    lines += self._stores(dest, "r")
+            pc += 1
+            if pc >= emulator.ROM_SIZE or pc in self.leaders:
+                lines.append(f"    return a, d, {pc}")
+                break
+        exec("\n".join(lines), namespace)
+        return namespace["block"], pc - start, halts
+
+    @staticmethod
+    def _stores(dest: int, value: str) -> list[str]:
+        # M is written through the old A, so it goes first
+        stores = []
+        if dest & 1:
+            stores.append(f"    ram[a] = {value}")
+        if dest & 2:
+            stores.append(f"    d = {value}")
+        if dest & 4:
+            stores.append(f"    a = {value}")
+        return stores
@@ -0,0 +1,344 @@
+"""
+Hack CPU emulator
+
+Runs assembled .hack ROMs (or raw binary images written by assembler.py --format bin) without
+the Java CPUEmulator. RAM and ROM are 32K arrays of unsigned 16 bit words, every ROM word is
+decoded once when the program is loaded so the main loop only has to dispatch on the
+predecoded instructions.
+
+It can also run the .tst scripts that drive the Computer chip (projects/05/Computer*.tst) or
+the CPU emulator (projects/07, projects/08) and compare their output to the .cmp files.
+
+usage: python emulator.py --rom Max.hack [--cycles N] [--set 0=3 1=5]
+       python emulator.py --tst ComputerMax.tst
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import typing
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "06"))
+from assembler import load_rom  # noqa: E402
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+# ALU output for each of the documented comp bit patterns (c1..c6), y is A or M depending on the a-bit
+ALU = {
+    0b101010: lambda d, y: 0,
+    0b111111: lambda d, y: 1,
+    0b111010: lambda d, y: 0xFFFF,
+    0b001100: lambda d, y: d,
+    0b110000: lambda d, y: y,
+    0b001101: lambda d, y: d ^ 0xFFFF,
+    0b110001: lambda d, y: y ^ 0xFFFF,
+    0b001111: lambda d, y: -d & 0xFFFF,
+    0b110011: lambda d, y: -y & 0xFFFF,
+    0b011111: lambda d, y: (d + 1) & 0xFFFF,
+    0b110111: lambda d, y: (y + 1) & 0xFFFF,
+    0b001110: lambda d, y: (d - 1) & 0xFFFF,
+    0b110010: lambda d, y: (y - 1) & 0xFFFF,
+    0b000010: lambda d, y: (d + y) & 0xFFFF,
+    0b010011: lambda d, y: (d - y) & 0xFFFF,
+    0b000111: lambda d, y: (y - d) & 0xFFFF,
+    0b000000: lambda d, y: d & y,
+    0b010101: lambda d, y: d | y,
+}
+
+
+def _alu(comp: int) -> typing.Callable[[int, int], int]:
+    """the general Hack ALU for comp bit patterns that are not in ALU"""
+    zx, nx, zy, ny, f, no = [(comp >> i) & 1 for i in range(5, -1, -1)]
+
+    def alu(d, y):
+        x = 0 if zx else d
+        x = x ^ 0xFFFF if nx else x
+        y = 0 if zy else y
+        y = y ^ 0xFFFF if ny else y
+        out = (x + y) & 0xFFFF if f else x & y
+        return out ^ 0xFFFF if no else out
+
+    return alu
+
+
+def decode(word: int) -> int | tuple:
+    """
+    A instructions decode to their value, C instructions to a (alu, dest, jump, reads_m) tuple
+    dest and jump keep the instruction bits (dest: A=4 D=2 M=1, jump: lt=4 eq=2 gt=1)
+    """
+    if not word & 0x8000:
+        return word
+    comp = (word >> 6) & 0x3F
+    return (ALU.get(comp) or _alu(comp), (word >> 3) & 0b111, word & 0b111, bool(word & 0x1000))
+
+
+def to_signed(value: int) -> int:
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class Computer:
+    def __init__(self, rom: typing.Iterable[int] = ()):
+        self.ram = array("H", bytes(2 * RAM_SIZE))
+        self.load(rom)
+
+    def load(self, rom: typing.Iterable[int]):
+        """
+        loads and predecodes a program, the rest of the ROM is zero (@0) like on the real machine
+        """
+        self.rom = array("H", rom)
+        if len(self.rom) > ROM_SIZE:
+            raise Exception(f"Program too large - {len(self.rom)} words")
+        self.rom.extend(array("H", bytes(2 * (ROM_SIZE - len(self.rom)))))
+        self.code = [decode(w) for w in self.rom]
+        # the `(END) @END 0;JMP` idiom: a 0;JMP right after an A instruction loading its own address
+        jmp = 0b1110101010000111
+        self.halts = frozenset(p + 1 for p in range(ROM_SIZE - 1) if self.rom[p] == p and self.rom[p + 1] == jmp)
+        self.reset()
+
+    def reset(self):
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def step(self):
+        self.run(1)
+
+    def run(self, limit: int = None) -> int:
+        """
+        executes up to limit instructions (forever if None), stops early when the program reaches
+        its halt loop. returns the number of instructions executed
+        """
+        code, ram, halts = self.code, self.ram, self.halts
+        a, d, pc = self.a, self.d, self.pc
+        n = 0
+        limit = sys.maxsize if limit is None else limit
+        halted = False
+        while n < limit:
+            op = code[pc]
+            n += 1
+            if op.__class__ is int:
+                a = op
+                pc += 1
+                continue
+            alu, dest, jump, m = op
+            r = alu(d, ram[a] if m else a)
+            target = a
+            if dest:
+                if dest & 1:
+                    ram[a] = r
+                if dest & 2:
+                    d = r
+                if dest & 4:
+                    a = r
+            if jump and jump & (4 if r & 0x8000 else 2 if r == 0 else 1):
+                if target == pc - 1 and pc in halts:
+                    pc = target
+                    halted = True
+                    break
+                pc = target
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += n
+        self.halted = halted
+        return n
+
+
+class TestScript:
+    """
+    runs the subset of the nand2tetris test script language used by the Computer*.tst and the
+    CPU emulator scripts: load, output-file, compare-to, output-list, set, tick, tock, ticktock,
+    output, echo and repeat blocks
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dir = os.path.dirname(os.path.abspath(path))
+        self.computer = Computer()
+        self.time = 0
+        self.half = False
+        self.reset_pin = 0
+        self.columns = []
+        self.output = []
+        self.compare_to = None
+
+    def run(self) -> list[str]:
+        with open(self.path, "r") as f:
+            source = re.sub(r"//[^\n]*|/\*.*?\*/", "", f.read(), flags=re.S)
+        tokens = re.findall(r'"[^"]*"|[{},;!]|[^\s{},;!]+', source)
+        self._block(tokens, 0)
+        return self.output
+
+    def compare(self) -> list[str]:
+        """
+        runs the script and returns the lines that differ from the compare-to file
+        """
+        output = self.run()
+        with open(os.path.join(self.dir, self.compare_to), "r") as f:
+            expected = [line.rstrip("\n") for line in f]
+        diffs = [f"line {i + 1}: got {o!r} expected {e!r}" for i, (o, e) in enumerate(zip(output, expected)) if o != e]
+        if len(output) != len(expected):
+            diffs.append(f"got {len(output)} lines expected {len(expected)}")
+        return diffs
+
+    def _block(self, tokens: list[str], i: int) -> int:
+        command = []
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if token == "repeat":
+                count = int(tokens[i])
+                start = i + 2  # skip the count and {
+                for _ in range(count):
+                    self._block(tokens, start)
+                depth = 1
+                i = start
+                while depth:
+                    depth += {"{": 1, "}": -1}.get(tokens[i], 0)
+                    i += 1
+            elif token == "}":
+                return i
+            elif token in ",;!":
+                if command:
+                    self._command(command)
+                command = []
+            else:
+                command.append(token)
+        if command:
+            self._command(command)
+        return i
+
+    def _command(self, command: list[str]):
+        name, args = command[0], command[1:]
+        if name == "load":
+            if args[0].endswith(".hack"):
+                self.computer.load(load_rom(os.path.join(self.dir, args[0])))
+            elif args[0].endswith(".asm"):
+                self.computer.load(_assemble(os.path.join(self.dir, args[0])))
+        elif name == "ROM32K":
+            self.computer.load(load_rom(os.path.join(self.dir, args[1])))
+        elif name == "compare-to":
+            self.compare_to = args[0]
+        elif name == "output-list":
+            self.columns = [self._column(c) for c in args]
+            self.output.append("|" + "|".join(self._header(*c) for c in self.columns) + "|")
+        elif name == "output":
+            self.output.append("|" + "|".join(self._format(*c) for c in self.columns) + "|")
+        elif name == "set":
+            self._set(args[0], int(args[1]))
+        elif name == "tick":
+            self.half = True
+        elif name == "tock":
+            self._cycle()
+        elif name == "ticktock":
+            self._cycle()
+        # output-file and echo have no effect here
+
+    def _cycle(self):
+        self.computer.step()
+        if self.reset_pin:
+            self.computer.pc = 0
+        self.half = False
+        self.time += 1
+
+    @staticmethod
+    def _column(spec: str) -> tuple:
+        name, fmt = spec.split("%")
+        left, width, right = (int(x) for x in fmt[1:].split("."))
+        return name, fmt[0], left, width, right
+
+    @staticmethod
+    def _header(name: str, fmt: str, left: int, width: int, right: int) -> str:
+        total = left + width + right
+        name = name[:total]
+        pad = (total - len(name)) // 2
+        return " " * pad + name + " " * (total - len(name) - pad)
+
+    def _format(self, name: str, fmt: str, left: int, width: int, right: int) -> str:
+        value = self._get(name)
+        if fmt == "S":
+            text = str(value).ljust(width)
+        elif fmt == "B":
+            text = format(value & 0xFFFF, "016b")[-width:]
+        else:
+            text = str(to_signed(value)).rjust(width)
+        return " " * left + text + " " * right
+
+    def _get(self, name: str):
+        c = self.computer
+        base = name.split("[")[0]
+        if base == "time":
+            return f"{self.time}+" if self.half else str(self.time)
+        if base == "reset":
+            return self.reset_pin
+        if base in ("ARegister", "A"):
+            return c.a
+        if base in ("DRegister", "D"):
+            return c.d
+        if base == "PC":
+            return c.pc
+        if base in ("RAM16K", "RAM"):
+            return c.ram[int(name.split("[")[1][:-1])]
+        raise Exception(f"Unknown output variable - {name}")
+
+    def _set(self, name: str, value: int):
+        c = self.computer
+        base = name.split("[")[0]
+        if base == "reset":
+            self.reset_pin = value
+        elif base in ("ARegister", "A"):
+            c.a = value & 0xFFFF
+        elif base in ("DRegister", "D"):
+            c.d = value & 0xFFFF
+        elif base == "PC":
+            c.pc = value
+        elif base in ("RAM16K", "RAM"):
+            c.ram[int(name.split("[")[1][:-1])] = value & 0xFFFF
+        else:
+            raise Exception(f"Unknown variable - {name}")
+
+
+def _assemble(path: str) -> array:
+    "assembles a .asm file with the project 06 assembler"
+    import assembler
+
+    with open(path, "r") as f:
+        asm = assembler.Assembler(f, assembler.SymbolTable())
+        asm.preprocess()
+        return asm.encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rom", action="store", help=".hack or binary ROM image to run")
+    parser.add_argument("--tst", action="store", help="test script to run and compare")
+    parser.add_argument("--cycles", action="store", type=int, help="stop after N instructions")
+    parser.add_argument("--set", nargs="*", default=[], metavar="ADDR=VALUE", help="initial RAM values")
+    parser.add_argument("--dump", nargs="*", type=int, default=[0, 1, 2], metavar="ADDR", help="RAM to print when done")
+    args = parser.parse_args()
+    if args.tst:
+        diffs = TestScript(args.tst).compare()
+        print("\n".join(diffs) if diffs else "comparison ended successfully")
+        sys.exit(1 if diffs else 0)
+    computer = Computer(load_rom(args.rom))
+    for s in args.set:
+        addr, value = s.split("=")
+        computer.ram[int(addr)] = int(value) & 0xFFFF
+    start = time.perf_counter()
+    n = computer.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    state = "halted" if computer.halted else "stopped"
+    print(f"{state} after {n} instructions in {elapsed:.3f}s ({n / elapsed:,.0f} instructions/sec)")
+    for addr in args.dump:
+        print(f"RAM[{addr}] = {to_signed(computer.ram[addr])}")
+
+
+if __name__ == "__main__":
+    main()
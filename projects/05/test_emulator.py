@@ -0,0 +1,95 @@
+import os
+from array import array
+import pytest
+import blocks
+import emulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestComputer:
+    def test_wraparound(self):
+        # @32767 D=A D=D+1 @0 M=D M=M-D M=M-1
+        rom = [32767, 0b1110110000010000, 0b1110011111010000, 0, 0b1110001100001000, 0b1111000111001000, 0b1111110010001000]
+        computer = emulator.Computer(rom)
+        computer.run(5)
+        assert computer.ram[0] == 0x8000
+        assert emulator.to_signed(computer.ram[0]) == -32768
+        computer.run(2)
+        assert computer.ram[0] == 0xFFFF
+
+    def test_halt(self):
+        computer = emulator.Computer(emulator.load_rom(os.path.join(HERE, "Max.hack")))
+        computer.ram[0] = 23456
+        computer.ram[1] = 12345
+        n = computer.run(1000)
+        assert computer.halted
+        assert n < 20
+        assert computer.ram[2] == 23456
+
+
+class TestScripts:
+    def test_computer_scripts(self):
+        for name in ["ComputerAdd.tst", "ComputerMax.tst", "ComputerRect.tst"]:
+            assert emulator.TestScript(os.path.join(HERE, name)).compare() == []
+
+
+class TestBlocks:
+    def test_matches_interpreter(self):
+        rom = emulator._assemble(os.path.join(HERE, "..", "06", "pong", "Pong.asm"))
+        base = emulator.Computer(rom)
+        fast = blocks.BlockComputer(rom)
+        for limit in [1, 7, 1000, 200_000]:
+            assert base.run(limit) == fast.run(limit)
+            assert (base.a, base.d, base.pc, base.cycles) == (fast.a, fast.d, fast.pc, fast.cycles)
+            assert base.ram == fast.ram
+
+    def test_halt(self):
+        computer = blocks.BlockComputer(emulator.load_rom(os.path.join(HERE, "Max.hack")))
+        computer.ram[0] = 3
+        computer.ram[1] = 5
+        computer.run()
+        assert computer.halted
+        assert computer.ram[2] == 5
+
+
+class TestBatch:
+    def test_matches_scalar(self):
+        np = pytest.importorskip("numpy")
+        import batch
+
+        rom = emulator.load_rom(os.path.join(HERE, "Max.hack"))
+        lanes = 64
+        computer = batch.BatchComputer(rom, lanes, ram_size=16)
+        rng = np.random.default_rng(1)
+        computer.ram[:, :2] = rng.integers(0, 0x10000, (lanes, 2), dtype=np.uint16)
+        initial = computer.ram.copy()
+        computer.run(100)
+        assert computer.halted.all()
+        for lane in range(lanes):
+            scalar = emulator.Computer(rom)
+            scalar.ram[:16] = array("H", initial[lane].tobytes())
+            scalar.run(100)
+            assert list(scalar.ram[:16]) == list(computer.ram[lane])
+            assert (scalar.a, scalar.d, scalar.pc, scalar.cycles) == (computer.a[lane], computer.d[lane], computer.pc[lane], computer.cycles[lane])
+
+    def test_screen(self):
+        np = pytest.importorskip("numpy")
+        import batch
+
+        rom = emulator.load_rom(os.path.join(HERE, "..", "06", "rect", "Rect.hack"))
+        computer = batch.BatchComputer(rom, 4)
+        computer.ram[:, 0] = np.arange(4)
+        initial = computer.ram.copy()
+        computer.run(1000)
+        assert computer.halted.all()
+        for lane in range(4):
+            scalar = emulator.Computer(rom)
+            scalar.ram[:] = array("H", initial[lane].tobytes())
+            scalar.run(1000)
+            assert scalar.ram.tobytes() == computer.ram[lane].tobytes()
+        assert list(computer.ram[:, emulator.SCREEN + 32]) == [0, 0, 0xFFFF, 0xFFFF]
+        small = batch.BatchComputer(rom, 4, ram_size=1024)
+        small.ram[:, 0] = 3
+        with pytest.raises(Exception, match=f"RAM address out of range - {emulator.SCREEN} at PC"):
+            small.run(1000)
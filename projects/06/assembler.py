@@ -1,24 +1,61 @@
 import argparse
+import bisect
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import typing
 from abc import ABC, abstractmethod
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from io import TextIOWrapper
 
+# comp bits including the a-bit (a c1 c2 c3 c4 c5 c6)
+COMP_TABLE = {
+    "0":   0b0101010, "1":   0b0111111, "-1":  0b0111010, "D":   0b0001100,
+    "A":   0b0110000, "!D":  0b0001101, "!A":  0b0110001, "-D":  0b0001111,
+    "-A":  0b0110011, "D+1": 0b0011111, "A+1": 0b0110111, "D-1": 0b0001110,
+    "A-1": 0b0110010, "D+A": 0b0000010, "D-A": 0b0010011, "A-D": 0b0000111,
+    "D&A": 0b0000000, "D|A": 0b0010101, "M":   0b1110000, "!M":  0b1110001,
+    "-M":  0b1110011, "M+1": 0b1110111, "M-1": 0b1110010, "D+M": 0b1000010,
+    "D-M": 0b1010011, "M-D": 0b1000111, "D&M": 0b1000000, "D|M": 0b1010101,
+}
+# the official assembler also accepts the commutative operations written the other way around
+COMP_TABLE.update({f"{x}{op}D": COMP_TABLE[f"D{op}{x}"] for x in "AM" for op in "+&|"})
+JUMP_TABLE = {
+    None:  0b000, "JGT": 0b001, "JEQ": 0b010, "JGE": 0b011,
+    "JLT": 0b100, "JNE": 0b101, "JLE": 0b110, "JMP": 0b111,
+}
+# dest registers may be written in any order (MD and DM are the same destination)
+DEST_TABLE = {None: 0b000}
+for n in range(1, 4):
+    for dest in itertools.permutations("ADM", n):
+        DEST_TABLE["".join(dest)] = (4 if "A" in dest else 0) | (2 if "D" in dest else 0) | (1 if "M" in dest else 0)
+
 
 class Instruction(ABC):
     @abstractmethod
-    def tobinary(self):
+    def encode(self) -> int:
         raise NotImplementedError
 
+    def tobinary(self) -> str:
+        return "{0:016b}".format(self.encode())
+
 
 class AInstruction(Instruction):
     def __init__(self, value: str):
         self.value = value
 
+    def encode(self) -> int:
+        return int(self.value)
+
     def tobinary(self) -> str:
-        try:
-            num = int(self.value)
-            return "{0:016b}".format(num)
-        except:
+        # unresolved symbols have no binary representation
+        if isinstance(self.value, str) and not self.value.isdigit():
             return None
+        return super().tobinary()
 
 
 class CInstruction(Instruction):
@@ -27,33 +64,8 @@ class CInstruction(Instruction):
         self.comp = comp
         self.jump = jump
 
-    def tobinary(self):
-        r = "111"
-        # set comp bytes
-        r += "1" if "M" in self.comp else "0"
-        r += dict(
-            [
-                ("0",   "101010"), ("1",   "111111"), ("-1",  "111010"), ("D",   "001100"),
-                ("A",   "110000"), ("!D",  "001101"), ("!A",  "110001"), ("-D",  "001111"),
-                ("-A",  "110011"), ("D+1", "011111"), ("A+1", "110111"), ("D-1", "001110"),
-                ("A-1", "110010"), ("D+A", "000010"), ("D-A", "010011"), ("A-D", "000111"),
-                ("D&A", "000000"), ("D|A", "010101"), ("M",   "110000"), ("!M",  "110001"),
-                ("-M",  "110011"), ("M+1", "110111"), ("M-1", "110010"), ("D+M", "000010"),
-                ("D-M", "010011"), ("M-D", "000111"), ("D&M", "000000"), ("D|M", "010101"),
-            ]
-        )[self.comp]
-        # set dest bytes
-        r += "1" if self.dest and "A" in self.dest else "0"
-        r += "1" if self.dest and "D" in self.dest else "0"
-        r += "1" if self.dest and "M" in self.dest else "0"
-        # set jmp bytes
-        r += dict(
-            [
-                (None,   "000"), ("JGT",   "001"), ("JEQ",  "010"), ("JGE",   "011"),
-                ("JLT",   "100"), ("JNE",  "101"), ("JLE",  "110"), ("JMP",  "111"),
-            ]
-        )[self.jump]
-        return r
+    def encode(self) -> int:
+        return 0b111 << 13 | COMP_TABLE[self.comp] << 6 | DEST_TABLE[self.dest] << 3 | JUMP_TABLE[self.jump]
 
 
 class Parser:
@@ -64,16 +76,133 @@ class Parser:
         else:
             if "=" in ins and ";" in ins:
                 dest = ins.split("=")[0]
-                comp, jump = ins.split("=")[1].split[";"]
+                comp, jump = ins.split("=")[1].split(";")
             elif "=" in ins:
                 dest, comp = ins.split("=")
                 jump = None
             elif ";" in ins:
                 dest = None
                 comp, jump = ins.split(";")
+            else:
+                dest, comp, jump = None, ins, None
             return CInstruction(dest, comp, jump)
 
 
+# every valid C instruction spelling mapped to its 16 bit word, built once at import time
+C_TABLE = {}
+for comp, dest, jump in itertools.product(COMP_TABLE, DEST_TABLE, JUMP_TABLE):
+    ins = comp if dest is None else f"{dest}={comp}"
+    if jump is not None:
+        ins += f";{jump}"
+    C_TABLE[ins] = CInstruction(dest, comp, jump).encode()
+
+
+def encode(ins: str) -> int:
+    """
+    encodes a single resolved instruction (no symbols, no whitespace) into a 16 bit word
+    """
+    if ins[0] == "@":
+        value = int(ins[1:])
+        if value > 0x7FFF:
+            raise Exception(f"Constant out of range - {ins}")
+        return value
+    try:
+        return C_TABLE[ins]
+    except KeyError:
+        raise Exception(f"Invalid instruction - {ins}") from None
+
+
+def write_hack(words: array, f):
+    """the classic text format, one 16 character binary string per line"""
+    f.write("".join(["{0:016b}\n".format(w) for w in words]))
+
+
+def write_bin(words: array, f):
+    """raw little-endian 16 bit words"""
+    if sys.byteorder == "big":
+        words = array("H", words)
+        words.byteswap()
+    f.write(words.tobytes())
+
+
+def write_hex(words: array, f, address: int = 0, eof: bool = True):
+    """
+    Intel HEX, 16 bytes per record, words stored little-endian like the raw binary format
+    address is the ROM address of the first word, eof=False leaves the file open for more records
+    """
+    if sys.byteorder == "big":
+        words = array("H", words)
+        words.byteswap()
+    data = words.tobytes()
+    records = []
+    for offset in range(address * 2, address * 2 + len(data), 16):
+        if offset and offset % 0x10000 == 0:
+            # extended linear address record for images larger than 64K
+            upper = offset >> 16
+            record = bytes([2, 0, 0, 4, upper >> 8, upper & 0xFF])
+            records.append(_hex_record(record))
+        chunk = data[offset - address * 2 : offset - address * 2 + 16]
+        record = bytes([len(chunk), (offset >> 8) & 0xFF, offset & 0xFF, 0]) + chunk
+        records.append(_hex_record(record))
+    if eof:
+        records.append(":00000001FF\n")
+    f.write("".join(records))
+
+
+def _hex_record(record: bytes) -> str:
+    checksum = -sum(record) & 0xFF
+    return ":" + record.hex().upper() + f"{checksum:02X}\n"
+
+
+# output format -> (writer, file mode)
+FORMATS = {
+    "hack": (write_hack, "w"),
+    "bin": (write_bin, "wb"),
+    "hex": (write_hex, "w"),
+}
+
+
+# words are buffered and written this many at a time (a multiple of 8 keeps hex records full)
+CHUNK_SIZE = 8192
+
+
+def write_stream(words: typing.Iterable[int], f, format: str = "hack", echo: bool = False, chunk_size: int = CHUNK_SIZE):
+    """
+    writes any iterable of words (a generator from assemble_iter for example) to f in large
+    buffered chunks, only chunk_size words are held in memory at a time
+    echo also prints the binary text of every word to stdout, like the assembler used to
+    """
+    writer, _ = FORMATS[format]
+    words = iter(words)
+    address = 0
+    while chunk := array("H", itertools.islice(words, chunk_size)):
+        if format == "hex":
+            write_hex(chunk, f, address, eof=False)
+        else:
+            writer(chunk, f)
+        if echo:
+            write_hack(chunk, sys.stdout)
+        address += len(chunk)
+    if format == "hex":
+        write_hex(array("H"), f)
+
+
+def load_rom(path: str) -> array:
+    """
+    loads a ROM image written by the assembler into an array of 16 bit words
+    raw binary images are read with a single readinto, anything ending in .hack is parsed as text
+    """
+    if path.endswith(".hack"):
+        with open(path, "r") as f:
+            return array("H", [int(line, 2) for line in f if line.strip()])
+    rom = array("H", bytes(os.path.getsize(path)))
+    with open(path, "rb") as f:
+        f.readinto(rom)
+    if sys.byteorder == "big":
+        rom.byteswap()
+    return rom
+
+
 class SymbolTable(dict):
     def __init__(self):
         defaults = {
@@ -104,61 +233,340 @@ class SymbolTable(dict):
         self.update(defaults)
 
 
+class AssemblyCache:
+    """
+    on disk cache of assembled programs, shared between runs (and CI jobs) through a directory
+    programs are keyed by a hash of the normalized source (comments and whitespace removed) and
+    stored as their words in raw little endian bytes in <key>.bin and their symbols in <key>.json.
+    A miss is assembled as usual, caching parts of a program does not pay off: encoding an
+    instruction costs about as much as hashing it. Only the keep most recently used programs
+    stay, older ones are removed when a new one is stored
+    """
+
+    def __init__(self, path: str, keep: int = 32):
+        self.path = path
+        self.keep = keep
+        self.hits = 0
+        self.misses = 0
+        # seconds the hits would have spent assembling, and seconds spent hashing, reading and
+        # writing the cache, hits included
+        self.saved = 0.0
+        self.spent = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(lines: list[str]) -> str:
+        return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+    def get_program(self, key: str) -> tuple[array, dict, float] | None:
+        """
+        returns the words, the symbol table and the assemble time of a previously assembled program
+        """
+        try:
+            with open(os.path.join(self.path, key + ".json"), "r") as f:
+                entry = json.load(f)
+            words = load_rom(os.path.join(self.path, key + ".bin"))
+            # the modification time orders the entries by last use for evicting them
+            os.utime(os.path.join(self.path, key + ".json"))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return words, entry["symbols"], entry["elapsed"]
+
+    def put_program(self, key: str, words: array, symbols: dict, elapsed: float):
+        # the words first, an entry is only found once its .json exists
+        if sys.byteorder == "big":
+            words = array("H", words)
+            words.byteswap()
+        _replace(os.path.join(self.path, key + ".bin"), words.tobytes())
+        _replace(os.path.join(self.path, key + ".json"), json.dumps({"symbols": symbols, "elapsed": elapsed}))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.path, name)), name[:-5]))
+                except FileNotFoundError:
+                    pass
+        for _, key in sorted(entries, reverse=True)[self.keep :]:
+            for suffix in (".json", ".bin"):
+                try:
+                    os.remove(os.path.join(self.path, key + suffix))
+                except FileNotFoundError:
+                    # another job evicted it first
+                    pass
+
+    def report(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, saved {(self.saved - self.spent) * 1000:.1f}ms net"
+
+
 class Assembler:
     MEMORY_START = 16
 
-    def __init__(self, src: TextIOWrapper, st: SymbolTable):
+    def __init__(self, src: TextIOWrapper, st: SymbolTable, cache: AssemblyCache = None):
         self.src = src
         self.st = st
+        self.cache = cache
         self.program = []
-        self.program = self.src.readlines()
-
-    def preprocess(self):
-        # strip whitespace and comments
-        self.program = [x.split("//")[0] for x in self.program]
-        self.program = [x.strip() for x in self.program if x.strip()]
-        # build symbol table
-        for line in self.program:
+        self.labels = {}
+        self.variables = {}
+        # source line number of every ROM address
+        self.lines = array("I")
+
+    def preprocess(self, numbered: typing.Iterable[tuple[int, str]] = None):
+        """
+        strips whitespace and comments and resolves every symbol in a single linear scan
+        labels are recorded as they are found, references to symbols that are not known yet are
+        remembered and backpatched once the scan is done, anything still unknown at that point is
+        a variable and gets the next free address starting at MEMORY_START (in order of first use)
+        numbered can pass the source as already stripped (line number, line) pairs
+        """
+        program = []
+        fixups = {}
+        lines = self.lines
+        for n, line in _numbered(self.src) if numbered is None else numbered:
             # handle labels
-            if line.startswith("("):
-                self.st[line[1:-1]] = self.program.index(line)
-                self.program.remove(line)
+            if line[0] == "(":
+                self.st[line[1:-1]] = self.labels[line[1:-1]] = len(program)
+                continue
             # handle symbols
-            elif line.startswith("@"):
+            if line[0] == "@" and not line[1:].isdigit():
                 symbol = line[1:]
-                if not symbol.isdigit():
-                    if symbol not in self.st:
-                        self.st[symbol] = None
-        # assign values to symbols
+                if self.st.get(symbol) is None:
+                    fixups.setdefault(symbol, []).append(len(program))
+                else:
+                    line = f"@{self.st[symbol]}"
+            program.append(line)
+            lines.append(n)
+        # backpatch forward references and assign values to variables
         next = self.MEMORY_START
-        for k, v in self.st.items():
-            if v is None:
-                self.st[k] = next
+        for symbol, indexes in fixups.items():
+            if self.st.get(symbol) is None:
+                self.st[symbol] = self.variables[symbol] = next
                 next += 1
+            for i in indexes:
+                program[i] = f"@{self.st[symbol]}"
+        self.program = program
+
+    def encode(self, jobs: int = 1) -> array:
+        """
+        returns the (preprocessed) program as an array of 16 bit words
+        with jobs > 1 the program is split into contiguous shards that are encoded by a pool of
+        worker processes, the shards are joined back in order so the result is identical
+        """
+        if jobs <= 1 or len(self.program) < jobs:
+            return array("H", map(encode, self.program))
+        size = -(-len(self.program) // jobs)
+        shards = [self.program[i : i + size] for i in range(0, len(self.program), size)]
+        words = array("H")
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for data in pool.map(_encode_shard, shards):
+                words.frombytes(data)
+        return words
+
+    def assemble(self, out: str, format: str = "hack", echo: bool = False, jobs: int = 1) -> array:
+        """
+        assembles the program into out and returns the encoded words
+        """
+        if self.cache is not None:
+            words = self._assemble_cached()
+        else:
+            self.preprocess()
+            words = self.encode(jobs)
+        with open(out, FORMATS[format][1]) as f:
+            write_stream(words, f, format, echo)
+        return words
+
+    def _assemble_cached(self) -> array:
+        start = time.perf_counter()
+        numbered = list(_numbered(self.src))
+        numbering = time.perf_counter() - start
+        key = AssemblyCache.key([line for _, line in numbered])
+        cached = self.cache.get_program(key)
+        if cached is not None:
+            words, symbols, elapsed = cached
+            self.st.update(symbols["st"])
+            self.labels.update(symbols["labels"])
+            self.variables.update(symbols["variables"])
+            self.lines.extend(n for n, line in numbered if line[0] != "(")
+            self.cache.saved += elapsed
+            self.cache.spent += time.perf_counter() - start
+            return words
+        assembling = time.perf_counter()
+        self.preprocess(numbered)
+        words = self.encode()
+        # what assembling without the cache takes, the numbering included
+        elapsed = numbering + time.perf_counter() - assembling
+        symbols = {"st": dict(self.st), "labels": self.labels, "variables": self.variables}
+        self.cache.put_program(key, words, symbols, elapsed)
+        self.cache.spent += time.perf_counter() - start - elapsed
+        return words
+
+    def write_sym(self, path: str):
+        """
+        writes the symbol map: one `label <name> <ROM address>` or `variable <name> <RAM address>`
+        per line, see SymbolMap for reading it back
+        """
+        with open(path, "w") as f:
+            for name, address in sorted(self.labels.items(), key=lambda x: x[1]):
+                f.write(f"label {name} {address}\n")
+            for name, address in sorted(self.variables.items(), key=lambda x: x[1]):
+                f.write(f"variable {name} {address}\n")
+
+    def write_listing(self, path: str, source: typing.Iterable[str], words: array):
+        """
+        writes the listing: every source line with the ROM address and word it assembled to
+        source has to be the same source the program was assembled from
+        """
+        addresses = {n: address for address, n in enumerate(self.lines)}
+        with open(path, "w") as f:
+            for n, text in enumerate(source, 1):
+                text = text.rstrip("\n")
+                address = addresses.get(n)
+                if address is None:
+                    f.write(f"{'':5} {'':16} {n:6}  {text}\n")
+                else:
+                    f.write(f"{address:5} {words[address]:016b} {n:6}  {text}\n")
+
+
+class SymbolMap:
+    """
+    the symbol map written by Assembler.write_sym, for attributing ROM addresses to labels
+    """
+
+    def __init__(self, labels: dict[str, int], variables: dict[str, int]):
+        self.labels = labels
+        self.variables = variables
+        ordered = sorted(labels.items(), key=lambda x: x[1])
+        self._addresses = [address for _, address in ordered]
+        self._names = [name for name, _ in ordered]
 
-    def assemble(self, out: str):
-        self.preprocess()
-        with open(out, "w") as f:
-            for line in self.program:
-                ins = Parser.parse(line)
-                if isinstance(ins, AInstruction):
-                    try:
-                        ins.value = self.st[ins.value]
-                    except:
-                        pass
-                print(ins.tobinary())
-                f.write(ins.tobinary() + "\n")
-            f.flush()
+    @classmethod
+    def load(cls, path: str) -> "SymbolMap":
+        labels, variables = {}, {}
+        with open(path, "r") as f:
+            for line in f:
+                kind, name, address = line.split()
+                (labels if kind == "label" else variables)[name] = int(address)
+        return cls(labels, variables)
+
+    def label_at(self, address: int) -> str | None:
+        """
+        the closest label at or before a ROM address, for translated VM code this is the function,
+        return address or label the instruction belongs to
+        """
+        i = bisect.bisect_right(self._addresses, address) - 1
+        return self._names[i] if i >= 0 else None
+
+
+def _replace(path: str, data: str | bytes):
+    """writes data next to path and renames it over path, a reader sees the old file or the new one"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _encode_shard(lines: list[str]) -> bytes:
+    "worker for Assembler.encode, returns the shard as native byte order words"
+    return array("H", map(encode, lines)).tobytes()
+
+
+def _numbered(lines: typing.Iterable[str]) -> typing.Iterator[tuple[int, str]]:
+    "yields the instructions and labels of the source with their line number, without comments and whitespace"
+    for n, line in enumerate(lines, 1):
+        line = line.split("//")[0].strip()
+        if line:
+            yield n, line
+
+
+def _strip(lines: typing.Iterable[str]) -> typing.Iterator[str]:
+    "yields the instructions and labels of the source, without comments and whitespace"
+    for _, line in _numbered(lines):
+        yield line
+
+
+def assemble_iter(source_lines: typing.Iterable[str], st: SymbolTable = None) -> typing.Iterator[int]:
+    """
+    streaming version of the assembler, takes any iterable of source lines and yields the encoded
+    words in ROM order
+    the first pass only records label addresses, the second pass encodes and numbers variables as
+    they are first used (the same numbering as Assembler.preprocess). A seekable source such as an
+    open file is rewound for the second pass so memory use is bounded by the symbol table, any
+    other iterable is buffered as stripped lines
+    """
+    st = SymbolTable() if st is None else st
+    if hasattr(source_lines, "seekable") and source_lines.seekable():
+        start = source_lines.tell()
+        lines = _strip(source_lines)
+    else:
+        source_lines = list(_strip(source_lines))
+        lines = iter(source_lines)
+    address = 0
+    for line in lines:
+        if line[0] == "(":
+            st[line[1:-1]] = address
+        else:
+            address += 1
+
+    if isinstance(source_lines, list):
+        lines = iter(source_lines)
+    else:
+        source_lines.seek(start)
+        lines = _strip(source_lines)
+    next = Assembler.MEMORY_START
+    for line in lines:
+        if line[0] == "(":
+            continue
+        if line[0] == "@" and not line[1:].isdigit():
+            symbol = line[1:]
+            if st.get(symbol) is None:
+                st[symbol] = next
+                next += 1
+            line = f"@{st[symbol]}"
+        yield encode(line)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--src", action="store")
     parser.add_argument("--out", action="store")
+    parser.add_argument("--format", action="store", choices=FORMATS, default="hack",
+                        help="hack (text), bin (raw little-endian words) or hex (Intel HEX)")
+    parser.add_argument("--stream", action="store_true", help="assemble in two streaming passes with bounded memory")
+    parser.add_argument("--echo", action="store_true", help="also print the binary of every instruction to stdout")
+    parser.add_argument("--jobs", action="store", type=int, default=1,
+                        help="encode with N worker processes, only worth it for very large programs")
+    parser.add_argument("--cache", action="store", help="directory to cache assembled programs in")
+    parser.add_argument("--sym", action="store", help="write the label and variable addresses to this file")
+    parser.add_argument("--listing", action="store", help="write a listing mapping ROM addresses to source lines")
     args = parser.parse_args()
+    if args.stream:
+        ignored = [option for option in ("sym", "listing", "cache") if getattr(args, option)]
+        if args.jobs != 1:
+            ignored.append("jobs")
+        if ignored:
+            parser.error(f"--stream does not keep the program in memory, it cannot be used with --{', --'.join(ignored)}")
+    if args.cache and args.jobs != 1:
+        parser.error("--cache encodes only the chunks it misses, it cannot be used with --jobs")
     with open(args.src, "r") as f:
-        st = SymbolTable()
-        asm = Assembler(f, st)
-        asm.assemble(args.out)
+        if args.stream:
+            with open(args.out, FORMATS[args.format][1]) as out:
+                write_stream(assemble_iter(f), out, args.format, args.echo)
+        else:
+            st = SymbolTable()
+            cache = AssemblyCache(args.cache) if args.cache else None
+            asm = Assembler(f, st, cache)
+            words = asm.assemble(args.out, args.format, args.echo, args.jobs)
+            if args.sym:
+                asm.write_sym(args.sym)
+            if args.listing:
+                f.seek(0)
+                asm.write_listing(args.listing, f, words)
+            if cache is not None:
+                print(cache.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+"""
+Throughput benchmark suite for the assembler
+
+Generates synthetic Hack programs (label heavy, variable heavy and a mix of A/C instructions)
+from 1K to 1M source lines, writes each one to a file and assembles it from there in its own
+process, recording lines/sec, peak RSS and the time spent in preprocess (symbol resolution) vs
+encode. The generator never runs in the measuring process so the peak RSS is the assembler's. The per line cost
+should stay flat as the program grows, if it does not the assembler is doing more than a
+linear amount of work somewhere.
+
+Results can be saved as a JSON baseline with --save, a later run with --baseline fails when the
+throughput of any case dropped by more than --threshold.
+
+With --jobs N it instead compares the serial encoder against N worker processes and reports
+the smallest program size where the parallel pass is faster.
+
+usage: python bench_assembler.py [--profiles mixed labels variables] [--sizes 1000 ... 1000000]
+                                 [--save baseline.json | --baseline baseline.json] [--jobs N]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import assembler
+
+COMPS = ["D=A", "D=M", "M=D", "M=M+1", "AM=M-1", "D=D+M", "D=D-A", "MD=M-1", "A=M"]
+JUMPS = ["D;JEQ", "D;JGT", "D;JLT", "0;JMP", "D;JNE"]
+
+# share of source lines per kind, the remainder are C instructions
+PROFILES = {
+    "mixed": {"label": 0.05, "jump": 0.10, "var": 0.15, "const": 0.10, "comment": 0.05, "vars": 200},
+    "labels": {"label": 0.20, "jump": 0.30, "var": 0.02, "const": 0.03, "comment": 0.03, "vars": 50},
+    "variables": {"label": 0.01, "jump": 0.02, "var": 0.45, "const": 0.05, "comment": 0.02, "vars": 8000},
+}
+
+
+def generate_program(lines: int, seed: int = 0, profile: str = "mixed") -> str:
+    """
+    builds a program of roughly `lines` source lines with the mix of labels, forward and backward
+    label references, variables, constants and C instructions given by the profile
+    """
+    p = PROFILES[profile]
+    label, jump = p["label"], p["label"] + p["jump"]
+    var = jump + p["var"]
+    const = var + p["const"]
+    comment = const + p["comment"]
+    rnd = random.Random(seed)
+    out = []
+    labels = 0
+    instructions = 0
+    closed = False
+    while len(out) < lines:
+        if instructions >= 32000 and not closed:
+            # define every label that was referenced ahead
+            out.extend(f"(L{i})" for i in range(labels, labels + 21))
+            labels += 21
+            closed = True
+        r = rnd.random()
+        if r < label:
+            # label addresses past the 32K ROM can not be encoded, keep defining labels
+            # until then and only jump backwards afterwards
+            if instructions < 32000:
+                out.append(f"(L{labels})")
+                labels += 1
+        elif r < jump:
+            # mostly forward references, they have to be backpatched
+            if instructions < 32000:
+                out.append(f"@L{labels + rnd.randint(-2, 20)}" if labels > 2 else f"@L{labels + 1}")
+            else:
+                out.append(f"@L{rnd.randint(0, labels - 1)}")
+            out.append(rnd.choice(JUMPS))
+            instructions += 2
+        elif r < var:
+            out.append(f"@var{rnd.randint(0, p['vars'])}")
+            instructions += 1
+        elif r < const:
+            out.append(f"@{rnd.randint(0, 32767)}")
+            instructions += 1
+        elif r < comment:
+            out.append("// comment line")
+        else:
+            out.append(rnd.choice(COMPS))
+            instructions += 1
+    if not closed:
+        out.extend(f"(L{i})" for i in range(labels, labels + 21))
+    return "\n".join(out) + "\n"
+
+
+def run(src: io.TextIOBase) -> tuple[float, float]:
+    asm = assembler.Assembler(src, assembler.SymbolTable())
+    start = time.perf_counter()
+    asm.preprocess()
+    mid = time.perf_counter()
+    asm.encode()
+    end = time.perf_counter()
+    return mid - start, end - mid
+
+
+def crossover(sizes: list[int], jobs: int):
+    print(f"{'lines':>10} {'serial':>10} {f'jobs={jobs}':>10} {'speedup':>8}")
+    found = None
+    for size in sizes:
+        asm = assembler.Assembler(io.StringIO(generate_program(size)), assembler.SymbolTable())
+        asm.preprocess()
+        start = time.perf_counter()
+        serial = asm.encode()
+        mid = time.perf_counter()
+        parallel = asm.encode(jobs)
+        end = time.perf_counter()
+        assert serial == parallel
+        speedup = (mid - start) / (end - mid)
+        print(f"{size:>10} {mid - start:>9.3f}s {end - mid:>9.3f}s {speedup:>7.2f}x")
+        if found is None and speedup > 1:
+            found = size
+    if found is None:
+        print(f"--jobs {jobs} did not pay off at any size (on {os.cpu_count()} cpus)")
+    else:
+        print(f"--jobs {jobs} pays off from {found} lines")
+
+
+def run_case(path: str, size: int) -> dict:
+    """
+    assembles one generated program file, meant to run in a fresh process so ru_maxrss is its own peak
+    """
+    with open(path, "r") as f:
+        pre, enc = run(f)
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_kb = rss // 1024 if sys.platform == "darwin" else rss
+    return {
+        "lines": size,
+        "preprocess": pre,
+        "encode": enc,
+        "lines_per_sec": size / (pre + enc),
+        "peak_rss_kb": rss_kb,
+    }
+
+
+def suite(profiles: list[str], sizes: list[int]) -> dict:
+    results = {}
+    print(f"{'case':>18} {'preprocess':>11} {'encode':>9} {'lines/sec':>11} {'us/line':>8} {'peak rss':>9}")
+    for profile in profiles:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "program.asm")
+                with open(path, "w") as f:
+                    f.write(generate_program(size, profile=profile))
+                out = subprocess.run(
+                    [sys.executable, __file__, "--case", path, str(size)],
+                    check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                ).stdout
+            r = results[f"{profile}/{size}"] = json.loads(out)
+            print(
+                f"{profile + '/' + str(size):>18} {r['preprocess']:>10.3f}s {r['encode']:>8.3f}s "
+                f"{r['lines_per_sec']:>11,.0f} {1e6 / r['lines_per_sec']:>8.2f} {r['peak_rss_kb'] / 1024:>7.1f}MB"
+            )
+    return results
+
+
+def check_scaling(results: dict, profiles: list[str], sizes: list[int], tolerance: float) -> list[str]:
+    failures = []
+    for profile in profiles:
+        first = results[f"{profile}/{sizes[0]}"]["lines_per_sec"]
+        last = results[f"{profile}/{sizes[-1]}"]["lines_per_sec"]
+        growth = first / last
+        print(f"{profile}: per line cost grew {growth:.2f}x from {sizes[0]} to {sizes[-1]} lines")
+        if growth > tolerance:
+            failures.append(f"{profile} does not scale linearly (growth {growth:.2f}x > {tolerance}x)")
+    return failures
+
+
+def check_baseline(results: dict, baseline: dict, threshold: float) -> list[str]:
+    failures = []
+    for case, r in results.items():
+        if case not in baseline["results"]:
+            continue
+        before = baseline["results"][case]["lines_per_sec"]
+        change = r["lines_per_sec"] / before - 1
+        if change < -threshold:
+            failures.append(f"{case} throughput regressed {-change:.0%} ({before:,.0f} -> {r['lines_per_sec']:,.0f} lines/sec)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--tolerance", type=float, default=3.0,
+                        help="max allowed growth of the per line cost from the smallest to the largest size")
+    parser.add_argument("--save", action="store", help="write the results as a JSON baseline")
+    parser.add_argument("--baseline", action="store", help="compare against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="max allowed throughput drop against the baseline (0.2 = 20%%)")
+    parser.add_argument("--jobs", type=int, default=1, help="report the crossover size for N worker processes")
+    parser.add_argument("--case", nargs=2, metavar=("ASM", "LINES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]))))
+        return
+    if args.jobs > 1:
+        crossover(args.sizes, args.jobs)
+        return
+
+    results = suite(args.profiles, args.sizes)
+    failures = check_scaling(results, args.profiles, args.sizes, args.tolerance)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_baseline(results, json.load(f), args.threshold)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+    if failures:
+        raise SystemExit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
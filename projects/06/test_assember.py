@@ -1,5 +1,8 @@
 import assembler
 import io
+import sys
+
+import pytest
 
 
 class TestAssembler:
@@ -33,6 +36,29 @@ class TestAssembler:
         assert st["symbol"] == 16
         assert st["symbol2"] == 17
 
+    def test_preprocess_forward_references(self):
+        test_data = """
+            @END        // forward reference to a label
+            0;JMP
+            (LOOP)
+            (LOOP2)
+            @i          // first use right after a label
+            M=M+1
+            @LOOP2
+            0;JMP
+            @j
+            (END)
+            @END
+        """
+        st = assembler.SymbolTable()
+        asm = assembler.Assembler(src=io.StringIO(test_data), st=st)
+        asm.preprocess()
+        assert st["END"] == 7
+        assert st["LOOP"] == st["LOOP2"] == 2
+        assert st["i"] == 16
+        assert st["j"] == 17
+        assert asm.program == ["@7", "0;JMP", "@16", "M=M+1", "@2", "0;JMP", "@17", "@7"]
+
 
 class TestParser:
     def test_ainstruction(self):
@@ -63,4 +89,116 @@ class TestParser:
             assert parsed.dest == t["dest"]
             assert parsed.comp == t["comp"]
             assert parsed.jump == t["jump"]
-            assert parsed.tobinary() == t["binary"]
\ No newline at end of file
+            assert parsed.tobinary() == t["binary"]
+
+class TestEncoder:
+    def test_encode(self):
+        assert assembler.encode("@21") == 21
+        assert assembler.encode("D=A") == 0b1110110000010000
+        assert assembler.encode("AM=M-1") == 0b1111110010101000
+        assert assembler.encode("MA=M-1") == assembler.encode("AM=M-1")
+        assert assembler.encode("D=M;JGT") == 0b1111110000010001
+        assert assembler.encode("0;JMP") == 0b1110101010000111
+
+    def test_formats(self, tmp_path):
+        words = assembler.array("H", [0x1234, 0xEC10, 0x0007])
+        with open(tmp_path / "out.hack", "w") as f:
+            assembler.write_hack(words, f)
+        with open(tmp_path / "out.bin", "wb") as f:
+            assembler.write_bin(words, f)
+        with open(tmp_path / "out.hex", "w") as f:
+            assembler.write_hex(words, f)
+        assert (tmp_path / "out.bin").read_bytes() == b"\x34\x12\x10\xec\x07\x00"
+        assert (tmp_path / "out.hex").read_text() == ":06000000341210EC0700B1\n:00000001FF\n"
+        assert assembler.load_rom(str(tmp_path / "out.hack")) == words
+        assert assembler.load_rom(str(tmp_path / "out.bin")) == words
+
+
+class TestStreaming:
+    def test_assemble_iter(self, tmp_path):
+        source = "@i\nM=1\n(LOOP)\n@END\nD;JGT\n@i\nM=M+1\n@LOOP\n0;JMP\n(END)\n@END\n0;JMP\n"
+        asm = assembler.Assembler(io.StringIO(source), assembler.SymbolTable())
+        asm.preprocess()
+        expected = list(asm.encode())
+        # generators are buffered, files are rewound for the second pass
+        assert list(assembler.assemble_iter(line for line in source.splitlines())) == expected
+        path = tmp_path / "prog.asm"
+        path.write_text(source)
+        with open(path) as f:
+            assert list(assembler.assemble_iter(f)) == expected
+
+    def test_stream_options(self, tmp_path, monkeypatch, capsys):
+        (tmp_path / "in.asm").write_text("@1\n")
+        argv = ["assembler.py", "--src", str(tmp_path / "in.asm"), "--out", str(tmp_path / "out.hack"), "--stream"]
+        monkeypatch.setattr(sys, "argv", argv + ["--sym", str(tmp_path / "out.sym"), "--jobs", "2"])
+        with pytest.raises(SystemExit):
+            assembler.main()
+        assert "cannot be used with --sym, --jobs" in capsys.readouterr().err
+        assert not (tmp_path / "out.hack").exists()
+
+    def test_parallel_encode(self):
+        source = "".join(f"@v{i % 7}\nD=M\n(L{i})\n@L{i}\nD;JGT\n" for i in range(100))
+        asm = assembler.Assembler(io.StringIO(source), assembler.SymbolTable())
+        asm.preprocess()
+        assert asm.encode(jobs=3) == asm.encode()
+
+    def test_write_stream(self):
+        words = [assembler.encode("D=A")] * 20
+        out = io.StringIO()
+        assembler.write_stream(iter(words), out, chunk_size=8)
+        assert out.getvalue() == "1110110000010000\n" * 20
+
+
+class TestCache:
+    def assemble(self, source, cache, out):
+        asm = assembler.Assembler(io.StringIO(source), assembler.SymbolTable(), cache)
+        asm.assemble(str(out))
+        return out.read_text()
+
+    def test_cache(self, tmp_path):
+        source = "@x\nM=1\n(A)\n@x\nM=M+1\n(B)\n@A\n0;JMP\n(C)\n@C\n0;JMP\n"
+        cache = assembler.AssemblyCache(str(tmp_path / "cache"))
+        first = self.assemble(source, cache, tmp_path / "1.hack")
+        assert (cache.hits, cache.misses) == (0, 1)
+        # same source with different comments and whitespace is a hit
+        second = self.assemble("// again\n" + source.replace("\n", "  \n"), cache, tmp_path / "2.hack")
+        assert first == second
+        assert (cache.hits, cache.misses) == (1, 1)
+        # an edit is a miss that assembles like no cache
+        edited = source.replace("(C)\n", "(C)\nD=0\n")
+        cache = assembler.AssemblyCache(str(tmp_path / "cache"))
+        third = self.assemble(edited, cache, tmp_path / "3.hack")
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert third == self.assemble(edited, None, tmp_path / "4.hack")
+
+    def test_evict(self, tmp_path):
+        cache = assembler.AssemblyCache(str(tmp_path / "cache"), keep=2)
+        for source in ["@0\n", "@1\n", "@2\n", "@1\n", "@0\n"]:
+            self.assemble(source, cache, tmp_path / "out.hack")
+        # @0 was the oldest when @2 was stored
+        assert (cache.hits, cache.misses) == (1, 4)
+        assert len(list((tmp_path / "cache").glob("*.json"))) == 2
+
+    def test_jobs(self, tmp_path, monkeypatch, capsys):
+        (tmp_path / "in.asm").write_text("@1\n")
+        argv = ["assembler.py", "--src", str(tmp_path / "in.asm"), "--out", str(tmp_path / "out.hack")]
+        monkeypatch.setattr(sys, "argv", argv + ["--cache", str(tmp_path / "cache"), "--jobs", "2"])
+        with pytest.raises(SystemExit):
+            assembler.main()
+        assert "cannot be used with --jobs" in capsys.readouterr().err
+
+
+class TestSymbolMap:
+    def test_sym_and_listing(self, tmp_path):
+        source = "// counter\n@i\nM=0\n(LOOP)\n@i\nM=M+1\n@LOOP\n0;JMP\n"
+        asm = assembler.Assembler(io.StringIO(source), assembler.SymbolTable())
+        words = asm.assemble(str(tmp_path / "out.hack"))
+        asm.write_sym(str(tmp_path / "out.sym"))
+        asm.write_listing(str(tmp_path / "out.lst"), io.StringIO(source), words)
+        assert (tmp_path / "out.sym").read_text() == "label LOOP 2\nvariable i 16\n"
+        listing = (tmp_path / "out.lst").read_text().splitlines()
+        assert listing[3].split() == ["4", "(LOOP)"]
+        assert listing[4].split() == ["2", "0000000000010000", "5", "@i"]
+        symbols = assembler.SymbolMap.load(str(tmp_path / "out.sym"))
+        assert symbols.variables == {"i": 16}
+        assert [symbols.label_at(a) for a in range(6)] == [None, None, "LOOP", "LOOP", "LOOP", "LOOP"]
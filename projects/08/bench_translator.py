@@ -0,0 +1,297 @@
+"""
+Compares the code the translator emits in each of its modes, and counts the instructions every
+fused pattern saves
+
+ROM size (instructions) is reported for the projects 07 and 08 tests and for every projects/11
+program linked with the OS in tools/OS. Cycles are the instructions the project 05 emulator
+executes on a test, starting from the RAM its .tst sets, until the program reaches its halt
+loop or runs past its last instruction. Every mode has to leave the same RAM behind as the
+inline translation.
+
+--jobs N times serial against parallel translation of the OS together with each game and
+checks the outputs are the same byte for byte
+
+--throughput N translates a generated file of N VM commands (a mix shaped like the compiled
+Jack code in tools/OS) in every mode and reports commands per second
+
+--prune lists the functions dead function elimination leaves out of every projects/11 program
+linked with the OS, and its ROM size in every mode with and without them
+
+usage: python bench_translator.py [--modes inline compact fused cached] [--cycles 1000000]
+       python bench_translator.py --patterns
+       python bench_translator.py --jobs 4 [--repeat 5]
+       python bench_translator.py --throughput 200000
+       python bench_translator.py --prune [--modes inline compact]
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import translator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+sys.path.insert(0, os.path.join(HERE, "..", "06"))
+import assembler  # noqa: E402
+import emulator  # noqa: E402
+
+# translator.build keyword arguments for every mode
+MODES = {
+    "inline": {},
+    "compact": {"compact": True},
+    "fused": {"fuse": True},
+    "compact+fused": {"compact": True, "fuse": True},
+    "cached": {"cache_top": True},
+    "fused+cached": {"fuse": True, "cache_top": True},
+}
+TESTS = [
+    "07/StackArithmetic/SimpleAdd",
+    "07/StackArithmetic/StackTest",
+    "07/MemoryAccess/BasicTest",
+    "07/MemoryAccess/PointerTest",
+    "07/MemoryAccess/StaticTest",
+    "08/ProgramFlow/BasicLoop",
+    "08/ProgramFlow/FibonacciSeries",
+    "08/FunctionCalls/SimpleFunction",
+    "08/FunctionCalls/FibonacciElement",
+    "08/FunctionCalls/StaticsTest",
+    "08/FunctionCalls/NestedCall",
+]
+PROGRAMS = ["Average", "ComplexArrays", "ConvertToBin", "Pong", "Seven", "Square"]
+GAMES = ["Pong", "Square"]
+
+
+def translate(src: list[str], mode: str, bootstrap: bool = True, prune: bool = False) -> list[str]:
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "out.asm")
+        translator.build(src, dest, bootstrap=bootstrap, prune=prune, **MODES[mode])
+        with open(dest, "r") as f:
+            return f.readlines()
+
+
+def rom_size(asm: list[str]) -> int:
+    """counts instructions without encoding them, linked programs can be larger than the ROM"""
+    program = assembler.Assembler(asm, assembler.SymbolTable())
+    program.preprocess()
+    return len(program.program)
+
+
+def instructions(asm: str) -> int:
+    return sum(1 for line in asm.split("\n") if line and line[0] not in "/(")
+
+
+def pattern_savings(src: list[str]) -> dict[str, tuple[int, int]]:
+    """
+    pattern name -> (times fused, instructions saved against translating the commands one by one)
+    """
+    savings = {cls.__name__: (0, 0) for cls in translator.FUSED}
+    for file in src:
+        with open(file, "r") as f:
+            commands = translator.Translator(f, os.path.basename(file).split(".")[0], fuse=True).parse()
+        for command in commands:
+            if isinstance(command, translator.Fused):
+                count, saved = savings[type(command).__name__]
+                original = sum(instructions(c.toasm()) for c in command.commands)
+                savings[type(command).__name__] = (count + 1, saved + original - instructions(command.toasm()))
+    return savings
+
+
+def run(asm: list[str], ram: dict[int, int], cycles: int) -> emulator.Computer:
+    """
+    runs until the program halts or jumps past its last instruction
+    """
+    program = assembler.Assembler(asm, assembler.SymbolTable())
+    program.preprocess()
+    computer = emulator.Computer(program.encode())
+    for address, value in ram.items():
+        computer.ram[address] = value & 0xFFFF
+    end = len(program.program)
+    while not computer.halted and computer.pc < end:
+        computer.run(1)
+        if computer.cycles > cycles:
+            raise Exception(f"Program did not finish - {cycles} cycles")
+    return computer
+
+
+def state(computer: emulator.Computer, bootstrap: bool) -> list[int]:
+    """
+    the RAM every mode has to agree on, R13-R15 are scratch registers. Programs with the
+    bootstrap keep return addresses (that differ between modes) on the stack, so only the top
+    of their stack is compared
+    """
+    ram = computer.ram
+    if bootstrap:
+        return list(ram[:13]) + list(ram[16:256]) + [ram[ram[0] - 1]]
+    return list(ram[:13]) + list(ram[16 : ram[0]]) + list(ram[3000:4096])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="*", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--cycles", action="store", type=int, default=1_000_000)
+    parser.add_argument("--patterns", action="store_true", help="only print the savings of every fused pattern")
+    parser.add_argument("--jobs", action="store", type=int, help="only compare serial and parallel translation")
+    parser.add_argument("--repeat", action="store", type=int, default=5)
+    parser.add_argument("--throughput", action="store", type=int, help="only time translating N generated commands")
+    parser.add_argument("--prune", action="store_true", help="only compare ROM sizes with dead function elimination")
+    args = parser.parse_args()
+    if args.patterns:
+        return patterns()
+    if args.throughput:
+        return throughput(args.throughput, args.repeat, args.modes)
+    if args.prune:
+        return pruning(args.modes)
+    if args.jobs:
+        return parallel(args.jobs, args.repeat, args.modes)
+    modes = args.modes if "inline" in args.modes else ["inline", *args.modes]
+    widths = [max(14, len(m) + 8) for m in modes]
+    header = "".join(f"{m + ' rom':>{w}}{m + ' cycles':>{w + 2}}" for m, w in zip(modes, widths))
+    print(f"{'program':<18}{header}")
+
+    totals = {mode: 0 for mode in modes}
+    for test in TESTS:
+        path = os.path.join(HERE, "..", test)
+        src = sorted(glob.glob(os.path.join(path, "*.vm")))
+        bootstrap = any(os.path.basename(file) == "Sys.vm" for file in src)
+        with open(glob.glob(os.path.join(path, "*[!E].tst"))[0], "r") as f:
+            ram = {int(a): int(v) for a, v in re.findall(r"set RAM\[(\d+)\]\s+(-?\d+)", f.read())}
+        row, base = [], None
+        for mode, w in zip(modes, widths):
+            if MODES[mode].get("compact") and not bootstrap:
+                row.append(f"{'-':>{w}}{'-':>{w + 2}}")
+                totals[mode] = None
+                continue
+            asm = translate(src, mode, bootstrap)
+            computer = run(asm, ram, args.cycles)
+            base = base or state(computer, bootstrap)
+            assert state(computer, bootstrap) == base, f"{test} {mode} does not match the inline translation"
+            row.append(f"{rom_size(asm):>{w},}{computer.cycles:>{w + 2},}")
+            if totals[mode] is not None:
+                totals[mode] += computer.cycles
+        print(f"{os.path.basename(test):<18}{''.join(row)}")
+    cells = [f"{'':>{w}}{'-' if totals[m] is None else f'{totals[m]:,}':>{w + 2}}" for m, w in zip(modes, widths)]
+    print(f"{'total cycles':<18}{''.join(cells)}")
+
+    os_src = sorted(glob.glob(os.path.join(ROOT, "tools", "OS", "*.vm")))
+    for name in PROGRAMS:
+        src = sorted(glob.glob(os.path.join(HERE, "..", "11", name, "*.vm"))) + os_src
+        row = [f"{rom_size(translate(src, mode)):>{w},}{'-':>{w + 2}}" for mode, w in zip(modes, widths)]
+        print(f"{name + ' + OS':<18}{''.join(row)}")
+
+
+def patterns():
+    groups = {"FunctionCalls": sorted(glob.glob(os.path.join(HERE, "FunctionCalls", "*", "*.vm")))}
+    for name in PROGRAMS:
+        groups[name] = sorted(glob.glob(os.path.join(HERE, "..", "11", name, "*.vm")))
+    groups["tools/OS"] = sorted(glob.glob(os.path.join(ROOT, "tools", "OS", "*.vm")))
+    names = [cls.__name__ for cls in translator.FUSED]
+    print(f"{'program':<18}" + "".join(f"{name:>18}" for name in names) + f"{'total':>10}")
+    for group, src in groups.items():
+        savings = pattern_savings(src)
+        cells = "".join(f"{f'{count} / -{saved}':>18}" for count, saved in savings.values())
+        print(f"{group:<18}{cells}{-sum(saved for _, saved in savings.values()):>10}")
+    print("cells are: times fused / instructions saved")
+
+
+def parallel(jobs: int, repeat: int, modes: list[str]):
+    os_src = sorted(glob.glob(os.path.join(ROOT, "tools", "OS", "*.vm")))
+    print(f"{'program':<14}{'mode':<16}{'files':>6}{'serial':>10}{f'jobs={jobs}':>10}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in GAMES:
+            src = sorted(glob.glob(os.path.join(HERE, "..", "11", name, "*.vm"))) + os_src
+            for mode in modes:
+                times = {}
+                for n in (1, jobs):
+                    dest = os.path.join(tmp, f"{n}.asm")
+                    best = float("inf")
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        translator.build(src, dest, jobs=n, **MODES[mode])
+                        best = min(best, time.perf_counter() - start)
+                    times[n] = best
+                with open(os.path.join(tmp, "1.asm"), "rb") as a, open(os.path.join(tmp, f"{jobs}.asm"), "rb") as b:
+                    assert a.read() == b.read(), f"{name} {mode} differs with {jobs} jobs"
+                print(
+                    f"{name + ' + OS':<14}{mode:<16}{len(src):>6}{times[1] * 1000:>8.1f}ms"
+                    f"{times[jobs] * 1000:>8.1f}ms{times[1] / times[jobs]:>8.2f}x"
+                )
+    print(f"{os.cpu_count()} cpus")
+
+
+def generate_vm(lines: int, seed: int = 0) -> str:
+    """
+    a large .vm file: functions of 20 to 200 commands, each a random mix of the commands the
+    Jack compiler emits, with labels and calls that resolve
+    """
+    rng = random.Random(seed)
+    segments = ["local", "argument", "this", "that", "static", "temp", "pointer"]
+    out = []
+    n = 0
+    while len(out) < lines:
+        size = rng.randint(20, 200)
+        out.append(f"function Gen.f{n} {rng.randint(0, 4)}")
+        labels = [f"L{i}" for i in range(size // 10 + 1)]
+        for label in labels:
+            out.append(f"label {label}")
+            for _ in range(10):
+                r = rng.random()
+                if r < 0.35:
+                    out.append(f"push constant {rng.choice([0, 1, 2, rng.randint(0, 32767)])}")
+                elif r < 0.55:
+                    segment = rng.choice(segments)
+                    out.append(f"push {segment} {rng.randint(0, 1 if segment == 'pointer' else 7)}")
+                elif r < 0.7:
+                    segment = rng.choice(segments)
+                    out.append(f"pop {segment} {rng.randint(0, 1 if segment == 'pointer' else 7)}")
+                elif r < 0.85:
+                    out.append(rng.choice(["add", "sub", "neg", "and", "or", "not", "eq", "gt", "lt"]))
+                elif r < 0.93:
+                    out.append(f"{rng.choice(['goto', 'if-goto'])} {rng.choice(labels)}")
+                else:
+                    out.append(f"call Gen.f{rng.randint(0, n)} {rng.randint(0, 3)}")
+        out.append("return")
+        n += 1
+    return "\n".join(out[:lines]) + "\n"
+
+
+def throughput(lines: int, repeat: int, modes: list[str]):
+    source = generate_vm(lines)
+    print(f"{lines:,} generated commands")
+    for mode in modes:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            translator.Translator(io.StringIO(source), "Gen", **MODES[mode]).fragment()
+            best = min(best, time.perf_counter() - start)
+        print(f"{mode:<16}{best * 1000:>10.1f}ms{lines / best:>14,.0f} commands/sec")
+
+
+def pruning(modes: list[str]):
+    os_src = sorted(glob.glob(os.path.join(ROOT, "tools", "OS", "*.vm")))
+    widths = [max(18, len(m) + 12) for m in modes]
+    print(f"{'program':<18}{'functions':>10}{'removed':>9}" + "".join(f"{m + ' rom':>{w}}" for m, w in zip(modes, widths)))
+    for name in PROGRAMS:
+        src = sorted(glob.glob(os.path.join(HERE, "..", "11", name, "*.vm"))) + os_src
+        texts = []
+        for file in src:
+            with open(file, "r") as f:
+                texts.append(f.read())
+        _, removed = translator.eliminate_dead_functions(texts)
+        functions = sum(text.count("function ") for text in texts)
+        cells = []
+        for mode, w in zip(modes, widths):
+            before, after = rom_size(translate(src, mode)), rom_size(translate(src, mode, prune=True))
+            cells.append(f"{f'{before:,} -> {after:,}':>{w}}")
+        print(f"{name + ' + OS':<18}{functions:>10}{len(removed):>9}{''.join(cells)}")
+        print(f"  removed: {' '.join(removed)}")
+
+
+if __name__ == "__main__":
+    main()
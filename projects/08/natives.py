@@ -0,0 +1,176 @@
+"""
+Python versions of the OS functions the programs spend most of their time in
+
+Every native leaves RAM the way the VM code of tools/OS would: the same heap blocks and free
+list, the same screen words, the same writes to the OS's own arrays (Math.divide keeps its
+doubling table on the heap) and the same value in temp 0. Only the stack above SP, where the VM
+code keeps its frame and locals, is not reproduced. When the VM code would call Sys.error the
+native returns None and the VM code runs instead.
+
+A native is registered under the function's name as a factory that gets the VirtualMachine (to
+look up the addresses of the OS's statics) and returns the function the VM calls as
+native(ram, *arguments).
+
+usage: vm = vmemulator.VirtualMachine(files)
+       natives.install(vm)                      # all of them
+       natives.install(vm, ["Math.multiply"])   # or some
+       vm.unhook("Math.multiply")               # and back to the VM code
+"""
+import typing
+
+import vmemulator
+from vmemulator import TEMP, to_signed
+
+# function name -> factory(vm) -> native(ram, *arguments)
+NATIVES = {}
+
+
+def native(name: str):
+    def register(factory: typing.Callable):
+        NATIVES[name] = factory
+        return factory
+
+    return register
+
+
+def install(vm: vmemulator.VirtualMachine, names: typing.Iterable[str] = None):
+    """hooks the natives of the loaded OS functions, every one of them if names is None"""
+    for name in NATIVES if names is None else names:
+        if name not in NATIVES:
+            raise Exception(f"Unknown native - {name}")
+        if name in vm.functions:
+            vm.hook(name, NATIVES[name](vm))
+
+
+def static(vm: vmemulator.VirtualMachine, scope: str, index: int) -> int:
+    """the RAM address of a static, the OS classes reach theirs through the same numbering"""
+    if (scope, index) not in vm.statics:
+        raise Exception(f"Unknown static - {scope} {index}")
+    return vm.statics[(scope, index)]
+
+
+@native("Math.multiply")
+def multiply(vm: vmemulator.VirtualMachine):
+    # shift and add over the bits of |y|, negated when the signs differ, is x * y mod 2^16
+    return lambda ram, x, y: (x * y) & 0xFFFF
+
+
+def _divide(ram: list[int], two: int, table: int, x: int, y: int) -> int:
+    """
+    Math.divide step by step: its table of y, 2y, 4y... lives on the heap so it has to be
+    written the same way
+    """
+    sx, sy = to_signed(x), to_signed(y)
+    neg = (sx < 0 < sy) or (sy < 0 < sx)
+    y = -sy & 0xFFFF if sy < 0 else y
+    x = -sx & 0xFFFF if sx < 0 else x
+    ram[table] = ram[TEMP] = y
+    i = 0
+    overflow = False
+    while i < 15 and not overflow:
+        d = ram[table + i]
+        overflow = to_signed((32767 - (d - 1)) & 0xFFFF) < to_signed((d - 1) & 0xFFFF)
+        if not overflow:
+            ram[table + i + 1] = ram[TEMP] = (d + d) & 0xFFFF
+            overflow = to_signed((d + d - 1) & 0xFFFF) > to_signed((x - 1) & 0xFFFF)
+            if not overflow:
+                i += 1
+    result = 0
+    while i > -1:
+        d = ram[table + i]
+        if not to_signed((d - 1) & 0xFFFF) > to_signed((x - 1) & 0xFFFF):
+            result = (result + ram[two + i]) & 0xFFFF
+            x = (x - d) & 0xFFFF
+        i -= 1
+    return -result & 0xFFFF if neg else result
+
+
+@native("Math.divide")
+def divide(vm: vmemulator.VirtualMachine):
+    two, table = static(vm, "Math", 0), static(vm, "Math", 1)
+
+    def divide(ram, x, y):
+        if y == 0:
+            return None
+        return _divide(ram, ram[two], ram[table], x, y)
+
+    return divide
+
+
+@native("Memory.alloc")
+def alloc(vm: vmemulator.VirtualMachine):
+    """
+    first fit over the list of [size, next] blocks from 2048, merging a free block with the one
+    after it while looking
+    """
+
+    def alloc(ram, size):
+        size = to_signed(size)
+        if size < 0:
+            return None
+        size = size or 1
+        segment = 2048
+        while segment < 16383 and to_signed(ram[segment]) < size:
+            following = ram[segment + 1]
+            if ram[segment] == 0 or to_signed(following) > 16382 or ram[following] == 0:
+                segment = following
+            else:
+                ram[segment] = (ram[segment + 1] - segment + ram[following]) & 0xFFFF
+                ram[segment + 1] = segment + 2 if ram[following + 1] == following + 2 else ram[following + 1]
+        if segment + size > 16379:
+            return None
+        if to_signed(ram[segment]) > size + 2:
+            ram[segment + size + 2] = (ram[segment] - size - 2) & 0xFFFF
+            ram[segment + size + 3] = segment + size + 4 if ram[segment + 1] == segment + 2 else ram[segment + 1]
+            ram[segment + 1] = segment + size + 2
+        ram[segment] = ram[TEMP] = 0
+        return segment + 2
+
+    return alloc
+
+
+@native("String.appendChar")
+def append_char(vm: vmemulator.VirtualMachine):
+    # a string is [capacity, chars, length]
+    def append_char(ram, this, c):
+        if ram[this + 2] == ram[this]:
+            return None
+        ram[ram[this + 1] + ram[this + 2]] = ram[TEMP] = c
+        ram[this + 2] = (ram[this + 2] + 1) & 0xFFFF
+        return this
+
+    return append_char
+
+
+@native("Screen.drawRectangle")
+def draw_rectangle(vm: vmemulator.VirtualMachine):
+    """
+    fills the words of every row between the left and the right edge, the partial words at both
+    ends are masked with Screen's own table of powers of two
+    """
+    bit, screen, color = static(vm, "Screen", 0), static(vm, "Screen", 1), static(vm, "Screen", 2)
+    two, table = static(vm, "Math", 0), static(vm, "Math", 1)
+
+    def draw_rectangle(ram, x1, y1, x2, y2):
+        x1, y1, x2, y2 = (to_signed(v) for v in (x1, y1, x2, y2))
+        if x1 > x2 or y1 > y2 or x1 < 0 or x2 > 511 or y1 < 0 or y2 > 255:
+            return None
+        # the VM code gets the columns from Math.divide, which rewrites its table
+        first = _divide(ram, ram[two], ram[table], x1, 16)
+        last = _divide(ram, ram[two], ram[table], x2, 16)
+        powers = ram[bit]
+        left = (ram[powers + x1 - first * 16] - 1) & 0xFFFF ^ 0xFFFF
+        right = (ram[powers + x2 - last * 16 + 1] - 1) & 0xFFFF
+        base, width = ram[screen], last - first
+        words = [left] + [0xFFFF] * (width - 1) + [right] if width else [left & right]
+        black = ram[color]
+        for row in range(y1 * 32 + first, y2 * 32 + first + 1, 32):
+            for address, mask in enumerate(words, base + row):
+                if black:
+                    ram[address] |= mask
+                else:
+                    ram[address] &= mask ^ 0xFFFF
+        ram[TEMP] = 0
+        return 0
+
+    return draw_rectangle
@@ -0,0 +1,129 @@
+import copy
+import os
+import random
+
+import pytest
+import natives
+import vmemulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EDGES = [0, 1, -1, 2, 15, 16, 17, 255, 256, 32767, -32767, -32768]
+
+
+def boot(tmp_path) -> vmemulator.VirtualMachine:
+    """the OS after Sys.init with an empty Main.main"""
+    (tmp_path / "Main.vm").write_text("function Main.main 0\npush constant 0\nreturn\n")
+    vm = vmemulator.VirtualMachine(vmemulator.collect(str(tmp_path)))
+    vm.run(10_000_000)
+    assert vm.halted
+    return vm
+
+
+def visible(vm: vmemulator.VirtualMachine) -> list[int]:
+    """everything but the stack above SP, where the VM code leaves its frames"""
+    return vm.ram[: vm.ram[0]] + vm.ram[2048:]
+
+
+def call(vm: vmemulator.VirtualMachine, name: str, *arguments: int) -> int | str:
+    try:
+        return vm.call(name, *arguments)
+    except Exception as e:
+        return str(e)
+
+
+@pytest.fixture(scope="module")
+def booted(tmp_path_factory):
+    return boot(tmp_path_factory.mktemp("boot"))
+
+
+@pytest.fixture
+def machines(booted):
+    """two machines in the same state, the second one runs the natives"""
+    code, native = copy.deepcopy(booted), copy.deepcopy(booted)
+    natives.install(native)
+    return code, native
+
+
+def assert_same(machines, name: str, cases: list[tuple]):
+    code, native = machines
+    for arguments in cases:
+        assert call(code, name, *arguments) == call(native, name, *arguments), arguments
+        assert visible(code) == visible(native), arguments
+
+
+class TestNatives:
+    def test_multiply(self, machines):
+        rng = random.Random(0)
+        cases = [(x, y) for x in EDGES for y in EDGES]
+        cases += [(rng.randint(-32768, 32767), rng.randint(-32768, 32767)) for _ in range(200)]
+        assert_same(machines, "Math.multiply", cases)
+
+    def test_divide(self, machines):
+        rng = random.Random(1)
+        cases = [(x, y) for x in EDGES for y in EDGES if y]
+        cases += [(rng.randint(-32768, 32767), rng.randint(-300, 300) or 7) for _ in range(200)]
+        assert_same(machines, "Math.divide", cases)
+
+    def test_divide_by_zero(self, machines):
+        assert_same(machines, "Math.divide", [(5, 0)])
+        assert "Program halted" in call(machines[1], "Math.divide", 5, 0)
+
+    def test_alloc(self, machines):
+        rng = random.Random(2)
+        code, native = machines
+        blocks = []
+        for _ in range(300):
+            if blocks and rng.random() < 0.4:
+                block = blocks.pop(rng.randrange(len(blocks)))
+                assert call(code, "Memory.deAlloc", block) == call(native, "Memory.deAlloc", block)
+            else:
+                size = rng.choice([0, 1, 2, 3, rng.randint(1, 60)])
+                block = call(code, "Memory.alloc", size)
+                assert call(native, "Memory.alloc", size) == block
+                blocks.append(block)
+            assert visible(code) == visible(native)
+        assert_same(machines, "Memory.alloc", [(-1,)])
+
+    def test_append_char(self, machines):
+        code, native = machines
+        string = call(code, "String.new", 5)
+        assert call(native, "String.new", 5) == string
+        # the sixth does not fit
+        assert_same(machines, "String.appendChar", [(string, c) for c in b"Hello!"])
+        assert call(native, "String.length", string) == 5
+
+    def test_draw_rectangle(self, machines):
+        rng = random.Random(3)
+        cases = [(0, 0, 511, 255), (5, 5, 5, 5), (16, 1, 31, 1), (15, 2, 16, 9), (3, 4, 2, 4), (0, 0, 512, 0)]
+        for _ in range(40):
+            x1, x2 = sorted(rng.randint(0, 511) for _ in range(2))
+            y1, y2 = sorted(rng.randint(0, 255) for _ in range(2))
+            cases.append((x1, y1, x2, y2))
+        code, native = machines
+        for i, case in enumerate(cases):
+            color = i % 3 != 0
+            assert call(code, "Screen.setColor", color) == call(native, "Screen.setColor", color)
+            assert_same(machines, "Screen.drawRectangle", [case])
+
+    def test_switch(self, machines):
+        code, native = machines
+        native.unhook("Math.multiply")
+        cycles = native.cycles
+        native.call("Math.multiply", 300, 7)
+        assert native.cycles > cycles + 100
+        natives.install(native, ["Math.multiply"])
+        cycles = native.cycles
+        assert native.call("Math.multiply", 300, 7) == 2100
+        assert native.cycles == cycles + 1
+
+    @pytest.mark.parametrize("program", ["Seven", "ComplexArrays", "Square"])
+    def test_programs(self, program):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", program))
+        code, native = vmemulator.VirtualMachine(src), vmemulator.VirtualMachine(src)
+        natives.install(native)
+        # Square waits for a key forever, it is compared once it drew the square
+        code.run(3_000_000)
+        native.run(code.cycles if code.halted else 1_000_000)
+        assert native.cycles < code.cycles
+        assert code.ram[16:256] == native.ram[16:256]
+        assert code.ram[2048:vmemulator.KBD] == native.ram[2048:vmemulator.KBD]
@@ -0,0 +1,122 @@
+import glob
+import json
+import os
+import sys
+
+import natives
+import profiler
+import translator
+import vmemulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+import emulator  # noqa: E402
+
+# Sys.init calls Main.twice 3 times, Main.twice loops twice calling Main.one every time
+PROGRAM = """function Sys.init 0
+push constant 3
+pop temp 0
+label LOOP
+call Main.twice 0
+pop temp 1
+push temp 0
+push constant 1
+sub
+pop temp 0
+push temp 0
+if-goto LOOP
+label END
+goto END
+function Main.twice 1
+push constant 2
+pop local 0
+label AGAIN
+call Main.one 0
+pop temp 1
+push local 0
+push constant 1
+sub
+pop local 0
+push local 0
+if-goto AGAIN
+push constant 0
+return
+function Main.one 0
+push constant 1
+return
+"""
+
+
+def profile(tmp_path, text: str = PROGRAM) -> profiler.Profile:
+    (tmp_path / "Sys.vm").write_text(text)
+    vm = vmemulator.VirtualMachine([str(tmp_path / "Sys.vm")])
+    result = profiler.Profile(vm)
+    result.run(10_000)
+    assert vm.halted
+    return result
+
+
+class TestProfiler:
+    def test_functions(self, tmp_path):
+        functions = profile(tmp_path).functions()
+        assert {name: row["calls"] for name, row in functions.items()} == {"Sys.init": 1, "Main.twice": 3, "Main.one": 6}
+        # function, push constant 1, return
+        assert functions["Main.one"]["instructions"] == functions["Main.one"]["inclusive_instructions"] == 18
+        twice = functions["Main.twice"]
+        assert twice["inclusive_instructions"] == twice["instructions"] + 18
+        assert functions["Sys.init"]["inclusive_instructions"] == sum(row["instructions"] for row in functions.values())
+
+    def test_labels(self, tmp_path):
+        labels = profile(tmp_path).labels()
+        assert labels == {"Main.twice$AGAIN": 6, "Sys.init$LOOP": 3, "Sys.init$END": 1}
+
+    def test_collapsed(self, tmp_path):
+        result = profile(tmp_path)
+        lines = result.collapsed().splitlines()
+        assert "Sys.init;Main.twice;Main.one 18" in lines
+        assert sum(int(line.split()[-1]) for line in lines) == result.vm.cycles
+        weights = result.collapsed("cycles").splitlines()
+        assert sum(int(line.split()[-1]) for line in weights) == result.summary()["cycles"]
+
+    def test_recursion_counted_once(self, tmp_path):
+        text = "function Sys.init 0\npush constant 5\ncall Main.down 1\nlabel END\ngoto END\n"
+        text += "function Main.down 0\npush argument 0\nif-goto MORE\npush constant 0\nreturn\nlabel MORE\n"
+        text += "push argument 0\npush constant 1\nsub\ncall Main.down 1\nreturn\n"
+        functions = profile(tmp_path, text).functions()
+        down = functions["Main.down"]
+        assert down["calls"] == 6
+        assert down["inclusive_instructions"] == down["instructions"]
+
+    def test_same_run(self):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", "Seven"))
+        plain, profiled = vmemulator.VirtualMachine(src), vmemulator.VirtualMachine(src)
+        plain.run()
+        result = profiler.Profile(profiled)
+        result.run(500_000)
+        result.run()
+        assert (plain.cycles, plain.pc, plain.ram) == (profiled.cycles, profiled.pc, profiled.ram)
+        summary = json.loads(json.dumps(result.summary()))
+        assert summary["instructions"] == plain.cycles
+        assert sum(row["instructions"] for row in summary["functions"].values()) == plain.cycles
+        assert summary["functions"]["Sys.init"]["inclusive_instructions"] == plain.cycles
+
+    def test_native_calls(self):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", "Seven"))
+        vm = vmemulator.VirtualMachine(src)
+        natives.install(vm, ["Math.multiply"])
+        result = profiler.Profile(vm)
+        result.run()
+        multiply = result.functions()["Math.multiply"]
+        assert multiply["calls"] == multiply["native_calls"] > 0
+        assert multiply["inclusive_instructions"] == 0
+
+    def test_cycles_estimate(self, tmp_path):
+        src = sorted(glob.glob(os.path.join(HERE, "FunctionCalls", "FibonacciElement", "*.vm")))
+        result = profiler.Profile(vmemulator.VirtualMachine(src))
+        result.run(100_000)
+        translator.build(src, str(tmp_path / "out.asm"))
+        computer = emulator.Computer(emulator._assemble(str(tmp_path / "out.asm")))
+        computer.run(100_000)
+        assert computer.halted
+        # the bootstrap is not part of the VM program
+        assert 0.9 < result.summary()["cycles"] / computer.cycles <= 1
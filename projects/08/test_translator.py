@@ -0,0 +1,278 @@
+import glob
+import io
+import os
+import shutil
+import sys
+
+import pytest
+import translator
+import vmemulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+sys.path.insert(0, os.path.join(HERE, "..", "06"))
+import assembler  # noqa: E402
+import emulator  # noqa: E402
+
+
+FUNCTION_CALLS = ["08/FunctionCalls/FibonacciElement", "08/FunctionCalls/StaticsTest", "08/FunctionCalls/NestedCall"]
+TESTS = [
+    "07/StackArithmetic/SimpleAdd",
+    "07/StackArithmetic/StackTest",
+    "07/MemoryAccess/BasicTest",
+    "07/MemoryAccess/PointerTest",
+    "07/MemoryAccess/StaticTest",
+    "08/ProgramFlow/BasicLoop",
+    "08/ProgramFlow/FibonacciSeries",
+    "08/FunctionCalls/SimpleFunction",
+    *FUNCTION_CALLS,
+]
+
+
+def translate_test(test: str, tmp: str, **kwargs) -> str:
+    """
+    translates a projects 07 or 08 test into tmp next to its .tst and .cmp files, only the
+    tests with a Sys.vm get the bootstrap code
+    """
+    src = os.path.join(HERE, "..", test)
+    name = os.path.basename(test)
+    for file in glob.glob(os.path.join(src, "*.tst")) + glob.glob(os.path.join(src, "*.cmp")):
+        shutil.copy(file, tmp)
+    vm = sorted(glob.glob(os.path.join(src, "*.vm")))
+    bootstrap = os.path.join(src, "Sys.vm") in vm
+    translator.build(vm, os.path.join(tmp, f"{name}.asm"), bootstrap=bootstrap, **kwargs)
+    return os.path.join(tmp, f"{name}.tst")
+
+
+def run_vm(vm: str, ram: dict[int, int], fuse: bool) -> list[int]:
+    """
+    translates a snippet of VM code without the bootstrap, runs it until it falls into the
+    closing halt loop and returns the RAM that has to be the same with and without fusion
+    """
+    commands = translator.Translator(io.StringIO(vm), "Test", fuse=fuse).parse()
+    asm = [command.toasm() for command in commands] + ["(HALT)", "@HALT", "0;JMP"]
+    program = assembler.Assembler("\n".join(asm).split("\n"), assembler.SymbolTable())
+    program.preprocess()
+    computer = emulator.Computer(program.encode())
+    for address, value in {0: 256, 1: 300, 2: 400, 3: 3000, 4: 3010, **ram}.items():
+        computer.ram[address] = value & 0xFFFF
+    computer.run(10_000)
+    assert computer.halted
+    ram = computer.ram
+    # R13-R15 are scratch and everything above SP is garbage
+    return list(ram[:13]) + list(ram[16 : ram[0]]) + list(ram[300:4096])
+
+
+def assert_fused(vm: str, pattern: type, rams: list[dict[int, int]]):
+    commands = translator.Translator(io.StringIO(vm), "Test", fuse=True).parse()
+    assert any(isinstance(command, pattern) for command in commands)
+    for ram in rams:
+        assert run_vm(vm, ram, fuse=True) == run_vm(vm, ram, fuse=False)
+
+
+# jumps to T when the command in front of it left a true value
+BRANCH = """
+if-goto T
+push constant 1
+pop temp 0
+goto END
+label T
+push constant 2
+pop temp 0
+label END
+"""
+
+
+class TestFusion:
+    @pytest.mark.parametrize(
+        "push, pop",
+        [
+            ("push local 2", "pop that 1"),
+            ("push argument 1", "pop local 9"),
+            ("push constant 7", "pop static 3"),
+            ("push this 0", "pop temp 2"),
+            ("push pointer 1", "pop pointer 0"),
+            ("push static 1", "pop argument 0"),
+        ],
+    )
+    def test_move(self, push, pop):
+        ram = {256: 11, 302: 5, 401: 1234, 3000: 77, 3011: 9, 16: 42, 17: 43}
+        assert_fused(f"{push}\n{pop}\n", translator.Move, [ram])
+
+    @pytest.mark.parametrize("value", [0, 1, 5, 300])
+    @pytest.mark.parametrize("op", ["add", "sub"])
+    def test_increment(self, value, op):
+        vm = f"push local 0\npush constant {value}\n{op}\npop local 1\n"
+        assert_fused(vm, translator.Increment, [{300: x} for x in [0, 1, -1, 32767, -32768]])
+
+    def test_push_jump(self):
+        assert_fused("push local 0" + BRANCH, translator.PushJump, [{300: x} for x in [0, 1, -1, 2]])
+
+    def test_inverted_jump(self):
+        vm = "push local 0\nnot" + BRANCH
+        assert_fused(vm, translator.InvertedJump, [{300: x} for x in [0, 1, -1, 5]])
+
+    @pytest.mark.parametrize("compare", ["eq", "gt", "lt"])
+    @pytest.mark.parametrize("invert", ["", "not\n"])
+    def test_compare_jump(self, compare, invert):
+        vm = f"push local 0\npush local 1\n{compare}\n{invert}" + BRANCH.lstrip()
+        pairs = [(0, 0), (1, 2), (2, 1), (-1, 1), (1, -1), (-5, -5), (32767, -1)]
+        assert_fused(vm, translator.CompareJump, [{300: x, 301: y} for x, y in pairs])
+
+    @pytest.mark.parametrize("test", TESTS)
+    def test_scripts(self, tmp_path, test):
+        tst = translate_test(test, str(tmp_path), fuse=True)
+        assert emulator.TestScript(tst).compare() == []
+
+
+class TestStackCache:
+    @pytest.mark.parametrize("test", TESTS)
+    @pytest.mark.parametrize("fuse", [False, True])
+    def test_scripts(self, tmp_path, test, fuse):
+        tst = translate_test(test, str(tmp_path), cache_top=True, fuse=fuse)
+        assert emulator.TestScript(tst).compare() == []
+
+    def test_spills_before_labels(self):
+        vm = "push constant 3\nlabel L\npush constant 4\nadd\ncall f 2\n"
+        asm = translator.StackCache().translate(translator.Translator(io.StringIO(vm), "Test").parse())
+        spill = "@SP\nAM=M+1\nA=A-1\nM=D"
+        assert asm[1].startswith(spill)
+        assert asm[4].startswith(spill)
+
+
+class TestTranslator:
+    @pytest.mark.parametrize("test", TESTS)
+    def test_scripts(self, tmp_path, test):
+        assert emulator.TestScript(translate_test(test, str(tmp_path))).compare() == []
+
+    @pytest.mark.parametrize("test", FUNCTION_CALLS)
+    def test_compact(self, tmp_path, test):
+        tst = translate_test(test, str(tmp_path), compact=True)
+        assert emulator.TestScript(tst).compare() == []
+
+    def test_compact_is_smaller(self, tmp_path):
+        sizes = []
+        for compact in (False, True):
+            translate_test("08/FunctionCalls/FibonacciElement", str(tmp_path), compact=compact)
+            sizes.append(len(emulator._assemble(os.path.join(str(tmp_path), "FibonacciElement.asm"))))
+        assert sizes[1] < sizes[0]
+
+
+class TestLabels:
+    def test_deterministic(self, tmp_path):
+        src = sorted(glob.glob(os.path.join(HERE, "..", "11", "Square", "*.vm")))
+        outputs = []
+        for name in ["a.asm", "b.asm"]:
+            translator.build(src, str(tmp_path / name), compact=True, cache_top=True)
+            outputs.append((tmp_path / name).read_text())
+        assert outputs[0] == outputs[1]
+
+    def test_labels_belong_to_functions(self):
+        vm = "function A.f 0\nlabel L\ngoto L\nfunction A.g 0\nlabel L\ngoto L\ncall A.f 0\n"
+        asm = translator.Translator(io.StringIO(vm), "A").fragment().split("\n")
+        labels = [line.split()[0] for line in asm if line.startswith("(")]
+        assert labels == ["(A.f)", "(A.f$L)", "(A.g)", "(A.g$L)", "(A.f$ret.A.6)"]
+
+
+class TestTranslationCache:
+    def test_rebuild(self, tmp_path):
+        src = tmp_path / "src"
+        src.mkdir()
+        for file in glob.glob(os.path.join(HERE, "..", "11", "Square", "*.vm")):
+            shutil.copy(file, src)
+        files = sorted(str(f) for f in src.iterdir())
+        translator.build(files, str(tmp_path / "plain.asm"))
+
+        cache = translator.TranslationCache(str(tmp_path / "cache"))
+        translator.build(files, str(tmp_path / "cold.asm"), cache=cache)
+        assert (cache.hits, cache.misses) == (0, 3)
+        translator.build(files, str(tmp_path / "warm.asm"), cache=cache)
+        assert (cache.hits, cache.misses) == (3, 3)
+        assert (tmp_path / "plain.asm").read_text() == (tmp_path / "cold.asm").read_text() == (tmp_path / "warm.asm").read_text()
+
+        with open(src / "Main.vm", "a") as f:
+            f.write("function Main.extra 0\npush constant 0\nreturn\n")
+        translator.build(files, str(tmp_path / "edit.asm"), cache=cache)
+        assert (cache.hits, cache.misses) == (5, 4)
+        assert "(Main.extra)" in (tmp_path / "edit.asm").read_text()
+
+    def test_mode_is_part_of_the_key(self, tmp_path):
+        files = sorted(glob.glob(os.path.join(HERE, "..", "11", "Seven", "*.vm")))
+        cache = translator.TranslationCache(str(tmp_path / "cache"))
+        translator.build(files, str(tmp_path / "a.asm"), cache=cache)
+        translator.build(files, str(tmp_path / "b.asm"), fuse=True, cache=cache)
+        assert cache.misses == 2
+
+
+class TestJobs:
+    @pytest.mark.parametrize("mode", [{}, {"compact": True, "fuse": True, "cache_top": True}])
+    def test_same_as_serial(self, tmp_path, mode):
+        src = sorted(glob.glob(os.path.join(HERE, "..", "11", "Pong", "*.vm")))
+        src += sorted(glob.glob(os.path.join(HERE, "..", "..", "tools", "OS", "*.vm")))
+        translator.build(src, str(tmp_path / "serial.asm"), **mode)
+        translator.build(src, str(tmp_path / "jobs.asm"), jobs=2, **mode)
+        assert (tmp_path / "serial.asm").read_bytes() == (tmp_path / "jobs.asm").read_bytes()
+
+    def test_cache_with_jobs(self, tmp_path):
+        src = sorted(glob.glob(os.path.join(HERE, "..", "11", "Square", "*.vm")))
+        cache = translator.TranslationCache(str(tmp_path / "cache"))
+        translator.build(src, str(tmp_path / "a.asm"), cache=cache, jobs=2)
+        translator.build(src, str(tmp_path / "b.asm"), cache=cache, jobs=2)
+        assert (cache.hits, cache.misses) == (3, 3)
+        assert (tmp_path / "a.asm").read_bytes() == (tmp_path / "b.asm").read_bytes()
+
+
+class TestMain:
+    def test_no_bootstrap(self, tmp_path, monkeypatch):
+        src = tmp_path / "SimpleAdd.vm"
+        shutil.copy(os.path.join(HERE, "..", "07", "StackArithmetic", "SimpleAdd", "SimpleAdd.vm"), src)
+        translator.build([str(src)], str(tmp_path / "expected.asm"), bootstrap=False)
+        monkeypatch.setattr(sys, "argv", ["translator.py", "--src", str(src), "--no-bootstrap"])
+        translator.main()
+        assert (tmp_path / "SimpleAdd.asm").read_text() == (tmp_path / "expected.asm").read_text()
+
+
+class TestPrune:
+    PROGRAM = "function Sys.init 0\ncall Main.used 0\nlabel END\ngoto END\nfunction Main.unused 0\ncall Main.used 0\nreturn\nfunction Main.used 0\npush constant 1\nreturn\n"
+
+    def test_unreached_functions(self):
+        texts, removed = translator.eliminate_dead_functions([self.PROGRAM])
+        assert removed == ["Main.unused"]
+        # line numbers stay the same, the return labels are made from them
+        lines = texts[0].split("\n")
+        assert len(lines) == len(self.PROGRAM.split("\n"))
+        assert lines[4:7] == ["", "", ""]
+        assert lines[7] == "function Main.used 0"
+
+    def test_keywords_any_case(self):
+        program = self.PROGRAM.replace("function Main.unused", "FUNCTION Main.unused").replace("call Main.used", "Call Main.used")
+        assert translator.eliminate_dead_functions([program])[1] == ["Main.unused"]
+
+    def test_needs_bootstrap(self, tmp_path):
+        (tmp_path / "Sys.vm").write_text(self.PROGRAM)
+        with pytest.raises(Exception, match="needs the bootstrap"):
+            translator.build([str(tmp_path / "Sys.vm")], str(tmp_path / "out.asm"), bootstrap=False, prune=True)
+
+    def test_program(self, tmp_path):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", "Seven"))
+        mode = {"compact": True, "fuse": True, "cache_top": True}
+        translator.build(src, str(tmp_path / "all.asm"), **mode)
+        removed = translator.build(src, str(tmp_path / "pruned.asm"), prune=True, **mode)
+        assert "Sys.wait" in removed and "Main.main" not in removed
+        assert "(Sys.wait)" not in (tmp_path / "pruned.asm").read_text()
+        assert len(emulator._assemble(str(tmp_path / "pruned.asm"))) < len(emulator._assemble(str(tmp_path / "all.asm")))
+        # the pruned program still draws the same screen and leaves the same heap
+        texts = []
+        for file in src:
+            with open(file, "r") as f:
+                texts.append(f.read())
+        texts, _ = translator.eliminate_dead_functions(texts)
+        files = []
+        for file, text in zip(src, texts):
+            (tmp_path / os.path.basename(file)).write_text(text)
+            files.append(str(tmp_path / os.path.basename(file)))
+        whole, pruned = vmemulator.VirtualMachine(src), vmemulator.VirtualMachine(files)
+        whole.run(10_000_000)
+        pruned.run(10_000_000)
+        assert whole.halted and pruned.halted
+        assert whole.ram[2048:vmemulator.KBD] == pruned.ram[2048:vmemulator.KBD]
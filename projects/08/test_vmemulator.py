@@ -0,0 +1,99 @@
+import glob
+import os
+import re
+import sys
+
+import pytest
+import translator
+import vmemulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+sys.path.insert(0, os.path.join(HERE, "..", "06"))
+import assembler  # noqa: E402
+import blocks  # noqa: E402
+import emulator  # noqa: E402
+
+from test_translator import TESTS  # noqa: E402
+
+
+def expected_ram(test: str) -> tuple[dict[int, int], dict[int, int]]:
+    """
+    the RAM a projects 07 or 08 test sets before running and the RAM its .cmp expects after
+    """
+    path = os.path.join(HERE, "..", test)
+    name = os.path.basename(test)
+    with open(os.path.join(path, f"{name}.tst"), "r") as f:
+        before = {int(a): int(v) & 0xFFFF for a, v in re.findall(r"set RAM\[(\d+)\]\s+(-?\d+)", f.read())}
+    after = {}
+    with open(os.path.join(path, f"{name}.cmp"), "r") as f:
+        lines = [line for line in f if line.strip()]
+    for header, values in zip(lines[::2], lines[1::2]):
+        addresses = [int(a) for a in re.findall(r"RAM\[(\d+)", header)]
+        after.update(zip(addresses, (int(v) & 0xFFFF for v in values.strip(" |\n").split("|"))))
+    return before, after
+
+
+class TestVirtualMachine:
+    @pytest.mark.parametrize("test", TESTS)
+    def test_scripts(self, test):
+        src = sorted(glob.glob(os.path.join(HERE, "..", test, "*.vm")))
+        bootstrap = any(os.path.basename(file) == "Sys.vm" for file in src)
+        before, after = expected_ram(test)
+        vm = vmemulator.VirtualMachine()
+        for address, value in before.items():
+            vm.ram[address] = value
+        vm.load(src, bootstrap)
+        vm.run(100_000)
+        assert vm.halted
+        assert {address: vm.ram[address] for address in after} == after
+
+    @pytest.mark.parametrize("program, ram", [("Seven", {}), ("ConvertToBin", {8000: 0b1011010})])
+    def test_matches_cpu(self, tmp_path, program, ram):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", program))
+        vm = vmemulator.VirtualMachine(src)
+        translator.build(src, str(tmp_path / "out.asm"), compact=True, fuse=True, cache_top=True)
+        symbols = assembler.SymbolTable()
+        with open(tmp_path / "out.asm", "r") as f:
+            program = assembler.Assembler(f, symbols)
+            program.preprocess()
+            computer = blocks.BlockComputer(program.encode())
+        for address, value in ram.items():
+            vm.ram[address] = computer.ram[address] = value
+        vm.run(10_000_000)
+        assert vm.halted
+        # the translated Sys.halt loops forever, run until the CPU is in it
+        while not symbols["Sys.halt"] <= computer.pc < symbols["Sys.wait"]:
+            assert computer.cycles < 100_000_000
+            computer.run(100_000)
+        # statics, heap and screen, the stack holds return addresses that differ
+        assert vm.ram[16:256] == list(computer.ram[16:256])
+        assert vm.ram[2048:emulator.KBD] == list(computer.ram[2048:emulator.KBD])
+
+    def test_os_is_replaced(self, tmp_path):
+        (tmp_path / "Math.vm").write_text("function Math.init 0\npush constant 0\nreturn\n")
+        files = vmemulator.collect(str(tmp_path))
+        assert [os.path.basename(file) for file in files].count("Math.vm") == 1
+        assert files[0] == str(tmp_path / "Math.vm")
+
+    def test_unknown_function(self, tmp_path):
+        (tmp_path / "Sys.vm").write_text("function Sys.init 0\ncall Main.missing 0\nreturn\n")
+        with pytest.raises(Exception, match="Unknown function - Main.missing"):
+            vmemulator.VirtualMachine([str(tmp_path / "Sys.vm")])
+
+    def test_single_file(self, monkeypatch, capsys):
+        src = os.path.join(HERE, "..", "07", "StackArithmetic", "SimpleAdd", "SimpleAdd.vm")
+        monkeypatch.setattr(sys, "argv", ["vmemulator.py", "--src", src, "--no-bootstrap", "--set", "0=256", "--dump", "256"])
+        vmemulator.main()
+        out = capsys.readouterr().out.splitlines()
+        assert out[0].startswith("halted after 3 VM commands")
+        assert out[1] == "RAM[256] = 15"
+
+    def test_run_in_steps(self):
+        src = vmemulator.collect(os.path.join(HERE, "..", "11", "Seven"))
+        whole, steps = vmemulator.VirtualMachine(src), vmemulator.VirtualMachine(src)
+        whole.run(50_000)
+        while steps.cycles + 997 <= 50_000:
+            steps.run(997)
+        steps.run(50_000 - steps.cycles)
+        assert (whole.pc, whole.cycles, whole.ram) == (steps.pc, steps.cycles, steps.ram)
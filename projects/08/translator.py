@@ -24,18 +24,47 @@ make sense out of each VM command, that is, understand what the
  the Hack platform. The VMTranslator drives the translation process.
 """
 
-import argparse, uuid
+import argparse, hashlib
+from concurrent.futures import ProcessPoolExecutor
 from abc import ABC, abstractmethod
+import io
 from io import TextIOWrapper
 import os
+import sys
 
 SEGMENT_TABLE = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+# RAM address of entry 0 of the segments that are not behind a pointer
+BASE_ADDRESS = {"temp": 5, "pointer": 3}
+
+
+def _strip(asm: str) -> str:
+    """
+    removes the indentation and blank lines of an asm template, templates are stripped once
+    when the module is loaded and only formatted per command
+    """
+    return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
 
 
 class Command(ABC):
+    __slots__ = ()
+
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> "Command":
+        """
+        the command of a line, args are the tokens after its name, index is the line number and
+        function the function the line is in
+        """
+        return cls()
+
     @abstractmethod
-    def toasm(self):
-        raise NotImplementedError
+    def toasm(self) -> str:
+        """the translation of the command"""
+
+    def comment(self) -> str:
+        """
+        the first line of toasm(), a comment naming the command
+        """
+        return self.toasm().split("\n", 1)[0]
 
 
 class Push(Command):
@@ -43,97 +72,112 @@ class Push(Command):
     push the value from the memory segment onto the stack
     """
 
-    def __init__(self, args: list[str], scope: str):
-        self.segment = args[0]
-        self.value = int(args[1])
-        self.scope = scope
-
-    def toasm(self) -> str:
-        asm = f"""
-        // push {self.segment} {self.value} - {self.scope}
-        """
-        if self.segment == "constant":
-            asm += f"""
-            @{self.value}
+    __slots__ = ("segment", "value", "scope")
+    # loads the value into D
+    LOAD = {
+        "constant": _strip("""
+            @{value}
             D=A
-            """
-        elif self.segment == "temp":
-            asm += f"""
-            @{self.value + 5}
+        """),
+        "temp": _strip("""
+            @{address}
             D=M
-            """
-        elif self.segment == "pointer":
-            asm += f"""
-            @{self.value + 3}
+        """),
+        "pointer": _strip("""
+            @{address}
             D=M
-            """
-        elif self.segment == "static":
-            asm += f"""
-            @{self.scope}.{self.value}
+        """),
+        "static": _strip("""
+            @{scope}.{value}
             D=M
-            """
-        else:
-            asm += f"""
-            @{self.value}
+        """),
+        **dict.fromkeys(SEGMENT_TABLE, _strip("""
+            @{value}
             D=A
-            @{SEGMENT_TABLE[self.segment]}
+            @{base}
             A=M
             A=A+D
             D=M
-            """
-        asm += f"""
+        """)),
+    }
+    ASM = {
+        segment: _strip("// push {segment} {value} - {scope}\n" + load + """
             @SP
             A=M
             M=D
             @SP
             M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
-
+        """)
+        for segment, load in LOAD.items()
+    }
 
-class Pop(Command):
     def __init__(self, args: list[str], scope: str):
         self.segment = args[0]
         self.value = int(args[1])
         self.scope = scope
 
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, scope)
+
+    def _format(self, template: str) -> str:
+        segment, value = self.segment, self.value
+        return template.format(
+            segment=segment,
+            value=value,
+            scope=self.scope,
+            address=value + BASE_ADDRESS.get(segment, 0),
+            base=SEGMENT_TABLE.get(segment),
+        )
+
     def toasm(self) -> str:
+        return self._format(self.ASM[self.segment])
+
+    def load(self) -> str:
+        """
+        the part of the push that loads the value into D
+        """
+        return self._format(self.LOAD[self.segment])
+
+    def comment(self) -> str:
+        return f"// push {self.segment} {self.value} - {self.scope}"
+
+
+class Pop(Command):
+    __slots__ = ("segment", "value", "scope")
+    # loads the address to pop to into D
+    ADDRESS = {
         # Temp: This 8-word segment is also fixed and mapped directly on RAM
         # locations 5 – 12. With that in mind, any access to temp i, where i varies from
         # 0 to 7, should be translated into assembly code that accesses RAM location 5+i
-        asm = f"""
-        // pop {self.segment} {self.value} - {self.scope}
-        """
-        if self.segment == "temp":
-            asm += f"""
-            @{self.value + 5}
+        "temp": _strip("""
+            @{address}
             D=A
-            """
+        """),
         # Unlike the virtual segments, the pointer segment
         # contains exactly two values and is mapped directly onto RAM locations 3
         # and 4.
-        elif self.segment == "pointer":
-            asm += f"""
-            @{self.value + 3}
+        "pointer": _strip("""
+            @{address}
             D=A
-            """
+        """),
         # Static variables are mapped on addresses 16 to 255 of the host
         # RAM.
-        elif self.segment == "static":
-            asm += f"""
-            @{self.scope}.{self.value}
+        "static": _strip("""
+            @{scope}.{value}
             D=A
-            """
-        else:
-            asm += f"""
-            @{self.value}
+        """),
+        **dict.fromkeys(SEGMENT_TABLE, _strip("""
+            @{value}
             D=A
-            @{SEGMENT_TABLE[self.segment]}
+            @{base}
             A=M
             A=A+D
             D=A
-            """
-        asm += f"""
+        """)),
+    }
+    ASM = {
+        segment: _strip("// pop {segment} {value} - {scope}\n" + address + """
             @R13
             M=D
             @SP
@@ -144,274 +188,392 @@ class Pop(Command):
             @R13
             A=M
             M=D
+        """)
+        for segment, address in ADDRESS.items()
+    }
+
+    def __init__(self, args: list[str], scope: str):
+        self.segment = args[0]
+        self.value = int(args[1])
+        self.scope = scope
+
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, scope)
+
+    def fixed(self) -> str | None:
+        """
+        the address of a temp, pointer or static entry, None for the segments behind a pointer
         """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        if self.segment == "temp":
+            return str(self.value + 5)
+        elif self.segment == "pointer":
+            return str(self.value + 3)
+        elif self.segment == "static":
+            return f"{self.scope}.{self.value}"
+        return None
+
+    def store(self) -> str | None:
+        """
+        writes D to the popped location without going through the stack, None for segments
+        behind a pointer with an index too large to reach with A=A+1
+        """
+        if self.fixed():
+            return f"@{self.fixed()}\nM=D"
+        if self.value < 7:
+            return f"@{SEGMENT_TABLE[self.segment]}\nA=M\n" + "A=A+1\n" * self.value + "M=D"
+        return None
+
+    def toasm(self) -> str:
+        segment, value = self.segment, self.value
+        return self.ASM[segment].format(
+            segment=segment,
+            value=value,
+            scope=self.scope,
+            address=value + BASE_ADDRESS.get(segment, 0),
+            base=SEGMENT_TABLE.get(segment),
+        )
+
+    def comment(self) -> str:
+        return f"// pop {self.segment} {self.value} - {self.scope}"
 
 
 class Sub(Command):
+    __slots__ = ()
+    ASM = _strip("""
+        // sub
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=M-D
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
     def toasm(self) -> str:
-        asm = """
-            // sub
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            AM=M-1
-            D=M-D
-            @SP
-            A=M
-            M=D
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        return self.ASM
 
 
 class Add(Command):
-    def toasm(self):
-        asm = """
-            // add
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            AM=M-1
-            D=D+M
-            @SP
-            A=M
-            M=D
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ()
+    ASM = _strip("""
+        // add
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=D+M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    def toasm(self) -> str:
+        return self.ASM
 
 
 class Neg(Command):
-    def toasm(self):
-        asm = """
-            // neg
-            @SP
-            AM=M-1
-            M=-M
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ()
+    ASM = _strip("""
+        // neg
+        @SP
+        AM=M-1
+        M=-M
+        @SP
+        M=M+1
+    """)
+
+    def toasm(self) -> str:
+        return self.ASM
 
 
 class And(Command):
-    def toasm(self):
-        asm = """
-            // and
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            AM=M-1
-            D=D&M
-            @SP
-            A=M
-            M=D
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ()
+    ASM = _strip("""
+        // and
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=D&M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    def toasm(self) -> str:
+        return self.ASM
 
 
 class Or(Command):
-    def toasm(self):
-        asm = """
-            // or
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            AM=M-1
-            D=D|M
-            @SP
-            A=M
-            M=D
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ()
+    ASM = _strip("""
+        // or
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=D|M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    def toasm(self) -> str:
+        return self.ASM
 
 
 class Not(Command):
-    def toasm(self):
-        asm = """
-            // not
-            @SP
-            M=M-1
-            A=M
-            M=!M
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ()
+    ASM = _strip("""
+        // not
+        @SP
+        M=M-1
+        A=M
+        M=!M
+        @SP
+        M=M+1
+    """)
 
+    def toasm(self) -> str:
+        return self.ASM
 
-class Eq(Command):
-    def toasm(self):
-        id = uuid.uuid4()
-        asm = f"""
-            // eq
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            M=M-1
-            A=M
-            D=M-D
-            @TRUE{id}
-            D;JEQ
-            @SP
-            A=M
-            M=0
-            @CONTINUE{id}
-            0;JMP
-            (TRUE{id})
-            @SP
-            A=M
-            M=-1
-            (CONTINUE{id})
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
 
+class Compare(Command):
+    """
+    eq, gt and lt, in compact mode the site only passes its return address in D and jumps to
+    the matching entry of the shared $$compare routine. Their labels are named after the file
+    and the line, so translating the same file twice gives the same code
+    """
 
-class Gt(Command):
-    def toasm(self):
-        id = uuid.uuid4()
-        asm = f"""
-            // gt
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            AM=M-1
-            D=M-D
-            @TRUE{id}
-            D;JGT
-            @SP
-            A=M
-            M=0
-            @CONTINUE{id}
-            0;JMP
-            (TRUE{id})
-            @SP
-            A=M
-            M=-1
-            (CONTINUE{id})
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    __slots__ = ("id", "compact")
+    KIND = None
+    ASM = None
+    SITE = _strip("""
+        // {kind}
+        @CONTINUE{id}
+        D=A
+        @$$compare.{kind}
+        0;JMP
+        (CONTINUE{id})
+    """)
 
+    def __init__(self, scope: str, index: int, compact: bool = False):
+        self.id = f".{scope}.{index}"
+        self.compact = compact
 
-class Lt(Command):
-    def toasm(self):
-        id = uuid.uuid4()
-        asm = f"""
-            // lt
-            @SP
-            AM=M-1
-            D=M
-            @SP
-            M=M-1
-            A=M
-            D=M-D
-            @TRUE{id}
-            D;JLT
-            @SP
-            A=M
-            M=0
-            @CONTINUE{id}
-            0;JMP
-            (TRUE{id})
-            @SP
-            A=M
-            M=-1
-            (CONTINUE{id})
-            @SP
-            M=M+1
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(scope, index, compact)
+
+    def site(self, kind: str) -> str:
+        return self.SITE.format(kind=kind, id=self.id)
+
+    def toasm(self) -> str:
+        if self.compact:
+            return self.site(self.KIND)
+        return self.ASM.format(id=self.id)
+
+    def comment(self) -> str:
+        return f"// {self.KIND}"
+
+
+class Eq(Compare):
+    __slots__ = ()
+    KIND = "eq"
+    ASM = _strip("""
+        // eq
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        M=M-1
+        A=M
+        D=M-D
+        @TRUE{id}
+        D;JEQ
+        @SP
+        A=M
+        M=0
+        @CONTINUE{id}
+        0;JMP
+        (TRUE{id})
+        @SP
+        A=M
+        M=-1
+        (CONTINUE{id})
+        @SP
+        M=M+1
+    """)
+
+
+class Gt(Compare):
+    __slots__ = ()
+    KIND = "gt"
+    ASM = _strip("""
+        // gt
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=M-D
+        @TRUE{id}
+        D;JGT
+        @SP
+        A=M
+        M=0
+        @CONTINUE{id}
+        0;JMP
+        (TRUE{id})
+        @SP
+        A=M
+        M=-1
+        (CONTINUE{id})
+        @SP
+        M=M+1
+    """)
+
+
+class Lt(Compare):
+    __slots__ = ()
+    KIND = "lt"
+    ASM = _strip("""
+        // lt
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        M=M-1
+        A=M
+        D=M-D
+        @TRUE{id}
+        D;JLT
+        @SP
+        A=M
+        M=0
+        @CONTINUE{id}
+        0;JMP
+        (TRUE{id})
+        @SP
+        A=M
+        M=-1
+        (CONTINUE{id})
+        @SP
+        M=M+1
+    """)
 
 
 class Label(Command):
+    __slots__ = ("label", "scope")
+    ASM = _strip("""
+        // label {label} - {scope}
+        ({scope}${label})
+    """)
+
     def __init__(self, args: list[str], scope: str):
         self.label = args[0]
         self.scope = scope
 
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, function or scope)
+
     def toasm(self) -> str:
-        asm = f"""
-        // label {self.label} - {self.scope}
-        ({self.scope}.{self.label})
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        return self.ASM.format(label=self.label, scope=self.scope)
 
 
 class Goto(Command):
+    __slots__ = ("label", "scope")
+    ASM = _strip("""
+        // goto {label} - {scope}
+        @{scope}${label}
+        0;JMP
+    """)
+
     def __init__(self, args: list[str], scope: str):
         self.label = args[0]
         self.scope = scope
 
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, function or scope)
+
     def toasm(self) -> str:
-        asm = f"""
-        // goto {self.label} - {self.scope}
-        @{self.scope}.{self.label}
-        0;JMP
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        return self.ASM.format(label=self.label, scope=self.scope)
 
 
 class IfGoto(Command):
+    __slots__ = ("label", "scope")
+    ASM = _strip("""
+        // if-goto {label} - {scope}
+        @SP
+        AM=M-1
+        D=M
+        @{scope}${label}
+        D;JNE
+    """)
+
     def __init__(self, args: list[str], scope: str):
         self.label = args[0]
         self.scope = scope
 
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, function or scope)
+
+    def target(self) -> str:
+        return f"{self.scope}${self.label}"
+
     def toasm(self) -> str:
-        asm = f"""
-        // if-goto {self.label} - {self.scope}
-        @SP
-        AM=M-1
-        D=M
-        @{self.scope}.{self.label}
-        D;JNE
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        return self.ASM.format(label=self.label, scope=self.scope)
+
+    def comment(self) -> str:
+        return f"// if-goto {self.label} - {self.scope}"
 
 
 class Function(Command):
+    __slots__ = ("name", "nVars", "scope")
+    ASM = _strip("""
+        // function {name} {nVars} - {scope}
+        ({name})
+    """)
+
     def __init__(self, args: list[str], scope: str):
         self.name = args[0]
         self.nVars = args[1]
         self.scope = scope
 
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, scope)
+
     def toasm(self) -> str:
-        asm = f"""
-        // function {self.name} {self.nVars} - {self.scope}
-        ({self.name})
-        """
+        asm = self.ASM.format(name=self.name, nVars=self.nVars, scope=self.scope)
         # TODO: Make this a loop in asm rather than python
-        for _ in range(int(self.nVars)):
-            asm += "\n" + Push(["constant", "0"], self.scope).toasm()
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        if int(self.nVars):
+            asm += ("\n" + Push(["constant", "0"], self.scope).toasm()) * int(self.nVars)
+        return asm
 
 
 class Call(Command):
-    def __init__(self, args: list[str], scope: str, index: int):
-        self.function = args[0]
-        self.nArgs = args[1]
-        self.scope = scope
-        self.index = index
-
-    def toasm(self) -> str:
-        retAddr = f"{self.function}$ret.{self.index}"
-        asm = f"""
-        // call {self.function} {self.nArgs} - {self.scope}
+    __slots__ = ("function", "nArgs", "scope", "index", "compact")
+    ASM = _strip("""
+        // call {function} {nArgs} - {scope}
         @{retAddr} // push returnAddr
         D=A
         @SP
@@ -451,7 +613,7 @@ class Call(Command):
         D=M
         @5
         D=D-A
-        @{self.nArgs}
+        @{nArgs}
         D=D-A
         @ARG
         M=D
@@ -460,19 +622,56 @@ class Call(Command):
         @LCL
         M=D
         // goto function
-        @{self.function}
+        @{function}
         0;JMP
         ({retAddr}) // (return address) generate label
-        """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
-
+    """)
+    # the shared $$call routine builds the frame, it gets the return address in D,
+    # the function in R13 and nArgs + 5 (the distance from the new SP to ARG) in R14
+    COMPACT = _strip("""
+        // call {function} {nArgs} - {scope}
+        @{function}
+        D=A
+        @R13
+        M=D
+        @{frame}
+        D=A
+        @R14
+        M=D
+        @{retAddr}
+        D=A
+        @$$call
+        0;JMP
+        ({retAddr})
+    """)
 
-class Return(Command):
-    def __init__(self, scope: str):
+    def __init__(self, args: list[str], scope: str, index: int, compact: bool = False):
+        self.function = args[0]
+        self.nArgs = args[1]
         self.scope = scope
+        self.index = index
+        self.compact = compact
+
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(args, scope, index, compact)
 
     def toasm(self) -> str:
-        asm = f"""
+        return (self.COMPACT if self.compact else self.ASM).format(
+            function=self.function,
+            nArgs=self.nArgs,
+            scope=self.scope,
+            retAddr=f"{self.function}$ret.{self.scope}.{self.index}",
+            frame=int(self.nArgs) + 5,
+        )
+
+    def comment(self) -> str:
+        return f"// call {self.function} {self.nArgs} - {self.scope}"
+
+
+class Return(Command):
+    __slots__ = ("scope", "compact")
+    ASM = _strip("""
         // return
         @LCL
         D=M
@@ -529,79 +728,647 @@ class Return(Command):
         @R14
         A=M
         0;JMP
+    """)
+    COMPACT = "// return\n@$$return\n0;JMP"
+
+    def __init__(self, scope: str, compact: bool = False):
+        self.scope = scope
+        self.compact = compact
+
+    @classmethod
+    def from_args(cls, args: list[str], scope: str, index: int, compact: bool, function: str) -> Command:
+        return cls(scope, compact)
+
+    def toasm(self) -> str:
+        return self.COMPACT if self.compact else self.ASM
+
+    def comment(self) -> str:
+        return "// return"
+
+
+class Runtime(Command):
+    """
+    the routines shared by every call, return and comparison site in compact mode, they are
+    written once after the bootstrap code
+    """
+
+    __slots__ = ()
+    ASM = _strip("""
+        // $$call - push the frame, reposition ARG and LCL and jump to the function
+        ($$call)
+        @SP // push returnAddr
+        A=M
+        M=D
+        @LCL // push LCL
+        D=M
+        @SP
+        AM=M+1
+        M=D
+        @ARG // push ARG
+        D=M
+        @SP
+        AM=M+1
+        M=D
+        @THIS // push THIS
+        D=M
+        @SP
+        AM=M+1
+        M=D
+        @THAT // push THAT
+        D=M
+        @SP
+        AM=M+1
+        M=D
+        @SP // LCL = SP
+        MD=M+1
+        @LCL
+        M=D
+        @R14 // ARG = SP-5-nArgs
+        D=D-M
+        @ARG
+        M=D
+        @R13
+        A=M
+        0;JMP
+        ($$return)
+    """ + "\n" + Return.ASM + """
+        // $$compare - pops y and x and pushes x <kind> y, the return address is in D
+        ($$compare.eq)
+        @R15
+        M=D
+        @SP
+        AM=M-1
+        D=M
+        A=A-1
+        D=M-D
+        @$$compare.true
+        D;JEQ
+        @$$compare.false
+        0;JMP
+        ($$compare.gt)
+        @R15
+        M=D
+        @SP
+        AM=M-1
+        D=M
+        A=A-1
+        D=M-D
+        @$$compare.true
+        D;JGT
+        @$$compare.false
+        0;JMP
+        ($$compare.lt)
+        @R15
+        M=D
+        @SP
+        AM=M-1
+        D=M
+        A=A-1
+        D=M-D
+        @$$compare.true
+        D;JLT
+        ($$compare.false)
+        @SP
+        A=M-1
+        M=0
+        @R15
+        A=M
+        0;JMP
+        ($$compare.true)
+        @SP
+        A=M-1
+        M=-1
+        @R15
+        A=M
+        0;JMP
+    """)
+
+    def toasm(self) -> str:
+        return self.ASM
+
+
+class Fused(Command):
+    """
+    a run of commands translated together by fuse(), commands keeps the original commands
+    """
+
+    __slots__ = ("commands",)
+
+    def __init__(self, commands: list[Command]):
+        self.commands = commands
+
+    @staticmethod
+    @abstractmethod
+    def match(commands: list[Command]) -> int:
         """
-        return "\n".join([line.strip() for line in asm.split("\n") if line.strip()])
+        the number of commands at the start of commands this pattern fuses, 0 if it does not match
+        """
+
+    def comment(self) -> str:
+        return "// " + " / ".join(c.comment()[3:] for c in self.commands)
+
+
+class Move(Fused):
+    """
+    push x / pop y copies x to y through D without touching the stack
+    """
+
+    __slots__ = ()
+    # segments behind a pointer with a large index, the address is computed before the load
+    ADDRESS = _strip("""
+        @{base}
+        D=M
+        @{value}
+        D=D+A
+        @R13
+        M=D
+    """)
+    STORE = _strip("""
+        @R13
+        A=M
+        M=D
+    """)
+
+    @staticmethod
+    def match(commands: list[Command]) -> int:
+        return 2 if len(commands) > 1 and type(commands[0]) is Push and type(commands[1]) is Pop else 0
+
+    def toasm(self) -> str:
+        push, pop = self.commands
+        store = pop.store()
+        if store:
+            return f"{self.comment()}\n{push.load()}\n{store}"
+        address = self.ADDRESS.format(base=SEGMENT_TABLE[pop.segment], value=pop.value)
+        return f"{self.comment()}\n{address}\n{push.load()}\n{self.STORE}"
+
+
+class Increment(Fused):
+    """
+    push constant c / add (or sub) adds c to the top of the stack in place
+    """
+
+    __slots__ = ()
+    ASM = _strip("""
+        @{value}
+        D=A
+        @SP
+        A=M-1
+        M={op}
+    """)
+
+    @staticmethod
+    def match(commands: list[Command]) -> int:
+        if len(commands) > 1 and type(commands[0]) is Push and commands[0].segment == "constant":
+            return 2 if type(commands[1]) in (Add, Sub) else 0
+        return 0
+
+    def toasm(self) -> str:
+        push, op = self.commands
+        add = type(op) is Add
+        if push.value == 1:
+            return f"{self.comment()}\n@SP\nA=M-1\nM=M{'+' if add else '-'}1"
+        if push.value:
+            return f"{self.comment()}\n" + self.ASM.format(value=push.value, op="D+M" if add else "M-D")
+        return self.comment()
+
+
+class PushJump(Fused):
+    """
+    push x / if-goto L jumps on x directly instead of pushing and popping it
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def match(commands: list[Command]) -> int:
+        return 2 if len(commands) > 1 and type(commands[0]) is Push and type(commands[1]) is IfGoto else 0
+
+    def toasm(self) -> str:
+        push, goto = self.commands
+        return f"{self.comment()}\n{push.load()}\n@{goto.target()}\nD;JNE"
+
+
+class InvertedJump(Fused):
+    """
+    not / if-goto L jumps when !x is not 0, that is when x + 1 is not 0
+    """
+
+    __slots__ = ()
+    ASM = _strip("""
+        @SP
+        AM=M-1
+        D=M+1
+        @{target}
+        D;JNE
+    """)
+
+    @staticmethod
+    def match(commands: list[Command]) -> int:
+        return 2 if len(commands) > 1 and type(commands[0]) is Not and type(commands[1]) is IfGoto else 0
+
+    def toasm(self) -> str:
+        return f"{self.comment()}\n" + self.ASM.format(target=self.commands[1].target())
+
+
+class CompareJump(Fused):
+    """
+    eq, gt or lt followed by if-goto L (or by not / if-goto L) jumps on x - y directly
+    """
+
+    __slots__ = ()
+    JUMPS = {Eq: ("JEQ", "JNE"), Gt: ("JGT", "JLE"), Lt: ("JLT", "JGE")}
+    ASM = _strip("""
+        @SP
+        AM=M-1
+        D=M
+        @SP
+        AM=M-1
+        D=M-D
+        @{target}
+        D;{jump}
+    """)
+
+    @staticmethod
+    def match(commands: list[Command]) -> int:
+        if type(commands[0]) not in CompareJump.JUMPS or len(commands) < 2:
+            return 0
+        if type(commands[1]) is IfGoto:
+            return 2
+        if len(commands) > 2 and type(commands[1]) is Not and type(commands[2]) is IfGoto:
+            return 3
+        return 0
+
+    def toasm(self) -> str:
+        compare, goto = self.commands[0], self.commands[-1]
+        jump = self.JUMPS[type(compare)][len(self.commands) == 3]
+        return f"{self.comment()}\n" + self.ASM.format(target=goto.target(), jump=jump)
+
+
+# tried in order at every command, the first match wins
+FUSED = [CompareJump, InvertedJump, PushJump, Move, Increment]
+# command types that can start one of the FUSED patterns
+FUSABLE = (Eq, Gt, Lt, Not, Push)
+
+
+def fuse(commands: list[Command]) -> list[Command]:
+    """
+    replaces runs of commands that match one of the FUSED patterns with the fused command
+    """
+    fused = []
+    i = 0
+    while i < len(commands):
+        command = commands[i]
+        n = 1
+        if type(command) in FUSABLE:
+            window = commands[i : i + 3]
+            for cls in FUSED:
+                n = cls.match(window) or 1
+                if n > 1:
+                    command = cls(window[:n])
+                    break
+        fused.append(command)
+        i += n
+    return fused
+
+
+class StackCache:
+    """
+    translates commands keeping the top of the stack in D instead of RAM where it can. The
+    stack is spilled before labels, jumps, calls, returns and any command that is not handled
+    here, so those and the calling convention always see the real stack
+    """
+
+    BINARY = {Add: "D=D+M", Sub: "D=M-D", And: "D=D&M", Or: "D=D|M"}
+    UNARY = {Neg: "-", Not: "!"}
+    COMPARE = {Eq: "JEQ", Gt: "JGT", Lt: "JLT"}
+    SPILL = "@SP\nAM=M+1\nA=A-1\nM=D"
+    TOP = "@SP\nAM=M-1\nD=M"
+    COMPARE_ASM = _strip("""
+        @SP
+        AM=M-1
+        D=M-D
+        @TRUE{id}
+        D;{jump}
+        D=0
+        @CONTINUE{id}
+        0;JMP
+        (TRUE{id})
+        D=-1
+        (CONTINUE{id})
+    """)
+
+    def __init__(self):
+        # D holds the top of the stack and RAM[SP-1] is not written yet
+        self.cached = False
+
+    def translate(self, commands: list[Command]) -> list[str]:
+        return [self.toasm(command) for command in commands] + [self.spill()]
+
+    def spill(self) -> str:
+        if not self.cached:
+            return ""
+        self.cached = False
+        return self.SPILL
+
+    def top(self) -> str:
+        """
+        makes D hold the top of the stack and pops it from RAM
+        """
+        if self.cached:
+            return ""
+        self.cached = True
+        return self.TOP
+
+    def toasm(self, command: Command) -> str:
+        kind = type(command)
+        if kind is Push:
+            asm = [command.comment(), self.spill(), command.load()]
+            self.cached = True
+        elif kind in self.BINARY:
+            asm = [command.comment(), self.top(), "@SP\nAM=M-1", self.BINARY[kind]]
+        elif kind in self.UNARY:
+            op = self.UNARY[kind]
+            asm = [command.comment(), f"D={op}D" if self.cached else f"@SP\nAM=M-1\nD={op}M"]
+            self.cached = True
+        elif kind in self.COMPARE and not command.compact:
+            jump = self.COMPARE[kind]
+            asm = [command.comment(), self.top(), self.COMPARE_ASM.format(id=command.id, jump=jump)]
+        elif kind is Pop and command.store():
+            asm = [command.comment(), self.top(), command.store()]
+            self.cached = False
+        elif kind is IfGoto:
+            asm = [command.comment(), self.top(), f"@{command.target()}\nD;JNE"]
+            self.cached = False
+        else:
+            asm = [self.spill(), command.toasm()]
+        return "\n".join([line for line in asm if line])
 
 
 class NOP(Command):
+    __slots__ = ()
+
     def toasm(self) -> str:
         return ""
 
 
+# commands whose translation only depends on the line and the file, see Translator.parse
+CONTEXT_FREE = frozenset([Push, Pop, Add, Sub, Neg, And, Or, Not, Return])
+_UNSEEN = object()
+
+
 class Parser:
+    # opcode -> the class of its command, built with from_args
+    COMMANDS = {
+        "push": Push,
+        "pop": Pop,
+        "add": Add,
+        "sub": Sub,
+        "neg": Neg,
+        "and": And,
+        "or": Or,
+        "not": Not,
+        "gt": Gt,
+        "lt": Lt,
+        "eq": Eq,
+        "label": Label,
+        "if-goto": IfGoto,
+        "goto": Goto,
+        "function": Function,
+        "call": Call,
+        "return": Return,
+    }
+
     @staticmethod
-    def parse(command: str, scope: str, index: int) -> Command:
-        tokens = command.strip().split(" ")
-        if tokens[0].lower() == "push":
-            return Push(tokens[1:], scope)
-        elif tokens[0].lower() == "pop":
-            return Pop(tokens[1:], scope)
-        elif tokens[0].lower() == "add":
-            return Add()
-        elif tokens[0].lower() == "sub":
-            return Sub()
-        elif tokens[0].lower() == "neg":
-            return Neg()
-        elif tokens[0].lower() == "and":
-            return And()
-        elif tokens[0].lower() == "or":
-            return Or()
-        elif tokens[0].lower() == "not":
-            return Not()
-        elif tokens[0].lower() == "gt":
-            return Gt()
-        elif tokens[0].lower() == "lt":
-            return Lt()
-        elif tokens[0].lower() == "eq":
-            return Eq()
-        elif tokens[0].lower() == "label":
-            return Label(tokens[1:], scope)
-        elif tokens[0].lower() == "if-goto":
-            return IfGoto(tokens[1:], scope)
-        elif tokens[0].lower() == "goto":
-            return Goto(tokens[1:], scope)
-        elif tokens[0].lower() == "function":
-            return Function(tokens[1:], scope)
-        elif tokens[0].lower() == "call":
-            return Call(
-                tokens[1:], scope, index
-            ) 
-        elif tokens[0].lower() == "return":
-            return Return(scope)
-        else:
+    def parse(command: str, scope: str, index: int, compact: bool = False, function: str = None) -> Command:
+        """
+        scope is the file name that static variables and comparison labels belong to, labels
+        belong to the function they are in (or to the file before its first function)
+        """
+        tokens = command.split()
+        command = Parser.COMMANDS.get(tokens[0].lower()) if tokens else None
+        if command is None:
             return NOP()
+        return command.from_args(tokens[1:], scope, index, compact, function)
 
 
 class Translator:
-    def __init__(self, src: TextIOWrapper, scope: str):
+    def __init__(
+        self, src: TextIOWrapper, scope: str, compact: bool = False, fuse: bool = False, cache_top: bool = False
+    ):
         self.src = src
         self.program = []
         self.program = self.src.readlines()
         self.scope = scope
+        self.compact = compact
+        self.fuse = fuse
+        self.cache_top = cache_top
+
+    def parse(self) -> list[Command]:
+        """
+        commands are immutable, lines that translate the same wherever they are in the file share
+        one command object
+        """
+        commands = []
+        append = commands.append
+        scope, compact = self.scope, self.compact
+        parse = Parser.parse
+        shared = {}
+        function = None
+        for index, line in enumerate(self.program):
+            command = shared.get(line, _UNSEEN)
+            if command is _UNSEEN:
+                command = parse(line, scope, index, compact, function)
+                if command.__class__ is NOP or command.__class__ in CONTEXT_FREE:
+                    shared[line] = command
+                elif command.__class__ is Function:
+                    function = command.name
+            if command.__class__ is not NOP:
+                append(command)
+        return fuse(commands) if self.fuse else commands
+
+    def fragment(self) -> str:
+        """
+        the translation of the whole file, it only refers to labels of its own file so fragments
+        can be cached and linked in any order
+        """
+        commands = self.parse()
+        if self.cache_top:
+            asm = [code for code in StackCache().translate(commands) if code]
+        else:
+            # every shared command is translated once
+            emitted = {}
+            asm = []
+            append = asm.append
+            for command in commands:
+                code = emitted.get(command)
+                if code is None:
+                    code = emitted[command] = command.toasm()
+                append(code)
+        return "\n".join(asm) + "\n" if asm else ""
 
     def translate(self, out: str):
         with open(out, "a") as f:
-            index = 0
-            for line in self.program:
-                command = Parser.parse(line, self.scope, index)
-                if command.toasm():
-                    f.write(command.toasm() + "\n")
-                index += 1
+            f.write(self.fragment())
+
+
+class TranslationCache:
+    """
+    on disk cache of translated .vm files, every fragment is stored as a .asm file named by the
+    hash of the file's source, its name, the translation mode and the translator itself
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        with open(__file__, "rb") as f:
+            self.version = hashlib.sha256(f.read()).hexdigest()
+
+    def key(self, source: str, scope: str, mode: tuple[bool, bool, bool]) -> str:
+        return hashlib.sha256(f"{self.version}\n{scope}\n{mode}\n{source}".encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        try:
+            with open(os.path.join(self.path, key + ".asm"), "r") as f:
+                fragment = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fragment
+
+    def put(self, key: str, fragment: str):
+        _replace(os.path.join(self.path, key + ".asm"), fragment)
+
+    def report(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses"
+
+
+def _replace(path: str, data: str | bytes):
+    """writes data next to path and renames it over path, a reader sees the old file or the new one"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _translate(source: tuple[str, str, tuple[bool, bool, bool]]) -> str:
+    """translates one file, (text, scope, (compact, fuse, cache_top)), in a worker process or not"""
+    text, scope, mode = source
+    return Translator(io.StringIO(text), scope, *mode).fragment()
+
+
+def eliminate_dead_functions(texts: list[str], root: str = "Sys.init") -> tuple[list[str], list[str]]:
+    """
+    link time pass over the whole program: builds the call graph from the function and call
+    commands and blanks out the lines of every function no chain of calls from root
+    reaches. Lines are emptied rather than dropped so the rest keeps its line numbers and
+    translates to the same labels. returns the new texts and the removed functions in order
+    """
+    calls = {}
+    owners = []
+    for text in texts:
+        function = None
+        owner = []
+        for line in text.splitlines():
+            tokens = line.split("//")[0].split()
+            kind = Parser.COMMANDS.get(tokens[0].lower()) if tokens else None
+            if kind is Function:
+                function = tokens[1]
+                calls.setdefault(function, set())
+            elif kind is Call:
+                calls.setdefault(function, set()).add(tokens[1])
+            owner.append(function)
+        owners.append(owner)
+    if root not in calls:
+        raise Exception(f"Unknown function - {root}")
+    # code in front of the first function of a file runs too
+    reached = {None, root}
+    stack = [root, None]
+    while stack:
+        for callee in calls.get(stack.pop(), ()):
+            if callee not in reached:
+                reached.add(callee)
+                stack.append(callee)
+    removed = [function for function in calls if function not in reached]
+    pruned = []
+    for text, owner in zip(texts, owners):
+        lines = text.splitlines()
+        pruned.append("".join(line + "\n" if function in reached else "\n" for line, function in zip(lines, owner)))
+    return pruned, removed
+
+
+def build(
+    src: list[str],
+    dest: str,
+    compact: bool = False,
+    fuse: bool = False,
+    cache_top: bool = False,
+    bootstrap: bool = True,
+    cache: TranslationCache = None,
+    jobs: int = 1,
+    prune: bool = False,
+) -> list[str]:
+    """
+    writes the bootstrap code and the translation of every .vm file in src to dest, without
+    bootstrap the program starts at the first command like the projects 07 tests expect.
+    With a cache only the files that changed are translated, the others are linked from the
+    cached fragments. jobs > 1 translates the files in that many worker processes, the
+    fragments are still written in the order of src so the output is the same.
+    prune=True leaves out the functions Sys.init never reaches, returns the ones it left out
+    """
+    if compact and not bootstrap:
+        raise Exception("Compact mode needs the bootstrap - the shared routines follow it")
+    if prune and not bootstrap:
+        raise Exception("Dead function elimination needs the bootstrap - it starts from Sys.init")
+    mode = (compact, fuse, cache_top)
+    texts = []
+    for file in src:
+        with open(file, "r") as f:
+            texts.append(f.read())
+    removed = []
+    if prune:
+        texts, removed = eliminate_dead_functions(texts)
+    sources, keys, fragments = [], [], []
+    for file, text in zip(src, texts):
+        sources.append((text, os.path.basename(file).split(".")[0], mode))
+        keys.append(cache.key(*sources[-1]) if cache else None)
+        fragments.append(cache.get(keys[-1]) if cache else None)
+    missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+    if jobs > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(min(jobs, len(missing))) as pool:
+            translated = list(pool.map(_translate, [sources[i] for i in missing]))
+    else:
+        translated = [_translate(sources[i]) for i in missing]
+    for i, fragment in zip(missing, translated):
+        fragments[i] = fragment
+        if cache:
+            cache.put(keys[i], fragment)
+    with open(dest, "w") as f:
+        if bootstrap:
+            f.write("\n".join(["@256", "D=A", "@SP", "M=D\n"]))
+            f.write(Call(["Sys.init", "0"], "init", 0, compact).toasm())
+            f.write("\n")
+        if compact:
+            f.write(Runtime().toasm())
+            f.write("\n")
+        f.writelines(fragments)
+    return removed
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--src", action="store")
+    parser.add_argument("--compact", action="store_true",
+                        help="jump to shared call, return and compare routines instead of inlining them")
+    parser.add_argument("--fuse", action="store_true", help="translate common command sequences together")
+    parser.add_argument("--cache-top", action="store_true", help="keep the top of the stack in D")
+    parser.add_argument("--cache", action="store", help="directory to cache the translation of every .vm file in")
+    parser.add_argument("--jobs", action="store", type=int, default=1, help="translate files in N worker processes")
+    parser.add_argument("--prune", action="store_true", help="leave out the functions Sys.init never calls")
+    parser.add_argument("--no-bootstrap", action="store_true",
+                        help="start at the first command instead of calling Sys.init, like the projects 07 tests")
     args = parser.parse_args()
     src = []
     if os.path.isdir(args.src):
@@ -613,21 +1380,21 @@ def main():
             for file in os.listdir(args.src)
             if os.path.isfile(os.path.join(args.src, file))
         ]
-        src = [file for file in src if file[-3:] == ".vm"]
+        src = sorted(file for file in src if file[-3:] == ".vm")
     else:
         base = os.path.basename(args.src).split(".")[0]
         path = os.path.split(args.src)[0]
         dest = os.path.join(path, base + ".asm")
         src.append(args.src)
-    with open(dest, "w") as f:
-        f.write("\n".join(["@256", "D=A", "@SP", "M=D\n"]))
-        f.write(Call(["Sys.init", "0"], "init", 0).toasm())
-        f.write("\n")
-    for file in src:
-        with open(file, "r") as f:
-            scope = os.path.basename(file).split(".")[0]
-            translator = Translator(f, scope)
-            translator.translate(dest)
+    cache = TranslationCache(args.cache) if args.cache else None
+    removed = build(
+        src, dest, args.compact, args.fuse, args.cache_top,
+        bootstrap=not args.no_bootstrap, cache=cache, jobs=args.jobs, prune=args.prune,
+    )
+    if args.prune:
+        print(f"removed {len(removed)} functions: {' '.join(removed)}", file=sys.stderr)
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,443 @@
+"""
+VM emulator
+
+Runs .vm files directly instead of translating, assembling and running them on the CPU
+emulator. Every VM command is compiled once at load time to an opcode and an integer argument
+(segments folded into the opcode, static and temp resolved to RAM addresses, labels and call
+targets resolved to instruction and function indices) so the main loop only has to dispatch on
+integers. RAM is the same 32K words as on the Hack machine: SP, LCL, ARG, THIS and THAT live in
+RAM[0]-RAM[4], statics from 16, the stack from 256, the heap from 2048, the screen at 16384 and
+the keyboard at 24576.
+
+A directory is loaded together with the OS in tools/OS, the classes the directory has its own
+.vm file for replace the OS ones (tools/builtInVMCode only has the Java VM emulator's classes).
+The program halts when it calls Sys.halt, jumps to the goto it is on, or returns past the end
+of the code.
+
+usage: python vmemulator.py --src ../11/Pong [--cycles N] [--screen pong.pbm] [--native [Math.multiply ...]]
+       python vmemulator.py --src ../11/ConvertToBin --set 8000=13 --dump 8001 8002 8003
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import typing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+from emulator import to_signed  # noqa: E402
+
+OS_DIR = os.path.join(HERE, "..", "..", "tools", "OS")
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+STATIC = 16
+TEMP = 5
+
+# opcodes, in the order of how often they run in projects/11/Pong
+(
+    PUSH_CONSTANT,
+    PUSH_LOCAL,
+    IF_GOTO,
+    POP_LOCAL,
+    GOTO,
+    NOT,
+    ADD,
+    GT,
+    SUB,
+    POP_POINTER_THAT,
+    PUSH_THAT,
+    PUSH_ARGUMENT,
+    LT,
+    PUSH_RAM,
+    EQ,
+    OR,
+    AND,
+    POP_RAM,
+    POP_ARGUMENT,
+    POP_THAT,
+    CALL,
+    FUNCTION,
+    RETURN,
+    NEG,
+    PUSH_THIS,
+    POP_THIS,
+    POP_POINTER_THIS,
+    PUSH_POINTER_THIS,
+    PUSH_POINTER_THAT,
+    HALT,
+) = range(30)
+
+PUSH = {"constant": PUSH_CONSTANT, "local": PUSH_LOCAL, "argument": PUSH_ARGUMENT, "this": PUSH_THIS, "that": PUSH_THAT}
+POP = {"local": POP_LOCAL, "argument": POP_ARGUMENT, "this": POP_THIS, "that": POP_THAT}
+POINTER = {("push", 0): PUSH_POINTER_THIS, ("push", 1): PUSH_POINTER_THAT, ("pop", 0): POP_POINTER_THIS, ("pop", 1): POP_POINTER_THAT}
+ARITHMETIC = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT, "and": AND, "or": OR, "not": NOT}
+
+# calls pack the callee's function index and the argument count into one argument
+ARGC_BITS = 8
+ARGC_MASK = (1 << ARGC_BITS) - 1
+
+
+def collect(src: str, os_dir: str = OS_DIR) -> list[str]:
+    """
+    the .vm files of a directory (or a single .vm file) followed by the OS classes it does not
+    implement itself
+    """
+    files = sorted(glob.glob(os.path.join(src, "*.vm"))) if os.path.isdir(src) else [src]
+    own = {os.path.basename(file) for file in files}
+    return files + [file for file in sorted(glob.glob(os.path.join(os_dir, "*.vm"))) if os.path.basename(file) not in own]
+
+
+class Function:
+    __slots__ = ("name", "index", "entry", "locals")
+
+    def __init__(self, name: str, index: int, entry: int, nLocals: int):
+        self.name = name
+        self.index = index
+        self.entry = entry
+        self.locals = nLocals
+
+
+class VirtualMachine:
+    def __init__(self, files: list[str] = (), bootstrap: bool = True):
+        self.ram = [0] * RAM_SIZE
+        if files:
+            self.load(files, bootstrap)
+
+    def load(self, files: list[str], bootstrap: bool = True):
+        """
+        compiles the files into self.ops/self.args, with the bootstrap the program starts like
+        the translated one: SP=256 and a call to Sys.init. Without it execution starts at the
+        first command of the first file with whatever the registers in RAM hold
+        """
+        self.ops, self.args = [], []
+        # the source of every instruction, for errors and the profiler
+        self.lines = []
+        self.functions = {}
+        self.statics = {}
+        # (function, file, label) -> index of the command after the label
+        self.labels = labels = {}
+        jumps, calls = [], []
+        function = None
+        for file in files:
+            scope = os.path.basename(file).split(".")[0]
+            with open(file, "r") as f:
+                for number, line in enumerate(f, 1):
+                    tokens = line.split("//")[0].split()
+                    if not tokens:
+                        continue
+                    where = (file, number)
+                    command = tokens[0]
+                    if command == "label":
+                        labels[(function, scope, tokens[1])] = len(self.ops)
+                        continue
+                    if command == "function":
+                        function = tokens[1]
+                        if function in self.functions:
+                            raise Exception(f"Duplicate function - {function} ({file}:{number})")
+                        self.functions[function] = Function(function, len(self.functions), len(self.ops), int(tokens[2]))
+                        self._emit(FUNCTION, int(tokens[2]), where)
+                    elif command in ("goto", "if-goto"):
+                        jumps.append((len(self.ops), (function, scope, tokens[1]), where))
+                        self._emit(GOTO if command == "goto" else IF_GOTO, 0, where)
+                    elif command == "call":
+                        calls.append((len(self.ops), tokens[1], int(tokens[2]), where))
+                        self._emit(CALL, 0, where)
+                    elif command == "return":
+                        self._emit(RETURN, 0, where)
+                    elif command in ARITHMETIC:
+                        self._emit(ARITHMETIC[command], 0, where)
+                    elif command in ("push", "pop"):
+                        self._emit(*self._access(command, tokens[1], int(tokens[2]), scope, where), where)
+                    else:
+                        raise Exception(f"Unknown command - {command} ({file}:{number})")
+        self._emit(HALT, 0, None)
+        for index, label, (file, number) in jumps:
+            if label not in labels:
+                raise Exception(f"Unknown label - {label[2]} ({file}:{number})")
+            target = labels[label]
+            # a jump to itself can only loop forever
+            self.ops[index], self.args[index] = (HALT, 0) if target == index else (self.ops[index], target)
+        for index, name, argc, (file, number) in calls:
+            if name == "Sys.halt":
+                self.ops[index] = HALT
+                continue
+            if name not in self.functions:
+                raise Exception(f"Unknown function - {name} ({file}:{number})")
+            if argc >= 1 << ARGC_BITS:
+                raise Exception(f"Too many arguments - {argc} ({file}:{number})")
+            self.args[index] = self.functions[name].index << ARGC_BITS | argc
+        # function index -> Function
+        self.table = sorted(self.functions.values(), key=lambda f: f.index)
+        self.entries = [f.entry for f in self.table]
+        # function index -> python function that runs instead of the VM code, see hook
+        self.natives = [None] * len(self.table)
+        self.reset(bootstrap)
+
+    def _emit(self, op: int, arg: int, where: tuple):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.lines.append(where)
+
+    def _access(self, command: str, segment: str, index: int, scope: str, where: tuple) -> tuple[int, int]:
+        if segment == "static":
+            # statics get addresses in the order they first appear, like the assembler gives them
+            key = (scope, index)
+            if key not in self.statics:
+                self.statics[key] = STATIC + len(self.statics)
+            return (PUSH_RAM if command == "push" else POP_RAM), self.statics[key]
+        if segment == "temp":
+            return (PUSH_RAM if command == "push" else POP_RAM), TEMP + index
+        if segment == "pointer":
+            return POINTER[(command, index)], 0
+        table = PUSH if command == "push" else POP
+        if segment not in table:
+            raise Exception(f"Unknown segment - {command} {segment} ({where[0]}:{where[1]})")
+        return table[segment], index
+
+    def hook(self, name: str, native: typing.Callable[..., int | None]):
+        """
+        runs native(ram, *arguments) instead of the VM code of a function, it returns the
+        function's return value or None to run the VM code after all (natives leave the error
+        paths to the OS this way)
+        """
+        if name not in self.functions:
+            raise Exception(f"Unknown function - {name}")
+        self.natives[self.functions[name].index] = native
+
+    def unhook(self, name: str):
+        self.natives[self.functions[name].index] = None
+
+    def call(self, name: str, *arguments: int, limit: int = None) -> int:
+        """
+        calls a function on top of the current stack like a call command would, runs it until it
+        returns and returns its return value. The machine is left where it was before
+        """
+        ram = self.ram
+        pc, halted = self.pc, self.halted
+        index = len(self.ops) - 1
+        self.ops[index], self.args[index] = CALL, self.functions[name].index << ARGC_BITS | len(arguments)
+        try:
+            sp = ram[0]
+            ram[sp : sp + len(arguments)] = [value & 0xFFFF for value in arguments]
+            ram[0] = sp + len(arguments)
+            # the call jumps back to itself, the return lands on the HALT it turns into
+            self.pc, self.halted = index, False
+            self.run(1)
+            self.ops[index] = HALT
+            if self.pc == index + 1:
+                # a native returned right away
+                self.pc = index
+            self.run(limit)
+            if not self.halted:
+                raise Exception(f"Function did not return - {name}")
+            if self.pc != index:
+                raise Exception(f"Program halted - {name} ({self.lines[self.pc][0]}:{self.lines[self.pc][1]})")
+            return ram[ram[0] - 1]
+        finally:
+            self.ops[index], self.args[index] = HALT, 0
+            self.pc, self.halted = pc, halted
+
+    def reset(self, bootstrap: bool = True):
+        self.cycles = 0
+        self.halted = False
+        self.pc = 0
+        if bootstrap:
+            if "Sys.init" not in self.functions:
+                raise Exception("Unknown function - Sys.init")
+            # the bootstrap's call Sys.init, its frame is all zeros
+            ram = self.ram
+            ram[256:261] = [len(self.ops) - 1, 0, 0, 0, 0]
+            ram[0], ram[1], ram[2] = 261, 261, 256
+            self.pc = self.functions["Sys.init"].entry
+
+    def run(self, limit: int = None) -> int:
+        """
+        executes up to limit VM commands (forever if None), stops early when the program halts.
+        The registers are kept in locals while running and written back to RAM[0]-RAM[4] when
+        it returns. returns the number of commands executed
+        """
+        ops, args, ram, entries, natives = self.ops, self.args, self.ram, self.entries, self.natives
+        end = len(ops)
+        sp, lcl, arg, this, that = ram[0], ram[1], ram[2], ram[3], ram[4]
+        pc = self.pc
+        limit = sys.maxsize if limit is None else limit
+        n = 0
+        while n < limit:
+            op = ops[pc]
+            x = args[pc]
+            pc += 1
+            n += 1
+            if op == PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif op == PUSH_LOCAL:
+                ram[sp] = ram[lcl + x]
+                sp += 1
+            elif op == IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    pc = x
+            elif op == POP_LOCAL:
+                sp -= 1
+                ram[lcl + x] = ram[sp]
+            elif op == GOTO:
+                pc = x
+            elif op == NOT:
+                ram[sp - 1] ^= 0xFFFF
+            elif op == ADD:
+                sp -= 1
+                ram[sp - 1] = (ram[sp - 1] + ram[sp]) & 0xFFFF
+            elif op == GT:
+                # flipping the sign bit turns the signed order into the unsigned one
+                sp -= 1
+                ram[sp - 1] = 0xFFFF if ram[sp - 1] ^ 0x8000 > ram[sp] ^ 0x8000 else 0
+            elif op == SUB:
+                sp -= 1
+                ram[sp - 1] = (ram[sp - 1] - ram[sp]) & 0xFFFF
+            elif op == POP_POINTER_THAT:
+                sp -= 1
+                that = ram[sp]
+            elif op == PUSH_THAT:
+                ram[sp] = ram[that + x]
+                sp += 1
+            elif op == PUSH_ARGUMENT:
+                ram[sp] = ram[arg + x]
+                sp += 1
+            elif op == LT:
+                sp -= 1
+                ram[sp - 1] = 0xFFFF if ram[sp - 1] ^ 0x8000 < ram[sp] ^ 0x8000 else 0
+            elif op == PUSH_RAM:
+                ram[sp] = ram[x]
+                sp += 1
+            elif op == EQ:
+                sp -= 1
+                ram[sp - 1] = 0xFFFF if ram[sp - 1] == ram[sp] else 0
+            elif op == OR:
+                sp -= 1
+                ram[sp - 1] |= ram[sp]
+            elif op == AND:
+                sp -= 1
+                ram[sp - 1] &= ram[sp]
+            elif op == POP_RAM:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif op == POP_ARGUMENT:
+                sp -= 1
+                ram[arg + x] = ram[sp]
+            elif op == POP_THAT:
+                sp -= 1
+                ram[that + x] = ram[sp]
+            elif op == CALL:
+                native = natives[x >> ARGC_BITS]
+                if native is not None:
+                    argc = x & ARGC_MASK
+                    result = native(ram, *ram[sp - argc : sp])
+                    if result is not None:
+                        sp -= argc
+                        ram[sp] = result
+                        sp += 1
+                        continue
+                ram[sp] = pc
+                ram[sp + 1] = lcl
+                ram[sp + 2] = arg
+                ram[sp + 3] = this
+                ram[sp + 4] = that
+                sp += 5
+                arg = sp - 5 - (x & ARGC_MASK)
+                lcl = sp
+                pc = entries[x >> ARGC_BITS]
+            elif op == FUNCTION:
+                if x:
+                    ram[sp : sp + x] = [0] * x
+                    sp += x
+            elif op == RETURN:
+                # the return address goes first, without arguments it is where the result goes
+                frame = lcl
+                pc = ram[frame - 5]
+                ram[arg] = ram[sp - 1]
+                sp = arg + 1
+                that = ram[frame - 1]
+                this = ram[frame - 2]
+                arg = ram[frame - 3]
+                lcl = ram[frame - 4]
+                if pc >= end:
+                    pc = end - 1
+            elif op == NEG:
+                ram[sp - 1] = -ram[sp - 1] & 0xFFFF
+            elif op == PUSH_THIS:
+                ram[sp] = ram[this + x]
+                sp += 1
+            elif op == POP_THIS:
+                sp -= 1
+                ram[this + x] = ram[sp]
+            elif op == POP_POINTER_THIS:
+                sp -= 1
+                this = ram[sp]
+            elif op == PUSH_POINTER_THIS:
+                ram[sp] = this
+                sp += 1
+            elif op == PUSH_POINTER_THAT:
+                ram[sp] = that
+                sp += 1
+            else:
+                # HALT stays on itself and is not counted
+                pc -= 1
+                n -= 1
+                self.halted = True
+                break
+        ram[0], ram[1], ram[2], ram[3], ram[4] = sp, lcl, arg, this, that
+        self.pc = pc
+        self.cycles += n
+        return n
+
+    def screen(self) -> bytes:
+        """the screen as a binary PBM image, bit 0 of a screen word is its leftmost pixel"""
+        rows = bytearray()
+        for word in self.ram[SCREEN:KBD]:
+            # PBM puts the leftmost pixel in the most significant bit
+            bits = int(f"{word:016b}"[::-1], 2)
+            rows += bytes([bits >> 8, bits & 0xFF])
+        return b"P4\n512 256\n" + bytes(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", action="store", required=True, help="directory of .vm files or a single .vm file")
+    parser.add_argument("--os", action="store", default=OS_DIR, help="directory with the OS .vm files")
+    parser.add_argument("--no-bootstrap", action="store_true", help="start at the first command instead of Sys.init")
+    parser.add_argument("--cycles", action="store", type=int, help="stop after N VM commands")
+    parser.add_argument("--set", nargs="*", default=[], metavar="ADDR=VALUE", help="initial RAM values")
+    parser.add_argument("--dump", nargs="*", type=int, default=[], metavar="ADDR", help="RAM to print when done")
+    parser.add_argument("--screen", action="store", help="write the screen to a .pbm image when done")
+    parser.add_argument("--native", nargs="*", metavar="FUNCTION", help="run OS functions in python, all of them without names")
+    args = parser.parse_args()
+    if not args.no_bootstrap:
+        files = collect(args.src, args.os)
+    elif os.path.isdir(args.src):
+        files = sorted(glob.glob(os.path.join(args.src, "*.vm")))
+    else:
+        files = [args.src]
+    vm = VirtualMachine(files, bootstrap=not args.no_bootstrap)
+    if args.native is not None:
+        import natives
+
+        natives.install(vm, args.native or None)
+    for s in args.set:
+        addr, value = s.split("=")
+        vm.ram[int(addr)] = int(value) & 0xFFFF
+    start = time.perf_counter()
+    n = vm.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    state = "halted" if vm.halted else "stopped"
+    print(f"{state} after {n:,} VM commands in {elapsed:.3f}s ({n / elapsed:,.0f} commands/sec)")
+    for addr in args.dump:
+        print(f"RAM[{addr}] = {to_signed(vm.ram[addr])}")
+    if args.screen:
+        with open(args.screen, "wb") as f:
+            f.write(vm.screen())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import xml.etree.ElementTree as ET
 from VMWriter import VMWriter, MemorySegment, Command
-from SymbolTable import SymbolTable, IdentifierKind
+from SymbolTable import Symbol, SymbolTable, IdentifierKind
 from Tokenizer import JackTokenizer, UnexpectedTokenType, UnexpectedTokenValue, OutOfTokens, TokenType
 
 
@@ -18,6 +18,10 @@ UNARY_TABLE = {
     "-": Command.NEG,
     "~": Command.NOT,
 }
+# constants are folded as 16 bit words, the way the Hack ALU and Math.multiply/divide compute them
+WORD = 0xFFFF
+# the multiplications by a constant other than a power of two that are turned into doublings and additions
+MAX_ADD_CHAIN = 8
 IdentifierKindToMemorySegment = {
     IdentifierKind.ARG: MemorySegment.ARGUMENT,
     IdentifierKind.STATIC: MemorySegment.STATIC,
@@ -26,16 +30,63 @@ IdentifierKindToMemorySegment = {
 }
 
 
+def to_signed(value: int) -> int:
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def fold(op: str, x: int, y: int) -> int | None:
+    """
+    the value of x op y for two 16 bit words, None when it is left to run, a division by zero
+    has to reach Sys.error
+    """
+    if op == "+":
+        return (x + y) & WORD
+    elif op == "-":
+        return (x - y) & WORD
+    elif op == "*":
+        return (x * y) & WORD
+    elif op == "/":
+        if y == 0 or 0x8000 in (x, y):
+            return None
+        quotient = abs(to_signed(x)) // abs(to_signed(y))
+        return -quotient & WORD if (x ^ y) & 0x8000 else quotient
+    elif op == "&":
+        return x & y
+    elif op == "|":
+        return x | y
+    elif op == "<":
+        return WORD if to_signed(x) < to_signed(y) else 0
+    elif op == ">":
+        return WORD if to_signed(x) > to_signed(y) else 0
+    elif op == "=":
+        return WORD if x == y else 0
+    raise Exception(f"Unknown operator encounted compiling expression: {op}")
+
+
+def is_identity(op: str, value: int, right: bool) -> bool:
+    """whether x op value (right) or value op x (not right) is x"""
+    if value == 0:
+        return op in "+|" or (right and op == "-")
+    if value == 1:
+        return op == "*" or (right and op == "/")
+    return value == WORD and op == "&"
+
+
 class CompilationEngine(object):
-    def __init__(self, tokenizer: JackTokenizer, vmwriter: VMWriter):
+    def __init__(self, tokenizer: JackTokenizer, vmwriter: VMWriter, optimize: bool = False):
         self.tokenizer = tokenizer
         self.tokenizer.advance()
         self.class_symbol_table = SymbolTable()
-        self.subroutine_symbol_table = SymbolTable()
+        self.subroutine_symbol_table = SymbolTable(self.class_symbol_table)
         self.current_class_type = None
         self.vmwriter = vmwriter
         self.while_counter = 0
         self.if_counter = 0
+        # what other classes need from this one and what this one needs from them, for the build cache
+        self.signatures = []
+        self.calls = set()
+        # fold constants, skip identities and multiply by constants without Math.multiply
+        self.optimize = optimize
 
     def compile_class(self) -> ET.Element:
         self._eat(TokenType.KEYWORD, "class")
@@ -47,6 +98,8 @@ class CompilationEngine(object):
                 self.compile_class_var_dec()
             elif self.tokenizer.current_token in ["constructor", "function", "method"]:
                 self.compile_subroutine()
+            else:
+                raise Exception(f"Unknown class member - {self.tokenizer.current_token}")
         self._eat(TokenType.SYMBOL, "}")
 
     def compile_class_var_dec(self):
@@ -81,6 +134,7 @@ class CompilationEngine(object):
             self._eat(TokenType.IDENTIFIER)
         name = self.tokenizer.current_token
         self._eat(TokenType.IDENTIFIER)
+        self.signatures.append((subroutine_type, name))
         self._eat(TokenType.SYMBOL, "(")
         self.compile_parameter_list()
         self._eat(TokenType.SYMBOL, ")")
@@ -112,7 +166,7 @@ class CompilationEngine(object):
         if type == "constructor":
             num_fields = self.class_symbol_table.var_count(IdentifierKind.FIELD)
             self.vmwriter.write_push(MemorySegment.CONSTANT, num_fields)
-            self.vmwriter.write_call("Memory.alloc", 1)
+            self._call("Memory.alloc", 1)
             self.vmwriter.write_pop(MemorySegment.POINTER, 0)
         elif type == "method":
             self.vmwriter.write_push(MemorySegment.ARGUMENT, 0)
@@ -154,11 +208,11 @@ class CompilationEngine(object):
     def compile_let(self):
         self._eat(TokenType.KEYWORD, "let")
         var_name = self.tokenizer.current_token
-        kind, index, _ = self._lookup_var(var_name)
+        symbol = self._lookup_var(var_name)
         self._eat(TokenType.IDENTIFIER)
         # TODO: Handle this
         if self.tokenizer.current_token == "[":
-            self.vmwriter.write_push(IdentifierKindToMemorySegment[kind], index)
+            self.vmwriter.write_push(IdentifierKindToMemorySegment[symbol.kind], symbol.index)
             self._eat(TokenType.SYMBOL, "[")
             self.compile_expression()
             self._eat(TokenType.SYMBOL, "]")
@@ -172,7 +226,7 @@ class CompilationEngine(object):
         else:
             self._eat(TokenType.SYMBOL, "=")
             self.compile_expression()
-            self.vmwriter.write_pop(IdentifierKindToMemorySegment[kind], index)
+            self.vmwriter.write_pop(IdentifierKindToMemorySegment[symbol.kind], symbol.index)
         self._eat(TokenType.SYMBOL, ";")
     
 
@@ -232,23 +286,143 @@ class CompilationEngine(object):
         self._eat(TokenType.SYMBOL, ";")
 
     def compile_expression(self):
+        if self.optimize:
+            self._push_constant(self._compile_expression())
+            return
         self.compile_term()
         while self.tokenizer.current_token in ["+", "-", "*", "/", "&", "|", "<", ">", "="]:
             op = self.tokenizer.current_token
             self._eat(TokenType.SYMBOL)
             self.compile_term()
-            if op in OP_TABLE:
-                self.vmwriter.write_arithmetic(Command(OP_TABLE[op]))
-            elif op == "*":
-                self.vmwriter.write_call("Math.multiply", 2)
-            elif op == "/":
-                self.vmwriter.write_call("Math.divide", 2)
-            else:
-                raise Exception(f"Unknown operator encounted compiling expression: {op}")
+            self._write_op(op)
+
+    def _compile_expression(self) -> int | None:
+        """
+        the optimizing compile_expression, Jack has no precedence so the operators apply left to
+        right. returns the value of a constant expression instead of pushing it, None when the
+        code was written
+        """
+        value = self.compile_term()
+        while self.tokenizer.current_token in ["+", "-", "*", "/", "&", "|", "<", ">", "="]:
+            op = self.tokenizer.current_token
+            self._eat(TokenType.SYMBOL)
+            # the right operand is held back until it is known whether the left one has to go first
+            with self.vmwriter.capture() as code:
+                right = self.compile_term()
+            value = self._combine(op, value, right, code.getvalue())
+        return value
+
+    def _combine(self, op: str, left: int | None, right: int | None, code: str) -> int | None:
+        """
+        writes left op right where left is either a constant or already on the stack and right is
+        either a constant or the code that pushes it
+        """
+        if left is not None and right is not None:
+            value = fold(op, left, right)
+            if value is not None:
+                return value
+            self._push_constant(left)
+        elif left is not None:
+            # constants have no side effects, the operand can follow the code when op commutes
+            if is_identity(op, left, right=False):
+                self.vmwriter.write_code(code)
+                return None
+            if op == "*" and self._multiply_by(left, code):
+                return None
+            self._push_constant(left)
+        elif right is not None:
+            if is_identity(op, right, right=True):
+                return None
+            if op == "*" and self._multiply_by(right, ""):
+                return None
+        self.vmwriter.write_code(code)
+        self._push_constant(right)
+        self._write_op(op)
+        return None
+
+    def _multiply_by(self, value: int, code: str) -> bool:
+        """
+        writes code, then multiplies what it pushes by value with doublings and additions when
+        value is a power of two or the chain is short, Math.multiply loops over all 16 bits
+        """
+        signed = to_signed(value)
+        n = abs(signed)
+        steps = n.bit_length() - 1 + n.bit_count() - 1
+        if signed == -32768 or (n.bit_count() > 1 and steps > MAX_ADD_CHAIN):
+            return False
+        self.vmwriter.write_code(code)
+        if n == 0:
+            # the operand still runs for its side effects
+            self.vmwriter.write_pop(MemorySegment.TEMP, 0)
+            self.vmwriter.write_push(MemorySegment.CONSTANT, 0)
+            return True
+        # temp 1 keeps the operand, temp 0 the running product while it is doubled
+        if n.bit_count() > 1:
+            self.vmwriter.write_pop(MemorySegment.TEMP, 1)
+            self.vmwriter.write_push(MemorySegment.TEMP, 1)
+        for bit in bin(n)[3:]:
+            self.vmwriter.write_pop(MemorySegment.TEMP, 0)
+            self.vmwriter.write_push(MemorySegment.TEMP, 0)
+            self.vmwriter.write_push(MemorySegment.TEMP, 0)
+            self.vmwriter.write_arithmetic(Command.ADD)
+            if bit == "1":
+                self.vmwriter.write_push(MemorySegment.TEMP, 1)
+                self.vmwriter.write_arithmetic(Command.ADD)
+        if signed < 0:
+            self.vmwriter.write_arithmetic(Command.NEG)
+        return True
+
+    def _push_constant(self, value: int | None):
+        """pushes a 16 bit word, push constant only takes 0 to 32767"""
+        if value is None:
+            return
+        if value <= 32767:
+            self.vmwriter.write_push(MemorySegment.CONSTANT, value)
+        elif value == 0x8000:
+            self.vmwriter.write_push(MemorySegment.CONSTANT, 32767)
+            self.vmwriter.write_arithmetic(Command.NOT)
+        else:
+            self.vmwriter.write_push(MemorySegment.CONSTANT, -value & WORD)
+            self.vmwriter.write_arithmetic(Command.NEG)
+
+    def _write_op(self, op: str):
+        if op in OP_TABLE:
+            self.vmwriter.write_arithmetic(Command(OP_TABLE[op]))
+        elif op == "*":
+            self._call("Math.multiply", 2)
+        elif op == "/":
+            self._call("Math.divide", 2)
+        else:
+            raise Exception(f"Unknown operator encounted compiling expression: {op}")
 
     # there is a lot of room for improvement in this 'do everything' function
-    def compile_term(self):
+    def compile_term(self) -> int | None:
+        """
+        writes the code of a term, when optimizing a constant term is not written and its value
+        returned instead
+        """
         # requires lookahead
+        if self.optimize and self.tokenizer.token_type() == TokenType.INT_CONST and self.tokenizer.int_val() <= 32767:
+            value = self.tokenizer.int_val()
+            self._eat(TokenType.INT_CONST)
+            return value
+        elif self.optimize and self.tokenizer.current_token in ["true", "false", "null"]:
+            value = WORD if self.tokenizer.current_token == "true" else 0
+            self._eat(TokenType.KEYWORD)
+            return value
+        elif self.optimize and self.tokenizer.current_token == "(":
+            self._eat(TokenType.SYMBOL, "(")
+            value = self._compile_expression()
+            self._eat(TokenType.SYMBOL, ")")
+            return value
+        elif self.optimize and self.tokenizer.current_token in ["-", "~"]:
+            op = self.tokenizer.current_token
+            self._eat(TokenType.SYMBOL)
+            value = self.compile_term()
+            if value is None:
+                self.vmwriter.write_arithmetic(UNARY_TABLE[op])
+                return None
+            return -value & WORD if op == "-" else value ^ WORD
         if self.tokenizer.token_type() == TokenType.INT_CONST:
             self.vmwriter.write_push(MemorySegment.CONSTANT, self.tokenizer.current_token)
             self._eat(TokenType.INT_CONST)
@@ -257,10 +431,10 @@ class CompilationEngine(object):
             s = list(self.tokenizer.current_token[1:-1].encode("ascii"))
             self._eat(TokenType.STRING_CONST)
             self.vmwriter.write_push(MemorySegment.CONSTANT, len(s))
-            self.vmwriter.write_call("String.new", 1)
+            self._call("String.new", 1)
             for c in s:
                 self.vmwriter.write_push(MemorySegment.CONSTANT, c)
-                self.vmwriter.write_call("String.appendChar", 2)
+                self._call("String.appendChar", 2)
         elif self.tokenizer.current_token in ["true", "false", "null", "this"]:
             keyword = self.tokenizer.current_token
             self._eat(TokenType.KEYWORD)
@@ -291,8 +465,8 @@ class CompilationEngine(object):
                 self._eat(TokenType.SYMBOL, "[")
                 self.compile_expression()
                 self._eat(TokenType.SYMBOL, "]")
-                kind, index, _ = self._lookup_var(prev)
-                self.vmwriter.write_push(IdentifierKindToMemorySegment[kind], index)
+                symbol = self._lookup_var(prev)
+                self.vmwriter.write_push(IdentifierKindToMemorySegment[symbol.kind], symbol.index)
                 self.vmwriter.write_arithmetic(Command.ADD)
                 self.vmwriter.write_pop(MemorySegment.POINTER, 1)
                 self.vmwriter.write_push(MemorySegment.THAT, 0)
@@ -301,42 +475,26 @@ class CompilationEngine(object):
                 self._eat(TokenType.SYMBOL, "(")
                 count = self.compile_expression_list()
                 self._eat(TokenType.SYMBOL, ")")
-                self.vmwriter.write_call(self._scope_function_name(prev), count+1)
+                self._call(self._scope_function_name(prev), count+1)
             elif self.tokenizer.current_token == ".": # subroutine call form <class/var>.<method>(args...)
-                # print(f"we are calling some method in the form <class|object>.<function|method> obect/class = {prev}")
-                # print(self.class_symbol_table._table)
-                # print(self.subroutine_symbol_table._table)
-                try:
-                    kind = self.subroutine_symbol_table.kind_of(prev)
-                    index = self.subroutine_symbol_table.index_of(prev)
-                    prev = self.subroutine_symbol_table.type_of(prev)
-                    self.vmwriter.write_push(IdentifierKindToMemorySegment[kind], index)
+                # a variable is an object whose method gets called, anything else is a class
+                symbol = self.subroutine_symbol_table.lookup(prev)
+                if symbol is not None:
+                    self.vmwriter.write_push(IdentifierKindToMemorySegment[symbol.kind], symbol.index)
+                    prev = symbol.type
                     arg_count = 1
-                except:
-                    try:
-                        kind = self.class_symbol_table.kind_of(prev)
-                        index = self.class_symbol_table.index_of(prev)
-                        prev = self.class_symbol_table.type_of(prev)
-                        self.vmwriter.write_push(IdentifierKindToMemorySegment[kind], index)
-                        arg_count = 1
-                    except:
-                        # print(f"{prev} must not be an object with a method")
-                        arg_count = 0
+                else:
+                    arg_count = 0
                 self._eat(TokenType.SYMBOL, ".")
                 name = self.tokenizer.current_token
                 self._eat(TokenType.IDENTIFIER)
                 self._eat(TokenType.SYMBOL, "(")
                 arg_count += self.compile_expression_list()
                 self._eat(TokenType.SYMBOL, ")")
-                self.vmwriter.write_call(prev+"."+name, arg_count)
+                self._call(prev+"."+name, arg_count)
             else: # varName
-                try:
-                    kind = self.subroutine_symbol_table.kind_of(prev)
-                    index = self.subroutine_symbol_table.index_of(prev)
-                except:
-                    kind = self.class_symbol_table.kind_of(prev)
-                    index = self.class_symbol_table.index_of(prev)
-                self.vmwriter.write_push(IdentifierKindToMemorySegment[kind], index)
+                symbol = self._lookup_var(prev)
+                self.vmwriter.write_push(IdentifierKindToMemorySegment[symbol.kind], symbol.index)
 
     def compile_expression_list(self) -> int:
         count = 0
@@ -347,25 +505,25 @@ class CompilationEngine(object):
                 self._eat(TokenType.SYMBOL, ",")
         return count
 
-    def _lookup_var(self, name):
-        try:
-            kind = self.subroutine_symbol_table.kind_of(name)
-            index = self.subroutine_symbol_table.index_of(name)
-            type = self.subroutine_symbol_table.type_of(name)
-        except:
-            kind = self.class_symbol_table.kind_of(name)
-            index = self.class_symbol_table.index_of(name)
-            type = self.class_symbol_table.type_of(name)
-        return (kind, index, type)
+    def _call(self, name: str, nargs: int):
+        self.calls.add(name.split(".")[0])
+        self.vmwriter.write_call(name, nargs)
+
+    def _lookup_var(self, name) -> Symbol:
+        symbol = self.subroutine_symbol_table.lookup(name)
+        if symbol is None:
+            raise Exception(f"SymbolNotFound - {name}")
+        return symbol
+
     def _eat(self, type: TokenType, value=None):
         """
         validates that the token is of type type and advances the tokenizer
         if value is passed also validate that the value matches
         """
         if self.tokenizer.token_type() != type:
-            raise UnexpectedTokenType()
+            raise UnexpectedTokenType(f"Expected {type} - {self.tokenizer.current_token!r}")
         if value and self.tokenizer.current_token != value:
-            raise UnexpectedTokenValue()
+            raise UnexpectedTokenValue(f"Expected {value!r} - {self.tokenizer.current_token!r}")
         if not self.tokenizer.has_more_tokens():
             raise OutOfTokens()
         self.tokenizer.advance()
@@ -7,35 +7,55 @@ class IdentifierKind(StrEnum):
     ARG = auto()
     VAR = auto()
 
+class Symbol(object):
+    """what a name was defined as, the index is given out once by define and never changes"""
+    __slots__ = ("kind", "type", "index")
+    def __init__(self, kind: IdentifierKind, type: str, index: int):
+        object.__setattr__(self, "kind", kind)
+        object.__setattr__(self, "type", type)
+        object.__setattr__(self, "index", index)
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Symbol is immutable - {name}")
+    def __repr__(self):
+        return f"Symbol({self.kind}, {self.type}, {self.index})"
+
 class SymbolTable(object):
-    def __init__(self):
+    """
+    one scope of names, a subroutine's table chains to its class's table through parent so a
+    lookup that misses here goes on there
+    """
+    def __init__(self, parent: "SymbolTable" = None):
+        self.parent = parent
         self.reset()
     def reset(self):
-        self._table = {
-            IdentifierKind.STATIC: [],
-            IdentifierKind.FIELD: [],
-            IdentifierKind.ARG: [],
-            IdentifierKind.VAR: []
-        }
-    def define(self, name: str, type: str, kind: IdentifierKind):
-        self._table[kind].append({"name": name, "type": type})
+        self._symbols = {}
+        self._counts = dict.fromkeys(IdentifierKind, 0)
+    def define(self, name: str, type: str, kind: IdentifierKind) -> Symbol:
+        if name in self._symbols:
+            raise Exception(f"SymbolRedefined - {name}")
+        kind = IdentifierKind(kind)
+        symbol = self._symbols[name] = Symbol(kind, type, self._counts[kind])
+        self._counts[kind] += 1
+        return symbol
     def var_count(self, kind: IdentifierKind) -> int:
-        return len(self._table[kind])
-    def kind_of(self, name: str) -> IdentifierKind | None:
-        for k, v in self._table.items():
-            for sym in v:
-                if sym["name"] == name:
-                    return k
-        raise Exception(f"SymbolNotFound - {name}")
+        return self._counts[kind]
+    def lookup(self, name: str) -> Symbol | None:
+        """the symbol of the innermost scope that defines name, None if none does"""
+        table = self
+        while table is not None:
+            symbol = table._symbols.get(name)
+            if symbol is not None:
+                return symbol
+            table = table.parent
+        return None
+    def _find(self, name: str) -> Symbol:
+        symbol = self.lookup(name)
+        if symbol is None:
+            raise Exception(f"SymbolNotFound - {name}")
+        return symbol
+    def kind_of(self, name: str) -> IdentifierKind:
+        return self._find(name).kind
     def type_of(self, name: str) -> str:
-        for _, v in self._table.items():
-            for sym in v:
-                if sym["name"] == name:
-                    return sym["type"]
-        raise Exception(f"SymbolNotFound - {name}")
+        return self._find(name).type
     def index_of(self, name: str) -> int:
-        for _, v in self._table.items():
-            for i, sym in enumerate(v):
-                if sym["name"] == name:
-                    return i
-        raise Exception(f"SymbolNotFound - {name}")
\ No newline at end of file
+        return self._find(name).index
@@ -1,4 +1,5 @@
-import os
+import re
+import sys
 import typing
 from enum import StrEnum, auto
 
@@ -48,76 +49,80 @@ class Keyword(StrEnum):
 
 
 SYMBOLS = "{}[]().,;+-*/&|<>=~"
+# token types as stored in the token array, small ints indexing TYPES
+KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST = range(5)
+TYPES = (TokenType.KEYWORD, TokenType.SYMBOL, TokenType.IDENTIFIER, TokenType.INT_CONST, TokenType.STRING_CONST)
+# whitespace and comments match without a group, every token type has its group in the order of
+# TYPES so the number of the group that matched is the type plus one
+PATTERN = re.compile(
+    r"""
+    \s+ | //[^\n]* | /\*.*?(?:\*/|\Z)
+    | ((?:%s)\b)
+    | ([{}\[\]().,;+\-*/&|<>=~])
+    | ([A-Za-z_]\w*)
+    | (\d+)
+    | ("[^"\n]*")
+    | (.)
+    """
+    % "|".join(Keyword),
+    re.DOTALL | re.VERBOSE,
+)
+
+
+def tokenize(text: str) -> tuple[list[str], bytearray]:
+    """
+    splits a whole source into its tokens and their types, strings keep their quotes like
+    current_token always had them
+    """
+    tokens = []
+    types = bytearray()
+    intern = sys.intern
+    for match in PATTERN.finditer(text):
+        group = match.lastindex
+        if group is None:
+            continue
+        if group > len(TYPES):
+            line = text.count("\n", 0, match.start()) + 1
+            raise Exception(f"Unexpected character - {match.group()!r} (line {line})")
+        tokens.append(intern(match.group()))
+        types.append(group - 1)
+    return tokens, types
 
 
 class JackTokenizer(object):
     def __init__(self, input: typing.TextIO):
+        self.tokens, self.types = tokenize(input.read())
+        # index of the current token, the token after the last one is ""
+        self.index = -1
         self.current_token = ""
-        self.input = input
 
     def has_more_tokens(self) -> bool:
-        "check if there are more tokens"
-        cur = self.input.tell()
-        self.input.seek(0, os.SEEK_END)
-        end = self.input.tell()
-        self.input.seek(cur, os.SEEK_SET)
-        return cur != end
+        "check if advance can still move, true until it moved past the last token"
+        return self.index < len(self.tokens)
 
     def advance(self):
         """
         get the next token from the input stream and makes it the current token
         should only be called if has_more_tokens() returns true
         """
-        self.current_token = ""
-        while c := self.input.read(1):
-            cur = self.input.tell()
-            next = self.input.read(1)
-            self.input.seek(cur, os.SEEK_SET)
-            if c.isspace():
-                if not self.current_token:
-                    continue
-                else:
-                    return
-            self.current_token += c
-            # consume comments
-            if c in "/":
-                if c == "/" and next == "/":
-                    while c != "\n":
-                        c = self.input.read(1)
-                    self.current_token = self.current_token[:-2]
-                elif c == "/" and next == "*":
-                    last = ""
-                    while x := self.input.read(1):
-                        if last + x == "*/":
-                            break
-                        last = x
-                    self.current_token = self.current_token[:-2]
-                if not self.current_token:
-                    continue
-            if next in SYMBOLS:
-                return
-            if c == '"':
-                while x := self.input.read(1):
-                    self.current_token += x
-                    if x == '"':
-                        return
-            if c in SYMBOLS:
-                return
+        self.index += 1
+        self.current_token = self.tokens[self.index] if self.index < len(self.tokens) else ""
+
+    def peek(self, k: int = 1) -> str:
+        """
+        returns the token k places after the current one without advancing, "" past the end
+        """
+        index = self.index + k
+        return self.tokens[index] if 0 <= index < len(self.tokens) else ""
 
     def token_type(self) -> TokenType:
         """
         returns the type of the current token as a constant
         """
-        if self.current_token in SYMBOLS:
-            return TokenType.SYMBOL
-        elif self.current_token in Keyword:
-            return TokenType.KEYWORD
-        elif self.current_token.isdigit():
-            return TokenType.INT_CONST
-        elif self.current_token[0] == self.current_token[-1] == '"':
-            return TokenType.STRING_CONST
-        else:
-            return TokenType.IDENTIFIER
+        if 0 <= self.index < len(self.tokens):
+            return TYPES[self.types[self.index]]
+        # before the first and past the last token, the empty token was always a symbol
+        return TokenType.SYMBOL
 
     def keyword(self) -> Keyword:
         """
@@ -1,3 +1,5 @@
+import contextlib
+import io
 from enum import StrEnum, auto
 
 class MemorySegment(StrEnum):
@@ -42,6 +44,17 @@ class VMWriter:
         self.out.write(f"function {name} {nvars}\n")
     def write_return(self):
         self.out.write("return\n")
+    def write_code(self, code: str):
+        self.out.write(code)
+    @contextlib.contextmanager
+    def capture(self):
+        """collects what is written inside the with block instead of writing it, to be written later with write_code"""
+        out = self.out
+        self.out = io.StringIO()
+        try:
+            yield self.out
+        finally:
+            self.out = out
     def close(self):
         self.out.close()
     def __enter__(self):
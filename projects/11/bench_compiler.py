@@ -0,0 +1,75 @@
+"""
+Times compiling the OS in projects/12 together with every projects/09 and projects/11 program in
+one invocation of compiler.py, serially and with --jobs
+
+The sources are copied to a temporary directory first so the .vm files in the repository are
+not touched. Reports the best wall time of --repeat runs for every job count and checks every
+run writes the same .vm files as the serial one.
+
+usage: python bench_compiler.py [--jobs 1 2 4] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTS = os.path.join(HERE, "..")
+
+
+def copy_sources(tmp: str) -> list[str]:
+    """copies every directory with .jack files in it, returns the copies"""
+    dirs = []
+    for project in ["09", "11", "12"]:
+        base = os.path.join(PROJECTS, project)
+        for file in sorted(glob.glob(os.path.join(base, "**", "*.jack"), recursive=True)):
+            dest = os.path.join(tmp, project, os.path.relpath(os.path.dirname(file), base))
+            if dest not in dirs:
+                os.makedirs(dest, exist_ok=True)
+                dirs.append(dest)
+            shutil.copy(file, dest)
+    return dirs
+
+
+def outputs(dirs: list[str]) -> dict[str, str]:
+    result = {}
+    for path in dirs:
+        for file in sorted(glob.glob(os.path.join(path, "*.vm"))):
+            with open(file, "r") as f:
+                result[file] = f.read()
+            os.remove(file)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", action="store", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--repeat", action="store", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        dirs = copy_sources(tmp)
+        files = sum(len(glob.glob(os.path.join(path, "*.jack"))) for path in dirs)
+        print(f"{files} files in {len(dirs)} directories, {os.cpu_count()} cpus")
+        print(f"{'jobs':>5}{'seconds':>10}{'speedup':>9}")
+        expected = serial = None
+        for jobs in args.jobs:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                command = [sys.executable, os.path.join(HERE, "compiler.py"), "--jobs", str(jobs), "--input", *dirs]
+                subprocess.run(command, check=True)
+                best = min(best, time.perf_counter() - start)
+                result = outputs(dirs)
+                expected = expected or result
+                if result != expected:
+                    raise Exception(f"Different output - {jobs} jobs")
+            serial = serial or best
+            print(f"{jobs:>5}{best:>10.3f}{serial / best:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
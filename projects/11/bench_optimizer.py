@@ -0,0 +1,93 @@
+"""
+Measures what compiler.py --optimize saves on the projects/11 programs
+
+Every program is compiled with and without --optimize and linked with the OS in tools/OS. The
+code size is the VM commands of the program's own .vm files and the calls to Math.multiply and
+Math.divide in them. The programs that run to the end without a keyboard are then run on the
+projects/08 VM emulator under its profiler, which estimates Hack cycles as the length of the
+inline translation of every VM command executed. Reported are the calls to Math.multiply and
+Math.divide made and the cycles of Main.main and everything it calls, the OS spends the same
+cycles setting itself up either way. Every optimized run has to leave the same heap and screen
+behind as the plain one.
+
+usage: python bench_optimizer.py [--programs Seven Pong]
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import compiler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "08"))
+import profiler  # noqa: E402
+import vmemulator  # noqa: E402
+
+PROGRAMS = ["Average", "ComplexArrays", "ConvertToBin", "Pong", "Seven", "Square"]
+# the programs that halt on their own and the RAM they read their input from
+RUNS = {"ComplexArrays": {}, "ConvertToBin": {8000: 0b1011010}, "Pong": {}, "Seven": {}}
+
+
+def build(program: str, dest: str, optimize: bool) -> list[str]:
+    os.makedirs(dest)
+    for file in glob.glob(os.path.join(HERE, program, "*.jack")):
+        shutil.copy(file, dest)
+    src = compiler.sources([dest])
+    errors = compiler.build(src, optimize=optimize)
+    if any(errors):
+        raise Exception(f"Compile failed - {program} {errors}")
+    return [file[:-5] + ".vm" for file in src]
+
+
+def code_size(files: list[str]) -> tuple[int, int]:
+    commands = calls = 0
+    for file in files:
+        with open(file, "r") as f:
+            for line in f:
+                commands += 1
+                calls += line.startswith(("call Math.multiply", "call Math.divide"))
+    return commands, calls
+
+
+def run(dest: str, ram: dict[int, int]) -> tuple[int, int, list[int]]:
+    """(multiply and divide calls, estimated cycles of Main.main, heap and screen)"""
+    vm = vmemulator.VirtualMachine(vmemulator.collect(dest))
+    for address, value in ram.items():
+        vm.ram[address] = value
+    profile = profiler.Profile(vm)
+    profile.run(100_000_000)
+    if not vm.halted:
+        raise Exception(f"Program did not halt - {dest}")
+    functions = profile.functions()
+    calls = sum(functions[name]["calls"] for name in ["Math.multiply", "Math.divide"] if name in functions)
+    return calls, functions["Main.main"]["inclusive_cycles"], vm.ram[2048 : vmemulator.KBD]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--programs", nargs="+", default=PROGRAMS)
+    args = parser.parse_args()
+    print(f"{'program':<15}{'vm code':>18}{'mul/div in code':>17}{'mul/div calls run':>20}{'Main.main cycles (est.)':>36}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for program in args.programs:
+            plain = build(program, os.path.join(tmp, program, "plain"), False)
+            optimized = build(program, os.path.join(tmp, program, "optimized"), True)
+            (size, calls), (size_o, calls_o) = code_size(plain), code_size(optimized)
+            row = f"{program:<15}{f'{size:,} -> {size_o:,}':>18}{f'{calls} -> {calls_o}':>17}"
+            if program in RUNS:
+                run_calls, cycles, memory = run(os.path.dirname(plain[0]), RUNS[program])
+                run_calls_o, cycles_o, memory_o = run(os.path.dirname(optimized[0]), RUNS[program])
+                if memory != memory_o:
+                    raise Exception(f"Different heap or screen - {program}")
+                row += f"{f'{run_calls:,} -> {run_calls_o:,}':>20}"
+                row += f"{f'{cycles:,} -> {cycles_o:,} ({1 - cycles_o / cycles:.1%})':>36}"
+            else:
+                row += f"{'waits for the keyboard':>30}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Times the symbol table on a generated class with thousands of fields and locals
+
+The class declares --size fields, and one method with --size locals whose statements read every
+local and every field once. Reports the time of the kind_of/type_of/index_of lookups the
+compilation engine makes for every name on its own, and the time to compile the whole class.
+
+usage: python bench_symboltable.py [--size 2000] [--repeat 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import compiler
+from SymbolTable import IdentifierKind, SymbolTable
+
+
+def generate_class(size: int) -> str:
+    lines = ["class Big {"]
+    lines += [f"    field int f{i};" for i in range(size)]
+    lines.append("    method int sum() {")
+    lines += [f"        var int v{i};" for i in range(size)]
+    lines.append("        var int total;")
+    lines.append("        let total = 0;")
+    for i in range(size):
+        lines.append(f"        let v{i} = f{i} + {i};")
+        lines.append(f"        let total = total + v{i};")
+    lines.append("        return total;")
+    lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def lookups(size: int) -> float:
+    fields, locals = SymbolTable(), SymbolTable()
+    for i in range(size):
+        fields.define(f"f{i}", "int", IdentifierKind.FIELD)
+        locals.define(f"v{i}", "int", IdentifierKind.VAR)
+    start = time.perf_counter()
+    for i in range(size):
+        for table, name in ((fields, f"f{i}"), (locals, f"v{i}")):
+            table.kind_of(name), table.type_of(name), table.index_of(name)
+    return time.perf_counter() - start
+
+
+def compile_class(size: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Big.jack")
+        with open(path, "w") as f:
+            f.write(generate_class(size))
+        start = time.perf_counter()
+        compiler.compile(path)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", action="store", type=int, default=2000, help="fields and locals in the class")
+    parser.add_argument("--repeat", action="store", type=int, default=3)
+    args = parser.parse_args()
+    best_lookups = min(lookups(args.size) for _ in range(args.repeat))
+    best_compile = min(compile_class(args.size) for _ in range(args.repeat))
+    names = 2 * args.size
+    print(f"{args.size:,} fields and {args.size:,} locals")
+    print(f"lookups  {best_lookups:>10.4f}s  {names / best_lookups:>12,.0f} names/s")
+    print(f"compile  {best_compile:>10.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Times the Jack tokenizer on the projects/11 programs and the projects/12 OS sources
+
+Every file is opened and run through JackTokenizer.advance until has_more_tokens is false, the
+way the compilation engine drives it. Reports the tokens and the best time of --repeat runs for
+each set of sources.
+
+usage: python bench_tokenizer.py [--repeat 5]
+"""
+import argparse
+import glob
+import os
+import time
+
+from Tokenizer import JackTokenizer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCES = {
+    "projects/11": os.path.join(HERE, "*", "*.jack"),
+    "projects/12": os.path.join(HERE, "..", "12", "**", "*.jack"),
+}
+
+
+def tokenize(files: list[str]) -> int:
+    count = 0
+    for file in files:
+        with open(file, "r") as f:
+            tokenizer = JackTokenizer(f)
+            while tokenizer.has_more_tokens():
+                tokenizer.advance()
+                if tokenizer.current_token:
+                    count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", action="store", type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'sources':<14}{'files':>6}{'tokens':>9}{'seconds':>10}{'tokens/s':>12}")
+    for name, pattern in SOURCES.items():
+        files = sorted(glob.glob(pattern, recursive=True))
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = tokenize(files)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:<14}{len(files):>6}{count:>9,}{best:>10.4f}{count / best:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
+import sys
+import json
 import argparse
+import hashlib
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 import xml.etree.ElementTree as ET
 from VMWriter import VMWriter
 from Tokenizer import JackTokenizer
@@ -9,31 +13,186 @@ from CompilationEngine import CompilationEngine
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", action="store", help="input file to analyze")
+    parser.add_argument("--input", action="store", nargs="+", help="input files or directories to compile")
+    parser.add_argument("--jobs", action="store", type=int, default=1, help="compile files in N worker processes")
+    parser.add_argument("--cache", action="store", help="directory to cache every class's .vm in, unchanged classes are skipped")
+    parser.add_argument("--optimize", action="store_true",
+                        help="fold constants, skip identities and multiply by constants without Math.multiply")
     args = parser.parse_args()
-    if os.path.isdir(args.input):
-        src = [
-            os.path.join(args.input, file)
-            for file in os.listdir(args.input)
-            if os.path.isfile(os.path.join(args.input, file)) and file[-5:] == ".jack"
-        ]
-        for file in src:
-            compile(file)
-    else:
-        compile(args.input)
-
-def compile(path: str):
+    src = sources(args.input)
+    cache = CompileCache(args.cache) if args.cache else None
+    errors = build(src, args.jobs, cache, args.optimize)
+    for file, error in zip(src, errors):
+        if error is not None:
+            print(f"{file}: {error}", file=sys.stderr)
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
+    failed = sum(error is not None for error in errors)
+    if failed:
+        print(f"{failed} of {len(src)} files failed to compile", file=sys.stderr)
+        sys.exit(1)
+
+def sources(paths: list[str]) -> list[str]:
+    '''
+    the .jack files to compile, a directory stands for the .jack files in it. Sorted per directory
+    so the order and the error report are the same on every run
+    '''
+    src = []
+    for path in paths:
+        if os.path.isdir(path):
+            src += sorted(
+                os.path.join(path, file)
+                for file in os.listdir(path)
+                if os.path.isfile(os.path.join(path, file)) and file[-5:] == ".jack"
+            )
+        else:
+            src.append(path)
+    return src
+
+class CompileCache:
+    '''
+    on disk cache of compiled classes, one .json entry per source file with the hash of the
+    source, whether it was optimized, the .vm it compiled to, the subroutines it exports as (kind, name) and the signatures
+    of every class it calls at the time it was compiled. An entry is used when the source and the
+    compiler are the same and none of the classes it calls changed their signatures, so editing
+    the body of a subroutine recompiles that class only
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        os.makedirs(path, exist_ok=True)
+        version = hashlib.sha256()
+        for module in ["compiler.py", "CompilationEngine.py", "SymbolTable.py", "Tokenizer.py", "VMWriter.py"]:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as f:
+                version.update(f.read())
+        self.version = version.hexdigest()
+
+    def _entry_path(self, file: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(os.path.abspath(file).encode()).hexdigest() + ".json")
+
+    def get(self, file: str, optimize: bool = False) -> dict | None:
+        '''the entry of file if it was compiled from the same source by the same compiler in the same mode'''
+        with open(file, "rb") as f:
+            source = hashlib.sha256(f.read()).hexdigest()
+        try:
+            with open(self._entry_path(file), "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            entry = None
+        if entry is None or (entry["source"], entry["version"], entry["optimize"]) != (source, self.version, optimize):
+            self.misses += 1
+            return None
+        return entry
+
+    def put(self, file: str, optimize: bool, vm: str, signatures: list, depends: dict[str, list]):
+        with open(file, "rb") as f:
+            source = hashlib.sha256(f.read()).hexdigest()
+        entry = {
+            "source": source,
+            "version": self.version,
+            "optimize": optimize,
+            "vm": vm,
+            "signatures": signatures,
+            "depends": depends,
+        }
+        _replace(self._entry_path(file), json.dumps(entry))
+
+    def report(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, {self.invalidated} invalidated by signature changes"
+
+def build(src: list[str], jobs: int = 1, cache: CompileCache = None, optimize: bool = False) -> list[str | None]:
+    '''
+    compiles every file of src, in that many worker processes if jobs > 1. Classes compile on
+    their own so every file is tried, returns the error of each file in the order of src, None
+    for the ones that compiled.
+    With a cache the classes whose source changed are compiled first, then the unchanged ones
+    that call a class whose signatures changed, the rest get their .vm from the cache
+    '''
+    results = [None] * len(src)
+    entries = [cache.get(file, optimize) for file in src] if cache else [None] * len(src)
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    for i, result in zip(missing, _compile_all([src[i] for i in missing], jobs, optimize)):
+        results[i] = result
+    # signatures of the classes in this build by (directory, class), the classes of a program
+    # are the files in one directory. A class that failed to compile has none
+    signatures = {}
+    for i, file in enumerate(src):
+        entry, result = entries[i], results[i]
+        if entry is not None or result[0] is None:
+            signatures[_class(file)] = entry["signatures"] if entry else result[1]
+    stale = [
+        i for i, entry in enumerate(entries)
+        if entry is not None
+        and any(signatures.get(_class(src[i], name)) != used for name, used in entry["depends"].items())
+    ]
+    for i, result in zip(stale, _compile_all([src[i] for i in stale], jobs, optimize)):
+        entries[i], results[i] = None, result
+    if cache:
+        cache.invalidated += len(stale)
+    errors = []
+    for file, entry, result in zip(src, entries, results):
+        vm = pathlib.Path(file).with_suffix(".vm")
+        if entry is not None:
+            cache.hits += 1
+            if not vm.is_file() or vm.read_text() != entry["vm"]:
+                vm.write_text(entry["vm"])
+            errors.append(None)
+            continue
+        error, exported, calls = result
+        if error is None and cache:
+            depends = {name: signatures.get(_class(file, name)) for name in calls if name != pathlib.Path(file).stem}
+            cache.put(file, optimize, vm.read_text(), exported, depends)
+        errors.append(error)
+    return errors
+
+def _replace(path: str, data: str | bytes):
+    '''writes data next to path and renames it over path, a reader sees the old file or the new one'''
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _class(file: str, name: str = None) -> tuple[str, str]:
+    '''the class a file declares, or the class name in the program of the file'''
+    path = pathlib.Path(os.path.abspath(file))
+    return (str(path.parent), name or path.stem)
+
+def _compile_all(src: list[str], jobs: int, optimize: bool) -> list[tuple]:
+    if jobs > 1 and len(src) > 1:
+        with ProcessPoolExecutor(min(jobs, len(src))) as pool:
+            return list(pool.map(_compile, src, [optimize] * len(src)))
+    return [_compile(file, optimize) for file in src]
+
+def _compile(path: str, optimize: bool = False) -> tuple[str | None, list, list]:
+    '''
+    compiles one file in a worker process or not, returns (error, signatures, called classes).
+    a failed file leaves no .vm behind
+    '''
+    try:
+        signatures, calls = compile(path, optimize)
+    except Exception as e:
+        pathlib.Path(path).with_suffix(".vm").unlink(missing_ok=True)
+        return (f"{type(e).__name__}: {e}" if str(e) else type(e).__name__, [], [])
+    return (None, signatures, calls)
+
+def compile(path: str, optimize: bool = False) -> tuple[list, list]:
     '''
     Takes a single .jack file as a path paramenter and outputs a compiled .vm file in the same directory
     path: path to the .jack file to be compiled
+    optimize: fold constant expressions and replace multiplications by constants
+    returns the [kind, name] of every subroutine the class declares and the classes it calls
     '''
     with open(path, "r") as f:
         tokenizer = JackTokenizer(f)
         p = pathlib.Path(path)
         p = p.with_suffix(".vm")
         with VMWriter(p) as vmwriter:
-            ce = CompilationEngine(tokenizer, vmwriter)
+            ce = CompilationEngine(tokenizer, vmwriter, optimize)
             ce.compile_class()
+    return [list(signature) for signature in ce.signatures], sorted(ce.calls)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import sys
+
+import pytest
+import compiler
+import CompilationEngine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "08"))
+import vmemulator  # noqa: E402
+
+
+def copy_program(tmp_path, program: str) -> list[str]:
+    for file in glob.glob(os.path.join(HERE, program, "*.jack")):
+        shutil.copy(file, tmp_path)
+    return compiler.sources([str(tmp_path)])
+
+
+class TestCompiler:
+    def test_jobs(self, tmp_path):
+        src = copy_program(tmp_path, "Pong")
+        assert compiler.build(src, jobs=2) == [None] * 4
+        for file in src:
+            vm = os.path.basename(file)[:-5] + ".vm"
+            with open(os.path.join(HERE, "Pong", vm), "r") as f:
+                assert (tmp_path / vm).read_text() == f.read()
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_errors(self, tmp_path, monkeypatch, capsys, jobs):
+        copy_program(tmp_path, "Square")
+        (tmp_path / "Broken.jack").write_text("class Broken {\n    function void f() {\n        var int x;\n        let x = ;\n    }\n}\n")
+        (tmp_path / "Member.jack").write_text("class Member { int x; }")
+        monkeypatch.setattr(sys, "argv", ["compiler.py", "--jobs", str(jobs), "--input", str(tmp_path)])
+        with pytest.raises(SystemExit) as exit:
+            compiler.main()
+        assert exit.value.code == 1
+        assert capsys.readouterr().err.splitlines() == [
+            f"{tmp_path / 'Broken.jack'}: UnexpectedTokenType: Expected identifier - ';'",
+            f"{tmp_path / 'Member.jack'}: Exception: Unknown class member - int",
+            "2 of 5 files failed to compile",
+        ]
+        # the files that failed leave nothing behind, the others compiled
+        assert sorted(path.name for path in tmp_path.glob("*.vm")) == ["Main.vm", "Square.vm", "SquareGame.vm"]
+
+    def test_cache(self, tmp_path):
+        program = tmp_path / "Square"
+        program.mkdir()
+        src = copy_program(program, "Square")
+        cache = compiler.CompileCache(str(tmp_path / "cache"))
+
+        def stats():
+            return cache.hits, cache.misses, cache.invalidated
+
+        assert compiler.build(src, cache=cache) == [None] * 3
+        assert stats() == (0, 3, 0)
+        (program / "Main.vm").unlink()
+        compiler.build(src, cache=cache)
+        assert stats() == (3, 3, 0)
+        with open(os.path.join(HERE, "Square", "Main.vm"), "r") as f:
+            assert (program / "Main.vm").read_text() == f.read()
+        # a new body only recompiles the class itself
+        square = (program / "Square.jack").read_text()
+        (program / "Square.jack").write_text(square.replace("let size = asize;", "let size = asize + 0;"))
+        compiler.build(src, cache=cache)
+        assert stats() == (5, 4, 0)
+        # a new subroutine recompiles SquareGame that calls Square, not Main that does not
+        (program / "Square.jack").write_text(square.replace("class Square {", "class Square {\n    function int two() { return 2; }"))
+        compiler.build(src, cache=cache)
+        assert stats() == (6, 5, 1)
+        assert "function Square.two 0" in (program / "Square.vm").read_text()
+
+
+def compile_main(tmp_path, body: str, optimize: bool) -> list[str]:
+    """compiles a Main class around body, returns its VM commands"""
+    path = tmp_path / ("optimized" if optimize else "plain")
+    path.mkdir(exist_ok=True)
+    (path / "Main.jack").write_text("class Main {\n" + body + "\n}\n")
+    compiler.compile(str(path / "Main.jack"), optimize)
+    return (path / "Main.vm").read_text().splitlines()
+
+
+class TestOptimize:
+    def test_fold(self):
+        word = 0xFFFF
+        assert CompilationEngine.fold("*", 300, 300) == 90000 & word
+        assert CompilationEngine.fold("/", -7 & word, 2) == -3 & word
+        assert CompilationEngine.fold("/", 7, -2 & word) == -3 & word
+        assert CompilationEngine.fold("/", 5, 0) is None
+        assert CompilationEngine.fold("<", -1 & word, 1) == word
+        assert CompilationEngine.fold("-", 0, 1) == word
+
+    def test_constants(self, tmp_path):
+        body = "function int f() { return 1 + (2 * 3) - (-4 / 2); }"
+        assert compile_main(tmp_path, body, True)[1:3] == ["push constant 9", "return"]
+        body = "function int f() { return ~0; }"
+        assert compile_main(tmp_path, body, True)[1:4] == ["push constant 1", "neg", "return"]
+        # left to Sys.error
+        body = "function int f() { return 5 / 0; }"
+        assert "call Math.divide 2" in compile_main(tmp_path, body, True)
+
+    def test_identities(self, tmp_path):
+        body = "function int f(int x) { return (((0 + x) * 1) - 0) & true; }"
+        assert compile_main(tmp_path, body, True)[1:3] == ["push argument 0", "return"]
+
+    def test_add_chain(self, tmp_path):
+        body = "function int f(int x) { return x * 8; }"
+        code = compile_main(tmp_path, body, True)
+        assert "call Math.multiply 2" not in code and code.count("add") == 3
+        body = "function int f(int x) { return x * 1000; }"
+        assert "call Math.multiply 2" in compile_main(tmp_path, body, True)
+
+    def test_same_results(self, tmp_path):
+        body = "\n".join(
+            [
+                "function void main() { return; }",
+                "function int f(int x) {",
+                "    var int y;",
+                "    let y = x * 3 + (x * 0) + (5 * x) + (x * 7) + (x * 8) - (25 * x) + (x * (-50)) + (x * 256);",
+                "    let y = y + (7 - x) - (x * 1000) + ((x * 2) / 3) + (100 / (x | 1)) + (x / (-3));",
+                "    return y + (x < 3) + (-2 > x) + (x = (2 * 2)) + (x & 12) + (3 | x);",
+                "}",
+            ]
+        )
+        machines = []
+        for optimize in (False, True):
+            compile_main(tmp_path, body, optimize)
+            path = tmp_path / ("optimized" if optimize else "plain")
+            vm = vmemulator.VirtualMachine(vmemulator.collect(str(path)))
+            vm.run(10_000_000)
+            assert vm.halted
+            machines.append(vm)
+        for x in [0, 1, 2, 3, 4, -1, -7, 100, 1000, 32767, -32768, 12345, -23456]:
+            assert machines[0].call("Main.f", x & 0xFFFF) == machines[1].call("Main.f", x & 0xFFFF), x
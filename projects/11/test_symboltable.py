@@ -0,0 +1,37 @@
+import pytest
+from SymbolTable import IdentifierKind, SymbolTable
+
+
+class TestSymbolTable:
+    def test_indexes_per_kind(self):
+        table = SymbolTable()
+        table.define("a", "int", IdentifierKind.FIELD)
+        table.define("b", "Point", "static")
+        table.define("c", "char", IdentifierKind.FIELD)
+        c = table.lookup("c")
+        assert (c.kind, c.type, c.index) == (IdentifierKind.FIELD, "char", 1)
+        assert table.kind_of("b") == IdentifierKind.STATIC and table.index_of("b") == 0
+        assert (table.var_count(IdentifierKind.FIELD), table.var_count(IdentifierKind.VAR)) == (2, 0)
+
+    def test_scopes(self):
+        fields = SymbolTable()
+        fields.define("x", "int", IdentifierKind.FIELD)
+        fields.define("y", "int", IdentifierKind.FIELD)
+        locals = SymbolTable(fields)
+        locals.define("x", "Array", IdentifierKind.VAR)
+        assert locals.lookup("x").kind == IdentifierKind.VAR
+        assert locals.lookup("y").kind == IdentifierKind.FIELD
+        assert locals.lookup("z") is None
+        locals.reset()
+        assert locals.lookup("x").kind == IdentifierKind.FIELD
+        assert locals.var_count(IdentifierKind.VAR) == 0
+
+    def test_errors(self):
+        table = SymbolTable()
+        symbol = table.define("a", "int", IdentifierKind.ARG)
+        with pytest.raises(AttributeError):
+            symbol.index = 3
+        with pytest.raises(Exception, match="SymbolRedefined - a"):
+            table.define("a", "int", IdentifierKind.VAR)
+        with pytest.raises(Exception, match="SymbolNotFound - b"):
+            table.type_of("b")
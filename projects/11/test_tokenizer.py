@@ -0,0 +1,74 @@
+import glob
+import io
+import os
+import shutil
+
+import pytest
+import compiler
+from Tokenizer import JackTokenizer, TokenType
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS = ["Average", "ComplexArrays", "ConvertToBin", "Pong", "Seven", "Square"]
+
+
+def tokens(source: str) -> list[tuple[str, TokenType]]:
+    tokenizer = JackTokenizer(io.StringIO(source))
+    result = []
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+        if tokenizer.current_token:
+            result.append((tokenizer.current_token, tokenizer.token_type()))
+    return result
+
+
+class TestTokenizer:
+    def test_tokens(self):
+        source = 'class Main { // comment\n/** doc\n */ let x[2]=-classy+"a, b";}'
+        assert tokens(source) == [
+            ("class", TokenType.KEYWORD),
+            ("Main", TokenType.IDENTIFIER),
+            ("{", TokenType.SYMBOL),
+            ("let", TokenType.KEYWORD),
+            ("x", TokenType.IDENTIFIER),
+            ("[", TokenType.SYMBOL),
+            ("2", TokenType.INT_CONST),
+            ("]", TokenType.SYMBOL),
+            ("=", TokenType.SYMBOL),
+            ("-", TokenType.SYMBOL),
+            ("classy", TokenType.IDENTIFIER),
+            ("+", TokenType.SYMBOL),
+            ('"a, b"', TokenType.STRING_CONST),
+            (";", TokenType.SYMBOL),
+            ("}", TokenType.SYMBOL),
+        ]
+
+    def test_string_starting_with_symbol(self):
+        assert tokens('do f("(x)");')[2:4] == [("(", TokenType.SYMBOL), ('"(x)"', TokenType.STRING_CONST)]
+
+    def test_peek(self):
+        tokenizer = JackTokenizer(io.StringIO("a . b ( )"))
+        assert tokenizer.peek() == "a"
+        tokenizer.advance()
+        assert (tokenizer.current_token, tokenizer.peek(), tokenizer.peek(3), tokenizer.peek(5)) == ("a", ".", "(", "")
+        assert tokenizer.current_token == "a"
+
+    def test_end_without_newline(self):
+        tokenizer = JackTokenizer(io.StringIO("}"))
+        tokenizer.advance()
+        assert tokenizer.has_more_tokens()
+        tokenizer.advance()
+        assert tokenizer.current_token == ""
+        assert not tokenizer.has_more_tokens()
+
+    def test_unexpected_character(self):
+        with pytest.raises(Exception, match="Unexpected character - '#' \\(line 2\\)"):
+            JackTokenizer(io.StringIO("class A {\n#}"))
+
+    @pytest.mark.parametrize("program", PROGRAMS)
+    def test_compiles_the_same(self, tmp_path, program):
+        for file in glob.glob(os.path.join(HERE, program, "*.jack")):
+            shutil.copy(file, tmp_path)
+            compiler.compile(str(tmp_path / os.path.basename(file)))
+            vm = os.path.basename(file)[:-5] + ".vm"
+            with open(os.path.join(HERE, program, vm), "r") as f:
+                assert (tmp_path / vm).read_text() == f.read()